@@ -1,4 +1,3 @@
-import torchvision
 from pathlib import Path
 from pyanomaly.config import update_config
 
@@ -9,6 +8,8 @@ from pyanomaly.utils import(
     get_tensorboard
 )
 
+from pyanomaly.core.engine.streaming import FileFrameSource
+
 from pyanomaly import (
     ModelAPI,
     EngineAPI,
@@ -61,7 +62,8 @@ def main(args, cfg, logger, cfg_name, time_stamp, is_training):
                     )
     logger.info('Finish initializing the model')
     
-    video, video_info = torchvision.io.read_video(video_path)
+    # the frames are pushed into the service one by one, as a live feed
+    video = FileFrameSource(video_path)
     # import ipdb; ipdb.set_trace()
     result_dict = service.execute(video)
     
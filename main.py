@@ -8,6 +8,8 @@ from pyanomaly.utils import(
     get_tensorboard
 )
 
+from pyanomaly.core.engine.launch import launch
+
 from pyanomaly import (
     ModelAPI,
     LossAPI,
@@ -90,6 +92,20 @@ def main(args, cfg, logger, writer_dict, cfg_name, time_stamp, log_file_name, is
     logger.info(f'The model path is {model_result_path}')
    
 
+def launch_main(args, cfg, cfg_path, root_path, phase):
+    """The function executed in each process.
+    """
+    logger, final_output_dir, tensorboard_log_dir, cfg_name, time_stamp, log_file_name = create_logger(root_path, cfg, args.cfg_name, phase=phase, verbose=args.verbose)  # dataset_name, model_name, cfg_name, time_stamp will decide the all final name such that of the model, results, tensorboard, log.
+    logger.info(f'^_^==> Use the following tensorboard:{tensorboard_log_dir}')
+    logger.info(f'@_@==> Use the following config in path: {cfg_path}')
+    logger.info(f'the configure name is {cfg_name}, the content is:\n{cfg}')
+    # Get the Summary writer 
+    writer_dict = get_tensorboard(tensorboard_log_dir, time_stamp, cfg.MODEL.name, log_file_name)
+    # main(args, cfg, logger, tensorboard_log_dir, cfg_name, time_stamp, log_file_name, is_training=args.train)
+    main(args, cfg, logger, writer_dict, cfg_name, time_stamp, log_file_name, is_training=args.train)
+    logger.info(f'Finish {phase} the whole process!!!')
+
+
 if __name__ == '__main__':
     args = parse_args()
     # Get the root path of the project
@@ -100,12 +116,10 @@ if __name__ == '__main__':
     cfg = update_config(cfg_path, args.opts)
     phase = 'train' if args.train else 'inference'
 
-    logger, final_output_dir, tensorboard_log_dir, cfg_name, time_stamp, log_file_name = create_logger(root_path, cfg, args.cfg_name, phase=phase, verbose=args.verbose)  # dataset_name, model_name, cfg_name, time_stamp will decide the all final name such that of the model, results, tensorboard, log.
-    logger.info(f'^_^==> Use the following tensorboard:{tensorboard_log_dir}')
-    logger.info(f'@_@==> Use the following config in path: {cfg_path}')
-    logger.info(f'the configure name is {cfg_name}, the content is:\n{cfg}')
-    # Get the Summary writer 
-    writer_dict = get_tensorboard(tensorboard_log_dir, time_stamp, cfg.MODEL.name, log_file_name)
-    # main(args, cfg, logger, tensorboard_log_dir, cfg_name, time_stamp, log_file_name, is_training=args.train)
-    main(args, cfg, logger, writer_dict, cfg_name, time_stamp, log_file_name, is_training=args.train)
-    logger.info(f'Finish {phase} the whole process!!!')
+    # launch the processes of the distributed training, it is the same as launch_main(...) when only using one process
+    dist_cfg = cfg.SYSTEM.distributed
+    num_processes = dist_cfg.num_processes if dist_cfg.use else 1
+    num_machines = dist_cfg.num_machines if dist_cfg.use else 1
+    init_method = args.init_method if num_machines > 1 else None
+    launch(launch_main, num_processes, num_machines=num_machines, machine_rank=dist_cfg.machine_rank, backend=dist_cfg.backend, init_method=init_method, 
+           args=(args, cfg, cfg_path, root_path, phase))
@@ -16,6 +16,7 @@ config.SYSTEM = CN()
 # config.SYSTEM.num_gpus = 1    # decide the num_gpus  # will be deprecated in the future 
 # Configure the number of gpus, and whether use the  parallell training 
 config.SYSTEM.gpus = [0]
+config.SYSTEM.device = 'cuda' # 'cuda' | 'cpu', the device of the models and the data
 
 config.SYSTEM.cudnn = CN()
 config.SYSTEM.cudnn.benchmark = True
@@ -25,6 +26,22 @@ config.SYSTEM.cudnn.enable = True
 # about use the distributed
 config.SYSTEM.distributed = CN()
 config.SYSTEM.distributed.use = False
+config.SYSTEM.distributed.backend = 'gloo' # 'gloo' for the cpu, 'nccl' for the gpus
+config.SYSTEM.distributed.num_processes = 1 # the number of processes launched on this machine, the TRAIN.batch_size is the batch size of each process
+config.SYSTEM.distributed.num_machines = 1
+config.SYSTEM.distributed.machine_rank = 0
+config.SYSTEM.distributed.shard_eval = True # each process evaluates a part of the val videos(balanced by the frames), and the scores are gathered on the first process
+# about the threads and the cores on the cpu
+config.SYSTEM.runtime = CN()
+config.SYSTEM.runtime.use = True # plan the threads, the data workers and the core affinity when SYSTEM.device is cpu
+config.SYSTEM.runtime.num_workers = 0 # the cores kept for the data workers, each one gets a physical core. -1 means planning it by the number of the cores. The video datasets read the clips in the main process(the cursors of the videos are not shared with the workers), so it is 0 for them
+config.SYSTEM.runtime.interop_threads = 1 # the inter-op threads of torch
+config.SYSTEM.runtime.use_smt = False # use the hyper-threads as the compute threads, otherwise one thread on each physical core
+config.SYSTEM.runtime.pin = True # pin the process and the data workers to their cores
+config.SYSTEM.runtime.auto_tune = CN()
+config.SYSTEM.runtime.auto_tune.use = False # time the first training steps with each candidate plan and keep the fastest one
+config.SYSTEM.runtime.auto_tune.steps = 5 # the timed steps of each plan
+config.SYSTEM.runtime.auto_tune.warmup = 1 # the steps which are not timed after changing the plan
 # configure the log things
 config.LOG = CN()
 config.LOG.log_output_dir = './output/log' # log 
@@ -58,6 +75,7 @@ config.DATASET.val.sampled_clip_length = 5
 config.DATASET.val.frame_step = 1
 config.DATASET.val.clip_step = 1
 config.DATASET.val.gt_path = ''
+config.DATASET.gt_cache_dir = './output/gt_cache' # the directory of the compiled ground truth, '' means parsing the label files every time
 config.DATASET.number_of_class = 1 # use in changing the label to one hot
 config.DATASET.score_normalize = False
 config.DATASET.score_type = 'normal' # 'normal' | 'abnormal'
@@ -66,6 +84,9 @@ config.DATASET.decidable_idx_back = 1 # The back decidable frame idx
 config.DATASET.smooth = CN()
 config.DATASET.smooth.guassian = False
 config.DATASET.smooth.guassian_sigma = [10]
+config.DATASET.smooth.causal = False # smooth with the causal kernel(the same as SERVICE.smoothing) instead of the gaussian_filter1d, the sigmas are DATASET.smooth.guassian_sigma
+config.DATASET.smooth.kernel = 'gaussian' # the causal kernel, 'exponential' | 'gaussian'
+config.DATASET.smooth.lag = 0 # the frames after the smoothed frame used by the causal kernel
 config.DATASET.mini_dataset = CN() 
 config.DATASET.mini_dataset.samples = 2
 config.DATASET.evaluate_function = CN()
@@ -208,7 +229,7 @@ config.MODEL.auxiliary.pose.MODEL.EXTRA.FINAL_CONV_KERNEL = 1
 config.MODEL.auxiliary.tracker = CN()
 config.MODEL.auxiliary.tracker.require_grad = False
 config.MODEL.auxiliary.tracker.name = ''
-config.MODEL.auxiliary.tacker.model_path = ''
+config.MODEL.auxiliary.tracker.model_path = ''
 
 # configure the training process
 #-----------------basic-----------------
@@ -218,12 +239,23 @@ config.TRAIN.batch_size = 2
 config.TRAIN.start_step = 0
 config.TRAIN.max_steps = 20000  # epoch * len(dataset)
 config.TRAIN.dynamic_steps = [0, 50, 100]
+config.TRAIN.accumulate_steps = 1 # the number of the micro-batches(TRAIN.batch_size) accumulated in one update, the effective batch size is batch_size * accumulate_steps. The steps(max_steps, log_step, eval_step, ...) count the micro-batches, the lr schedulers count the updates
 config.TRAIN.log_step = 5  # the step to print the info
 config.TRAIN.vis_step = 100  # the step to vis of the training results
 # =========================================Will be deprecated in the future, because we don't need the minieval anymore===================================================
 config.TRAIN.mini_eval_step = 100 # the step to exec the light-weight eval
 # ============================================================================================================================
 config.TRAIN.eval_step = 100 # the step to use the evaluate function
+config.TRAIN.prefetch = CN()
+config.TRAIN.prefetch.use = False # prepare the next batches and the outputs of the frozen models(e.g. F, Detector) in a background thread while the step trains
+config.TRAIN.prefetch.depth = 1 # the number of the batches prepared ahead
+config.TRAIN.eval_async = CN()
+config.TRAIN.eval_async.use = False # evaluate in a background process forked at the evaluation step(a thread with the copies of the trainable models on the gpu), the training does not wait for it
+config.TRAIN.eval_async.max_staleness = 1 # the max number of the evaluations running behind the training, the training waits when it is reached
+config.TRAIN.async_save = CN()
+config.TRAIN.async_save.use = False # copy the state dicts to the cpu and write the checkpoints in a background thread
+config.TRAIN.async_save.max_pending = 2 # the max number of the checkpoints waiting to be written, the training waits when it is reached
+config.TRAIN.checkpoint_format = 'torch' # 'torch' | 'fast', the fast format is memory-mapped and only the used networks are loaded
 config.TRAIN.save_step = 500  # the step to save the model
 config.TRAIN.epochs = 1
 # configure the resume
@@ -310,11 +342,78 @@ config.VAL.path = '' # if not use the data in the DATASET.val.data_path
 config.VAL.batch_size = 1
 config.VAL.model_file = ''
 config.VAL.result_output = './output/results'
+config.VAL.result_format = 'pickle' # 'pickle' | 'columnar', the columnar results are memory-mapped when loading
+#-------------------parallel evaluation--------------
+config.VAL.parallel = CN()
+config.VAL.parallel.num_workers = 1 # the number of processes evaluating the videos at the same time on the cpu, 1 means evaluating the videos one by one
+config.VAL.parallel.threads_per_worker = 0 # the torch threads(and the pinned cores) of each process, 0 means sharing the cores equally
+config.VAL.parallel.pin_cores = True # pin each process to its own cores
+#-------------------online evaluation--------------
+config.VAL.online_eval = CN()
+config.VAL.online_eval.num_bins = 1000 # the number of bins in the score histograms
+config.VAL.online_eval.score_range = [0.0, 1.0] # the range of the scores, the normalized scores are in [0, 1]
+config.VAL.online_eval.log_interval = 0 # log the approximate metrics every N videos, 0 means not log
+config.VAL.adaptive_stride = CN()
+config.VAL.adaptive_stride.use = False # score every stride-th window and interpolate the others, the windows around the rising scores are all scored
+config.VAL.adaptive_stride.stride = 4 # the coarse stride of the windows
+config.VAL.adaptive_stride.dense_window = 8 # the number of the windows after the rising score which are all scored
+config.VAL.adaptive_stride.sigma = 2.0 # the score rises when it is more abnormal than the mean + sigma * std of the scores before it
+config.VAL.adaptive_stride.warmup = 5 # the number of the coarse scores before the threshold is used
 
 # configure the service function
 config.SERVICE = CN()
 config.SERVICE.use = False
 config.SERVICE.engine_name = 'BaseService'
+config.SERVICE.threshold = 0.0 # the frame is the anomaly when its score is larger than it, the scores are the raw values of the model(higher means more abnormal)
+config.SERVICE.latency_window = 1000 # the number of the latest frames used by the latency summary
+config.SERVICE.log_interval = 0 # log the latency every N scored frames, 0 means not log
+config.SERVICE.stateful = False # the recurrent model(AnoPCN) carries its state across the frames of each stream, two steps per frame instead of the whole window. The state is re-seeded every clip_length - 1 frames, so it holds the last clip_length - 1 to 2 * (clip_length - 1) - 1 frames, and the scores are the same as the windowed ones on every (clip_length - 1)-th frame
+config.SERVICE.incremental = CN()
+config.SERVICE.incremental.use = False # the 3D-conv encoder(STAE, MemAE) reuses the temporal slices of the feature maps of the windows before, also in the batches of the MicroBatchScheduler
+config.SERVICE.incremental.mode = 'exact' # 'exact': only reuse the slices not touched by the zero padding | 'approximate': also reuse the slices touched by the left padding, the features are different from the windowed ones
+config.SERVICE.motion_gate = CN()
+config.SERVICE.motion_gate.use = False # skip the model on the static frames
+config.SERVICE.motion_gate.threshold = 0.01 # the frame is static if the mean absolute difference with the last scored frame(the downsampled gray frames in [0, 1]) is lower than it
+config.SERVICE.motion_gate.size = 32 # the side of the downsampled gray frame
+config.SERVICE.motion_gate.max_skip = 0 # score the frame after N static frames in a row, 0 means no limit
+config.SERVICE.motion_gate.mode = 'carry' # the score of the static frame, 'carry': the last score | 'baseline': SERVICE.motion_gate.baseline
+config.SERVICE.motion_gate.baseline = 0.0
+config.SERVICE.adaptive_stride = CN()
+config.SERVICE.adaptive_stride.use = False # score every stride-th frame and keep the last score on the others, the frames after the rising scores are all scored
+config.SERVICE.adaptive_stride.stride = 4
+config.SERVICE.adaptive_stride.dense_window = 8
+config.SERVICE.adaptive_stride.sigma = 2.0
+config.SERVICE.adaptive_stride.warmup = 5
+config.SERVICE.smoothing = CN()
+config.SERVICE.smoothing.use = False # smooth the scores of each stream with the causal kernel, the is_anomaly uses the smoothed score
+config.SERVICE.smoothing.kernel = 'exponential' # 'exponential': exp(-|d|/sigma) | 'gaussian': the truncated half-Gaussian, d is the distance in frames
+config.SERVICE.smoothing.sigma = 5.0 # the time constant of the exponential kernel or the std of the gaussian kernel, in frames
+config.SERVICE.smoothing.lag = 0 # the fixed-lag mode, the smoothed score of a frame is given `lag` frames later and uses the scores after it
+config.SERVICE.smoothing.truncate = 3.0 # the kernel is truncated at truncate * sigma frames before the smoothed frame
+config.SERVICE.batching = CN()
+config.SERVICE.batching.max_batch_size = 8 # the max number of the windows(from all of the streams) scored in one forward
+config.SERVICE.batching.max_wait = 0.01 # the max seconds the first window of a batch waits for the others
+config.SERVICE.ingest = CN()
+config.SERVICE.ingest.decode_workers = 4 # the threads which decode and buffer the frames of the asyncio sources
+config.SERVICE.ingest.max_pending = 64 # the max number of the frames submitted but not scored, the sources wait when it is reached
+config.SERVICE.ingest.poll_interval = 0.5 # the seconds between two scans of the watched directory
+
+# configure the cascade of two models, used by the CascadeInference
+config.CASCADE = CN()
+config.CASCADE.cheap = CN()
+config.CASCADE.cheap.cfg_file = '' # the config of the cheap stage, '' means the model of this config
+config.CASCADE.cheap.engine_name = 'STAEService' # the service engine which scores the windows of the stage
+config.CASCADE.cheap.model_file = ''
+config.CASCADE.expensive = CN()
+config.CASCADE.expensive.cfg_file = '' # the config of the expensive stage
+config.CASCADE.expensive.engine_name = 'AMCService'
+config.CASCADE.expensive.model_file = ''
+config.CASCADE.escalate_ratio = 0.1 # the ratio of the frames with the highest cheap scores in each video, the segments around them are scored by the expensive stage
+config.CASCADE.segment_length = 16 # the number of the frames in the segment around each escalated frame
+config.CASCADE.fusion = 'weighted' # 'weighted': (1-weight)*cheap + weight*expensive on the escalated frames | 'max' | 'replace'
+config.CASCADE.weight = 0.5
+config.CASCADE.batch_size = 8 # the number of the windows in one forward
+config.CASCADE.compare_stages = True # also score all of the frames with the expensive stage, to report the AUC and the cost of each stage alone
 
 def _get_cfg_defaults():
     """
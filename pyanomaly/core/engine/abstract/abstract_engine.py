@@ -86,6 +86,22 @@ class AbstractEngine(object):
         gpus = [int(i) for i in self.engine_gpus]
         return torch.nn.DataParallel(model.cuda(), device_ids=gpus)
 
+    def distributed_parallel(self, model):
+        """Parallel the models among the processes.
+        Using torch.nn.parallel.DistributedDataParallel, the models without the trainable parameters(e.g. the fixed flow networks) are not wrapped.
+        Args:
+            model: torch.nn.Module
+        Returns:
+            model_parallel
+        """
+        model = model.to(self.device)
+        if not any(p.requires_grad for p in model.parameters()):
+            return model
+        logger.info('<!_!> ==> Distributed Data Parallel')
+        device_ids = [self.device.index] if self.device.type == 'cuda' else None
+        # not broadcast the buffers in the forward, so one process can run the evaluation alone
+        return torch.nn.parallel.DistributedDataParallel(model, device_ids=device_ids, broadcast_buffers=False)
+
 
     def _load_file(self, model_keys, model_file):
         """Method to load the data into pytorch structure.
@@ -127,9 +143,9 @@ class AbstractEngine(object):
                     getattr(self, item).load_state_dict(saved_model_file)
         
         # import ipdb; ipdb.set_trace()
-        parallel_flag = self.kwargs['parallel']
         for item in model_keys:
             item = str(item)
+            parallel_flag = self.kwargs['parallel'] or isinstance(getattr(self, item), torch.nn.parallel.DistributedDataParallel)
             if 'state_dict' in model_file.keys():
                 logger.info('\033[5;31m!! Directly use the file, the state_dict is in file\033[0m')
                 # getattr(self, item).load_state_dict(model_file['state_dict'])
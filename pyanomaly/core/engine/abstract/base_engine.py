@@ -2,13 +2,26 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
+import time
 import torch
 import abc
 import logging
+import numpy as np
 from collections import OrderedDict, namedtuple
 
 from pyanomaly.core.utils import AverageMeter, ParamSet
-from ..utils import engine_save
+from pyanomaly.datatools.dataclass.sampler import DataStream
+from ..utils import engine_save, CheckpointWriter
+from ..checkpoint import load_checkpoint
+from ..prefetch import BatchPrefetcher
+from ..streaming import LatencyRecorder, StreamState, StreamResult
+from ..motion_gate import build_motion_gate
+from ..adaptive_stride import build_adaptive_stride
+from pyanomaly.datatools.evaluate.smoothing import build_smoother, smooth_scores
+from ..accumulate import AccumulateState, AccumulateOptimizer, AccumulateScheduler, accumulate_context
+from ..launch import get_device, is_distributed
+from pyanomaly.datatools.dataclass.sampler.common import is_main_process
+from pyanomaly.utils.runtime import get_runtime_tuner
 from .abstract_engine import AbstractTrainer, AbstractInference, AbstractService
 
 logger = logging.getLogger(__name__)
@@ -54,15 +67,21 @@ class BaseTrainer(AbstractTrainer):
         # self._eval_hooks = []
         self._register_hooks(kwargs['hooks'])
         # logger & config
-        # self.logger = defaults[4]
+        self.logger = kwargs.get('logger', logger)
         self.config = kwargs['config']
 
         # devices
         self.engine_gpus = self.config.SYSTEM.gpus
+        self.device = get_device(self.config)
+        self.distributed = is_distributed(self.config)
+        # compare the cpu runtime plans with the first training steps
+        self.runtime_tuner = get_runtime_tuner() if self.device.type == 'cpu' else None
 
          # set the configuration of the saving process
         save_cfg_template = namedtuple('save_cfg_template', ['output_dir', 'low',  'cfg_name', 'dataset_name', 'model_name', 'time_stamp'])
         self.save_cfg = save_cfg_template(output_dir=self.config.TRAIN.checkpoint_output, low=0.0, cfg_name=kwargs['config_name'], dataset_name=self.config.DATASET.name, model_name=self.config.MODEL.name, time_stamp=kwargs['time_stamp'])
+        # write the checkpoints once and in the background if async_save is used
+        self.checkpoint_writer = CheckpointWriter(async_write=self.config.TRAIN.async_save.use, max_pending=self.config.TRAIN.async_save.max_pending, file_format=self.config.TRAIN.checkpoint_format)
 
         self.model = kwargs['model_dict']
         
@@ -72,7 +91,12 @@ class BaseTrainer(AbstractTrainer):
         dataloaders_dict = kwargs['dataloaders_dict']
         self._dataloaders_dict = dataloaders_dict
         self.train_dataloaders_dict = dataloaders_dict['train']
-        self._train_loader_iter = iter(self.train_dataloaders_dict['general_dataset_dict']['all'])
+        # count the used batches, so the position of the data can be saved in the checkpoint
+        self.data_stream = DataStream(self.train_dataloaders_dict['general_dataset_dict']['all'])
+        self._train_loader_iter = self.data_stream
+        # prepare the next batches and the outputs of the frozen models in the background
+        if self.config.TRAIN.prefetch.use:
+            self._train_loader_iter = BatchPrefetcher(self.data_stream, prepare=self._prepare_batch, device=self.device, depth=self.config.TRAIN.prefetch.depth)
         # temporal, but it is wrong !!!
         self.val_dataloaders_dict = dataloaders_dict['val']
         self.val_dataset_keys = list(dataloaders_dict['val']['general_dataset_dict'].keys())
@@ -113,28 +137,54 @@ class BaseTrainer(AbstractTrainer):
         # self.saved_optimizer = OrderedDict()
         # self.saved_loss = OrderedDict()
         self.saved_stuff = OrderedDict()
+        self.resume_step = None
 
         # Get the models
         for item_key in self.model.keys():
             attr_name = str(item_key)
             if self.kwargs['parallel']:
                 temp_model = self.data_parallel(self.model[item_key])
+            elif self.distributed:
+                temp_model = self.distributed_parallel(self.model[item_key])
             else:
-                temp_model = self.model[item_key].cuda()
+                temp_model = self.model[item_key].to(self.device)
             self.__setattr__(attr_name, temp_model)
         
+        # accumulate the gradients of the micro-batches, the optimizers and the schedulers are updated once in accumulate_steps steps
+        self.accumulate_state = AccumulateState(self.config.TRAIN.accumulate_steps)
+        if self.accumulate_state.accumulate_steps > 1:
+            logger.info(f'Accumulate {self.accumulate_state.accumulate_steps} micro-batches in each update, '
+                        f'the effective batch size:{self.config.TRAIN.batch_size * self.accumulate_state.accumulate_steps}')
+
         # get the optimizer
         for item_key in self.optimizer.keys():
             attr_name = str(item_key)
+            optimizer = self.optimizer[item_key]
+            scheduler = self.lr_scheduler_dict[f'{attr_name}_scheduler']
+            if self.accumulate_state.accumulate_steps > 1:
+                optimizer = AccumulateOptimizer(optimizer, self.accumulate_state)
+                scheduler = AccumulateScheduler(scheduler, self.accumulate_state)
             # get the optimizer
-            self.__setattr__(attr_name, self.optimizer[item_key])
+            self.__setattr__(attr_name, optimizer)
             # get the lr scheduler
-            self.__setattr__(f'{attr_name}_scheduler', self.lr_scheduler_dict[f'{attr_name}_scheduler'])
+            self.__setattr__(f'{attr_name}_scheduler', scheduler)
         
         # get the losses
         for item_key in self.loss_function.keys():
             attr_name = str(item_key)
-            self.__setattr__(attr_name, self.loss_function[attr_name])
+            loss_function = self.loss_function[attr_name]
+            if isinstance(loss_function, torch.nn.Module):
+                loss_function = loss_function.to(self.device)
+            self.__setattr__(attr_name, loss_function)
+        
+        # the things needed by the resume, the trainers can add others in the train step
+        for item_key in self.model.keys():
+            self.saved_stuff[str(item_key)] = getattr(self, str(item_key))
+        for item_key in self.optimizer.keys():
+            self.saved_stuff[str(item_key)] = getattr(self, str(item_key))
+            self.saved_stuff[f'{item_key}_scheduler'] = getattr(self, f'{item_key}_scheduler')
+        # the prefetcher does not count the batches which are not used by the training
+        self.saved_stuff['data_stream'] = self._train_loader_iter
 
         self.custom_setup()
 
@@ -163,7 +213,7 @@ class BaseTrainer(AbstractTrainer):
             logger.info('=>Not have the pre-train model! Training from the scratch')
         else:
             logger.info(f'=>Loading the model in {model_path}')
-            pretrain_model = torch.load(model_path)
+            pretrain_model = load_checkpoint(model_path)
             if 'epoch' in pretrain_model.keys():
                 logger.info('(|_|) ==> Use the check point file')
                 # self.model.load_state_dict(pretrain_model['model_state_dict'])
@@ -177,16 +227,79 @@ class BaseTrainer(AbstractTrainer):
     
     def resume(self):
         """Load files used for resume training.
-        The method loads the model file and the optimzier file.
+        The method loads the models, the optimzers, the lr schedulers and the data stream saved by the engine_save.
+        The training continues from the step in the checkpoint, and the data stream continues from the next batch.
         """
         logger.info('=> Resume the previous training')
         checkpoint_path = self.config.TRAIN.resume.checkpoint_path
         logger.info(f'=> Load the checkpoint from {checkpoint_path}')
-        checkpoint = torch.load(checkpoint_path)
+        checkpoint = load_checkpoint(checkpoint_path)
         # self.model.load_state_dict(checkpoint['model_state_dict'])
-        self._load_file(self.model.keys(), checkpoint['model_state_dict'])
+        self._load_file(self.model.keys(), checkpoint)
         # self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-        self._load_file(self.optimizer.keys(), checkpoint['optimizer_state_dict'])
+        for item_key in self.optimizer.keys():
+            item_key = str(item_key)
+            if item_key in checkpoint:
+                getattr(self, item_key).load_state_dict(checkpoint[item_key])
+            else:
+                logger.warning(f'=> Not have the {item_key} in the checkpoint')
+            scheduler_key = f'{item_key}_scheduler'
+            if scheduler_key in checkpoint:
+                getattr(self, scheduler_key).load_state_dict(checkpoint[scheduler_key])
+        
+        if 'data_stream' in checkpoint:
+            self.data_stream.load_state_dict(checkpoint['data_stream'])
+        else:
+            logger.warning('=> Not have the data stream in the checkpoint, the data starts from the beginning')
+        
+        if 'step' in checkpoint:
+            self.resume_step = int(checkpoint['step'])
+            self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = self.resume_step
+            logger.info(f'=> Continue the training from the step {self.resume_step}')
+
+    def _prepare_batch(self, batch):
+        data, anno, meta = batch
+        data = data.to(self.device, non_blocking=True)
+        with torch.no_grad():
+            frozen = self.prepare_frozen(data)
+        return data, anno, meta, frozen
+
+    def prepare_frozen(self, data):
+        """Get the outputs of the frozen models on the batch, e.g. the optical flow or the detected objects.
+        Re-write by the sub-class. When TRAIN.prefetch.use is True, it runs in the background thread while the previous step trains,
+        so it should only use the models which are not updated.
+        Args:
+            data(torch.Tensor): The data of the batch on the device
+        Returns:
+            frozen(dict)
+        """
+        return dict()
+
+    def next_batch(self):
+        """Get the next batch of the training data.
+        Returns:
+            data(torch.Tensor): The data on the device
+            anno, meta: From the dataset
+            frozen(dict): The outputs of prepare_frozen
+        """
+        batch = next(self._train_loader_iter)
+        if isinstance(self._train_loader_iter, BatchPrefetcher):
+            return batch
+        return self._prepare_batch(batch)
+
+    def run(self, start_iter, max_iter):
+        if self.resume_step is not None and self.resume_step > start_iter:
+            start_iter = self.resume_step
+        if self.accumulate_state.accumulate_steps > 1 and start_iter % self.accumulate_state.accumulate_steps != 0:
+            logger.warning(f'The step {start_iter} is not the start of the accumulation window, the first update uses fewer micro-batches')
+        self.before_train()
+        for i in range(start_iter, max_iter):
+            self.before_step(i)
+            # the models in the DistributedDataParallel only reduce the gradients on the last micro-batch
+            with accumulate_context(self.accumulate_state, [getattr(self, str(key)) for key in self.model.keys()]):
+                self.train(i)
+            self.after_step(i)
+        self.after_train()
     
 
     def fine_tune(self):
@@ -224,33 +337,53 @@ class BaseTrainer(AbstractTrainer):
         return torch.nn.DataParallel(model.cuda(), device_ids=gpus)
     
     
+    def before_step(self, current_step):
+        self.accumulate_state.current_step = current_step
+        if self.runtime_tuner is not None:
+            self.runtime_tuner.before_step(current_step)
+
     def after_step(self, current_step):
+        # the time of the hooks(e.g. the evaluation) is not counted by the tuner
+        if self.runtime_tuner is not None:
+            self.runtime_tuner.after_step(current_step)
         # acc = 0.0
+        # the next step after resuming
+        self.saved_stuff['step'] = current_step + 1
         for h in self._hooks:
             h.after_step(current_step)
 
     def after_train(self):
         for h in self._hooks:
             h.after_train()
+        if isinstance(self._train_loader_iter, BatchPrefetcher):
+            self._train_loader_iter.close()
         
         self.save(self.config.TRAIN.max_steps, flag='final')
+        # make sure all of the checkpoints are on the disk
+        self.checkpoint_writer.close()
 
-    def save(self, current_step, best=False, flag='inter'):
+    def save(self, current_step, best=False, flag='inter', saved_stuff=None):
         """Save method.
         The method is used to save the model or checkpoint. The following attributes are related to this function.
             self.saved_stuff(dict): the dictionary of saving things, such as model, optimizer, loss, step. 
         Args:
             current_step(int): The current step. 
             best(bool): indicate whether is the best model
+            saved_stuff(dict): the saving things used instead of self.saved_stuff, e.g. the snapshot taken by the asynchronous evaluation
 
         """
+        if not is_main_process():
+            # only the first process writes the checkpoints in the distributed training
+            return
+        if saved_stuff is None:
+            saved_stuff = self.saved_stuff
         if best:
-            # result_dict = engine_save(self.config, self.kwargs['config_name'], self.saved_stuff, current_step, self.kwargs['time_stamp'], self.accuarcy, flag='best', verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=True, save_model=True)
-            result_dict = engine_save(self.saved_stuff, current_step, self.accuarcy, save_cfg=self.save_cfg, flag=flag, verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=True, save_model=True)
+            # result_dict = engine_save(self.config, self.kwargs['config_name'], self.saved_stuff, current_step, self.kwargs['time_stamp'], self.accuarcy, flag='best', verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=True, save_model=True, writer=self.checkpoint_writer)
+            result_dict = engine_save(saved_stuff, current_step, self.accuarcy, save_cfg=self.save_cfg, flag=flag, verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=True, save_model=True, writer=self.checkpoint_writer)
             self.result_path = result_dict['model_file']
         else:
-            # result_dict = engine_save(self.config, self.kwargs['config_name'], self.saved_stuff, current_step, self.kwargs['time_stamp'], self.accuarcy, flag='best', verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=False, save_model=False)
-            result_dict = engine_save(self.saved_stuff, current_step, self.accuarcy, save_cfg=self.save_cfg, flag=flag, verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=False, save_model=False)
+            # result_dict = engine_save(self.config, self.kwargs['config_name'], self.saved_stuff, current_step, self.kwargs['time_stamp'], self.accuarcy, flag='best', verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=False, save_model=False, writer=self.checkpoint_writer)
+            result_dict = engine_save(saved_stuff, current_step, self.accuarcy, save_cfg=self.save_cfg, flag=flag, verbose=(self.kwargs['model_type'] + '#' + self.verbose), best=False, save_model=False, writer=self.checkpoint_writer)
     
         
     @abc.abstractmethod
@@ -309,10 +442,11 @@ class BaseInference(AbstractInference):
         # self._eval_hooks = []
         self._register_hooks(kwargs['hooks'])
         # logger & config
-        # self.logger = defaults[4]
+        self.logger = kwargs.get('logger', logger)
         self.config = kwargs['config']
         # devices
         self.engine_gpus = self.config.SYSTEM.gpus
+        self.device = get_device(self.config)
 
         self.model = kwargs['model_dict']
         
@@ -363,7 +497,7 @@ class BaseInference(AbstractInference):
             if self.kwargs['parallel']:
                 temp_model = self.data_parallel(self.model[item_key])
             else:
-                temp_model = self.model[item_key].cuda()
+                temp_model = self.model[item_key].to(self.device)
             self.__setattr__(attr_name, temp_model)
         
         # get the optimizer
@@ -372,7 +506,10 @@ class BaseInference(AbstractInference):
         # get the losses
         for item_key in self.loss_function.keys():
             attr_name = str(item_key)
-            self.__setattr__(attr_name, self.loss_function[attr_name])
+            loss_function = self.loss_function[attr_name]
+            if isinstance(loss_function, torch.nn.Module):
+                loss_function = loss_function.to(self.device)
+            self.__setattr__(attr_name, loss_function)
 
         self.custom_setup()
 
@@ -380,7 +517,7 @@ class BaseInference(AbstractInference):
         """Load the model from the model file.
         """
         logger.info(f'=>Loading the Test model in {model_path}')
-        model_file = torch.load(model_path)
+        model_file = load_checkpoint(model_path)
         self._load_file(self.model.keys(), model_file)
 
 
@@ -397,6 +534,9 @@ class BaseService(AbstractService):
     """The BaseService class
     The 'service' means that the user only want to use the model to run on the real data instaed of the data from the dataset.
     So, in this class, it just provide the function to get the model, and regularize the pipeline to use the model. 
+    The frames of the live feeds are pushed one by one(push_frame), each stream keeps the latest `window_length` frames in its ring buffer,
+    and every new frame is scored with the latest window once the buffer is full.
+    The sub-class sets the `window_length` in the custom_setup and implements the score_windows.
     """
     def __init__(self, **kwargs):
         """Initialization Method.
@@ -421,6 +561,7 @@ class BaseService(AbstractService):
 
         # devices
         self.engine_gpus = self.config.SYSTEM.gpus
+        self.device = get_device(self.config)
 
         self.model = kwargs['model_dict']
         
@@ -445,8 +586,8 @@ class BaseService(AbstractService):
         self.config_name = kwargs['config_name']
         self.kwargs = kwargs
         self.normalize = ParamSet(name='normalize', 
-                                  train={'use':self.config.ARGUMENT.train.normal.use, 'mean':self.config.ARGUMENT.train.normal.mean, 'std':self.config.ARGUMENT.train.normal.std}, 
-                                  val={'use':self.config.ARGUMENT.val.normal.use, 'mean':self.config.ARGUMENT.val.normal.mean, 'std':self.config.ARGUMENT.val.normal.std})
+                                  train={'use':self.config.AUGMENT.train.normal.use, 'mean':self.config.AUGMENT.train.normal.mean, 'std':self.config.AUGMENT.train.normal.std}, 
+                                  val={'use':self.config.AUGMENT.val.normal.use, 'mean':self.config.AUGMENT.val.normal.mean, 'std':self.config.AUGMENT.val.normal.std})
 
         self.evaluate_function = kwargs['evaluate_function']
         
@@ -465,14 +606,22 @@ class BaseService(AbstractService):
             if self.kwargs['parallel']:
                 temp_model = self.data_parallel(self.model[item_key])
             else:
-                temp_model = self.model[item_key].cuda()
+                temp_model = self.model[item_key].to(self.device)
             self.__setattr__(attr_name, temp_model)
         
-        
-        # get the losses
-        for item_key in self.loss_function.keys():
-            attr_name = str(item_key)
-            self.__setattr__(attr_name, self.loss_function[attr_name])
+        # the streams, stream_id -> StreamState
+        self.streams = OrderedDict()
+        self.window_length = self.config.DATASET.val.clip_length
+        self.threshold = self.config.SERVICE.threshold
+        self.latency = LatencyRecorder(self.config.SERVICE.latency_window)
+        # skip the model on the static frames
+        self.motion_gate = build_motion_gate(self.config.SERVICE.motion_gate)
+        # score every k-th frame, and every frame after the rising score
+        self.adaptive_stride = build_adaptive_stride(self.config.SERVICE.adaptive_stride)
+        # smooth the scores of each stream with the causal kernel
+        self.smoother = build_smoother(self.config.SERVICE.smoothing)
+        # the IncrementalEncoder3D which reuses the features of the overlapping windows, set by the sub-class which supports it
+        self.incremental = None
 
         self.custom_setup()
         self.load_model(self.model_path)
@@ -481,14 +630,271 @@ class BaseService(AbstractService):
         """Load the model from the model file.
         """
         logger.info(f'=>Loading the Test model in {model_path}')
-        model_file = torch.load(model_path)
+        model_file = load_checkpoint(model_path)
         self._load_file(self.model.keys(), model_file)
+        for item_key in self.model.keys():
+            getattr(self, str(item_key)).eval()
 
     @abc.abstractmethod
     def custom_setup(self):
         pass
 
     @abc.abstractmethod
-    def execute(self):
+    def score_windows(self, windows):
+        """Score the windows of the frames.
+        Args:
+            windows(torch.Tensor): [B, C, D, H, W] on the device, D=window_length
+        Returns:
+            scores(np.ndarray): [B], the anomaly score of the last frame in each window, higher means more abnormal
+        """
         pass
-    
\ No newline at end of file
+
+    def score_stream(self, state, frame_index, window):
+        """Score the window of one stream which ends at the frame.
+        With the incremental encoder, the features of the encoder are given to the score_windows(features=...).
+        Args:
+            state(StreamState): The state of the stream
+            frame_index(int): The index of the last frame of the window in the stream
+            window(torch.Tensor): [C, D, H, W]
+        Returns:
+            score(float)
+        """
+        return float(self.score_stream_windows([state], [frame_index], window.unsqueeze(0))[0])
+
+    def score_stream_windows(self, states, frame_indices, windows):
+        """Score the windows of the streams together, e.g. the batch of the MicroBatchScheduler.
+        With the incremental encoder, each window is encoded with the features of its stream, and the rest of the model runs on the batch.
+        So the windows of one stream should be given in the order of their frames.
+        Args:
+            states(list): The StreamState of each window
+            frame_indices(list): The index of the last frame of each window in its stream
+            windows(torch.Tensor): [B, C, D, H, W]
+        Returns:
+            scores(np.ndarray): [B]
+        """
+        if self.incremental is None:
+            return self.score_windows(windows)
+        features = torch.cat([self.incremental.stream(state.stream_id, windows[i:i + 1], frame_index - self.window_length + 1)
+                              for i, (state, frame_index) in enumerate(zip(states, frame_indices))], dim=0)
+        return self.score_windows(windows, features=features)
+
+    def preprocess_frame(self, frame):
+        """Turn the raw frame into the input of the model, in the same way as the val dataset.
+        Args:
+            frame(np.ndarray|torch.Tensor): [H, W, C] uint8 RGB image, or the [C, H, W] float tensor which has been processed
+        Returns:
+            frame(torch.Tensor): [C, H, W] on the device
+        """
+        if torch.is_tensor(frame) and frame.is_floating_point():
+            return frame.to(self.device)
+        if not torch.is_tensor(frame):
+            frame = torch.from_numpy(np.ascontiguousarray(frame))
+        frame = frame.to(self.device)
+        if frame.dim() == 2:
+            frame = frame.unsqueeze(-1)
+        frame = frame.permute(2, 0, 1).float().div_(255.0)
+        if self.config.DATASET.channel_name == 'gray' and frame.shape[0] == 3:
+            frame = (0.299 * frame[0] + 0.587 * frame[1] + 0.114 * frame[2]).unsqueeze(0)
+        resize = self.config.AUGMENT.val.resize
+        if resize.use and tuple(frame.shape[-2:]) != (resize.height, resize.width):
+            frame = torch.nn.functional.interpolate(frame.unsqueeze(0), size=(resize.height, resize.width), mode='bilinear', align_corners=False).squeeze(0)
+        # the empty mean and std only scale the frame to [0, 1], the same as the video loader
+        normalize = self.normalize.param['val']
+        if normalize['use'] and len(normalize['mean']) != 0 and len(normalize['std']) != 0:
+            mean = torch.tensor(self.normalize.param['val']['mean'], dtype=frame.dtype, device=frame.device).view(-1, 1, 1)
+            std = torch.tensor(self.normalize.param['val']['std'], dtype=frame.dtype, device=frame.device).view(-1, 1, 1)
+            frame = (frame - mean) / std
+        return frame
+
+    def open_stream(self, stream_id):
+        """Add the stream, pushing to an unknown stream also opens it.
+        """
+        if stream_id not in self.streams:
+            self.streams[stream_id] = StreamState(stream_id, self.window_length, self.config.SERVICE.latency_window)
+            logger.info(f'Open the stream: {stream_id}')
+        return self.streams[stream_id]
+
+    def close_stream(self, stream_id):
+        """Remove the stream and return the summary of its latencies.
+        """
+        state = self.streams.pop(stream_id, None)
+        if state is None:
+            return None
+        summary = state.latency.summary()
+        message = f'Close the stream: {stream_id}, {state.num_frames} frames, {self._format_latency(summary)}'
+        if self.motion_gate is not None:
+            summary['skip_rate'] = self.motion_gate.skip_rate(stream_id)
+            self.motion_gate.reset(stream_id)
+            message += f', skip rate:{summary["skip_rate"]:.3f}'
+        if self.adaptive_stride is not None:
+            summary['evaluated_ratio'] = self.adaptive_stride.evaluated_ratio(stream_id)
+            self.adaptive_stride.reset(stream_id)
+            message += f', evaluated ratio:{summary["evaluated_ratio"]:.3f}'
+        if self.incremental is not None:
+            self.incremental.reset_stream(stream_id)
+        if self.smoother is not None:
+            # the last `lag` frames are smoothed with the frames after them, the results begin at the end of the first window
+            summary['smoothed_tail'] = [(index + self.window_length - 1, value) for index, value in self.smoother.flush(stream_id)]
+        logger.info(message)
+        return summary
+
+    def push_frame(self, stream_id, frame):
+        """Push one frame of the stream, and score it if the buffer holds the whole window.
+        Args:
+            stream_id: The name of the stream
+            frame: The raw frame, refer to the preprocess_frame
+        Returns:
+            result(StreamResult|None): None if the buffer is not full yet
+        """
+        start = time.perf_counter()
+        state, frame_index, window = self.buffer_frame(stream_id, frame)
+        if window is None:
+            return None
+        result = self.skip_frame(state, frame_index, frame, start)
+        if result is not None:
+            return result
+        with torch.no_grad():
+            score = self.score_stream(state, frame_index, window)
+        return self.record_result(state, frame_index, score, start)
+
+    def buffer_frame(self, stream_id, frame):
+        """Push the frame into the ring buffer of the stream without scoring it.
+        Returns:
+            state(StreamState): The state of the stream
+            frame_index(int): The index of the frame in the stream
+            window(torch.Tensor|None): [C, D, H, W] the latest window which ends with the frame, None if the buffer is not full.
+                It may share the memory with the buffer, so copy it if it is used after the next frame
+        """
+        state = self.open_stream(stream_id)
+        state.buffer.push(self.preprocess_frame(frame))
+        frame_index = state.num_frames
+        state.num_frames += 1
+        if not state.buffer.full:
+            return state, frame_index, None
+        return state, frame_index, state.buffer.window()
+
+    def skip_frame(self, state, frame_index, frame, start):
+        """Check the frame with the adaptive stride and the motion gate.
+        The frame is still pushed into the buffer, so the window is complete when the frame after it is scored.
+        Returns:
+            result(StreamResult|None): The result of the skipped frame, None if the model should score the frame
+        """
+        skip = self.check_skip(state, frame)
+        if skip is None:
+            return None
+        return self.record_result(state, frame_index, self.skipped_score(state, skip), start, skipped=True)
+
+    def check_skip(self, state, frame, has_score=None):
+        """Decide whether the model skips the frame, without recording its result.
+        Args:
+            has_score(bool): Whether a score of the stream is recorded or will be recorded before this frame, default is state.last_score is not None
+        Returns:
+            skip(str|None): 'stride'(the adaptive stride) | 'motion'(the motion gate), None if the model should score the frame
+        """
+        if has_score is None:
+            has_score = state.last_score is not None
+        # the frame is counted as scored by the adaptive stride only after the motion gate also passes it
+        if self.adaptive_stride is not None and not self.adaptive_stride.check(state.stream_id, can_skip=has_score, commit=False):
+            return 'stride'
+        if self.motion_gate is not None:
+            can_skip = self.motion_gate.mode == 'baseline' or has_score
+            if not self.motion_gate.check(state.stream_id, frame, can_skip=can_skip):
+                return 'motion'
+        if self.adaptive_stride is not None:
+            self.adaptive_stride.mark_scored(state.stream_id)
+        return None
+
+    def skipped_score(self, state, skip):
+        """The score of the frame skipped by check_skip, got from the last score of the stream.
+        """
+        if skip == 'stride':
+            # the service can not wait for the next scored frame, so the last score is kept instead of the interpolation
+            return state.last_score
+        return self.motion_gate.skipped_score(state.last_score)
+
+    def record_result(self, state, frame_index, score, start, skipped=False):
+        """Record the latency of the scored frame and make its result.
+        With the smoothing, the score is pushed into the smoother and the result gets the smoothed score of the frame `lag` frames before it.
+        Args:
+            start(float): The time.perf_counter() when the frame was pushed
+            skipped(bool): The model is not run on the frame
+        """
+        if not skipped:
+            state.last_score = score
+            if self.adaptive_stride is not None:
+                self.adaptive_stride.update(state.stream_id, score)
+        latency = time.perf_counter() - start
+        state.latency.update(latency)
+        self.latency.update(latency)
+        log_interval = self.config.SERVICE.log_interval
+        if log_interval > 0 and self.latency.count % log_interval == 0:
+            logger.info(f'Scored {self.latency.count} frames of {len(self.streams)} streams, {self._format_latency(self.latency.summary())}')
+        if self.smoother is None:
+            return StreamResult(state.stream_id, frame_index, score, score > self.threshold, latency, skipped)
+        smoothed_index, smoothed = self.smoother.update(state.stream_id, score)
+        if smoothed_index is None:
+            return StreamResult(state.stream_id, frame_index, score, False, latency, skipped)
+        return StreamResult(state.stream_id, frame_index, score, smoothed > self.threshold, latency, skipped, frame_index - self.smoother.lag, smoothed)
+
+    @staticmethod
+    def _format_latency(summary):
+        return f'latency mean:{summary["mean"] * 1000:.2f}ms, p50:{summary["p50"] * 1000:.2f}ms, p99:{summary["p99"] * 1000:.2f}ms'
+
+    def latency_summary(self, stream_id=None):
+        """The latencies of one stream, or all of the streams if the stream_id is None.
+        Returns:
+            summary(dict): The count, mean, p50 and p99 in seconds
+        """
+        if stream_id is None:
+            return self.latency.summary()
+        return self.streams[stream_id].latency.summary()
+
+    def build_scheduler(self):
+        """Build the MicroBatchScheduler with the SERVICE.batching config, which scores the windows of many streams in one forward.
+        """
+        from ..batching import MicroBatchScheduler
+        batching = self.config.SERVICE.batching
+        return MicroBatchScheduler(self, batching.max_batch_size, batching.max_wait, self.config.SERVICE.latency_window)
+
+    def run_source(self, source, stream_id='default'):
+        """Push all of the frames of the source into the stream.
+        Args:
+            source: The iterable of the frames, e.g. the FileFrameSource
+            stream_id: The name of the stream
+        Yields:
+            result(StreamResult): The results of the scored frames
+        """
+        try:
+            for frame in source:
+                result = self.push_frame(stream_id, frame)
+                if result is not None:
+                    yield result
+        finally:
+            self.close_stream(stream_id)
+
+    def execute(self, data, stream_id='video'):
+        """Score a whole video as a stream.
+        Args:
+            data: The frames of the video, e.g. the [T, H, W, C] uint8 tensor from the torchvision.io.read_video, or the FileFrameSource
+        Returns:
+            output_dict(OrderedDict): 'scores': [T] the score of each frame, the first window_length-1 frames use the score of the first window.
+                'result_dict': [T] whether the frame is the anomaly, with the smoothing it uses 'smoothed_scores': [T] the smoothed scores
+        """
+        output_dict = OrderedDict()
+        results = list(self.run_source(data, stream_id))
+        if len(results) == 0:
+            logger.warning(f'The video is shorter than the window({self.window_length} frames), no frame is scored')
+            output_dict['scores'] = np.zeros(0, dtype=np.float32)
+            output_dict['result_dict'] = np.zeros(0, dtype=bool)
+            return output_dict
+        scores = np.array([result.score for result in results], dtype=np.float32)
+        scores = np.concatenate([np.full(results[0].frame_index, scores[0], dtype=np.float32), scores])
+        output_dict['scores'] = scores
+        if self.smoother is not None:
+            # the same as the smoothed scores of the stream, and the last `lag` frames are flushed
+            smoother = self.smoother
+            scores = smooth_scores(scores[results[0].frame_index:], smoother.kernel, smoother.sigma, smoother.lag, smoother.truncate).astype(np.float32)
+            scores = np.concatenate([np.full(results[0].frame_index, scores[0], dtype=np.float32), scores])
+            output_dict['smoothed_scores'] = scores
+        output_dict['result_dict'] = scores > self.threshold
+        return output_dict
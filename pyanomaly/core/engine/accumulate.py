@@ -0,0 +1,107 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Accumulate the gradients of several micro-batches before updating the models.
+Each training step of the engine trains one micro-batch(TRAIN.batch_size), and the optimizers are updated every TRAIN.accumulate_steps steps,
+so the effective batch size is batch_size * accumulate_steps, while the memory is the one of the micro-batch.
+The trainers are not changed: the optimizers and the schedulers are wrapped, zero_grad() only works on the first micro-batch of the window,
+step() only works on the last one, and the accumulated gradients are averaged before the update.
+In the adversarial training, G and D are updated once in each window, so D sees the same G in all of the micro-batches, which is the same as one large batch.
+"""
+import contextlib
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['AccumulateState', 'AccumulateOptimizer', 'AccumulateScheduler', 'accumulate_context']
+
+
+class AccumulateState(object):
+    """The position of the current step in the accumulation window.
+    Args:
+        accumulate_steps(int): The number of the micro-batches in one update
+    """
+    def __init__(self, accumulate_steps=1):
+        assert accumulate_steps >= 1, f'The accumulate_steps should be positive, but got {accumulate_steps}'
+        self.accumulate_steps = int(accumulate_steps)
+        self.current_step = 0
+
+    @property
+    def micro_step(self):
+        return self.current_step % self.accumulate_steps
+
+    @property
+    def is_first(self):
+        return self.micro_step == 0
+
+    @property
+    def is_update_step(self):
+        return self.micro_step == self.accumulate_steps - 1
+
+
+class AccumulateOptimizer(object):
+    """Wrap the optimizer, it can be used as the optimizer in the trainers and in the checkpoints.
+    Args:
+        optimizer(torch.optim.Optimizer)
+        state(AccumulateState)
+    """
+    def __init__(self, optimizer, state):
+        self.optimizer = optimizer
+        self.accumulate_state = state
+
+    def zero_grad(self, *args, **kwargs):
+        if self.accumulate_state.is_first:
+            self.optimizer.zero_grad(*args, **kwargs)
+
+    def step(self, *args, **kwargs):
+        if not self.accumulate_state.is_update_step:
+            return None
+        # the losses are the means of the micro-batches, so average the accumulated gradients
+        scale = 1.0 / self.accumulate_state.accumulate_steps
+        with torch.no_grad():
+            for group in self.optimizer.param_groups:
+                for param in group['params']:
+                    if param.grad is not None:
+                        param.grad.mul_(scale)
+        return self.optimizer.step(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # state_dict, load_state_dict, param_groups, ... are from the optimizer
+        return getattr(self.__dict__['optimizer'], name)
+
+
+class AccumulateScheduler(object):
+    """Wrap the lr scheduler, which steps once in each update.
+    Args:
+        scheduler: The lr scheduler
+        state(AccumulateState)
+    """
+    def __init__(self, scheduler, state):
+        self.scheduler = scheduler
+        self.accumulate_state = state
+
+    def step(self, *args, **kwargs):
+        if self.accumulate_state.is_update_step:
+            return self.scheduler.step(*args, **kwargs)
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['scheduler'], name)
+
+
+def accumulate_context(state, models):
+    """Skip the all-reduce of the DistributedDataParallel models on the micro-batches except the last one of the window.
+    Args:
+        state(AccumulateState)
+        models(list): The models of the engine
+    Returns:
+        context: Used by the with statement around the training step
+    """
+    stack = contextlib.ExitStack()
+    if not state.is_update_step:
+        for model in models:
+            if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+                stack.enter_context(model.no_sync())
+    return stack
@@ -0,0 +1,332 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Score the windows at a coarse stride and densify around the rising scores.
+Every `stride`-th window is scored by the model, and the windows in between get the interpolated scores.
+When a score exceeds the running threshold(the mean + sigma * std of the scores seen before it), the windows around it are all scored,
+so the anomalies are not smoothed away by the interpolation.
+The evaluation looks back(the windows before the rising score are scored too) and interpolates between the scored windows,
+the service can not look back, it keeps the last score until the next scored frame and scores every frame for dense_window frames after the rising score.
+The re-scoring tool applies the schedule of the evaluation to the dense scores of the val videos and compares the AUC, for example:
+    python -m pyanomaly.core.engine.adaptive_stride ./output/results/xxx.pkl --cfg ./configuration/stae/avenue/avenue_default.yaml --strides 2 4 8
+"""
+import os
+import csv
+import argparse
+import numpy as np
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['RunningThreshold', 'AdaptiveStride', 'build_adaptive_stride', 'interpolate_scores', 'adaptive_scores', 'evaluate_adaptive_stride']
+
+TABLE_FIELDS = ['stride', 'evaluated_ratio', 'dense_auc', 'adaptive_auc', 'auc_delta']
+
+
+class RunningThreshold(object):
+    """The mean + sigma * std of the scores seen so far(Welford's method).
+    Args:
+        sigma(float): The number of the std above the mean
+        warmup(int): No score exceeds the threshold before `warmup` scores are seen
+        higher_is_abnormal(bool): False if the low score means the anomaly(e.g. the psnr), then the threshold is mean - sigma * std
+    """
+    def __init__(self, sigma=2.0, warmup=5, higher_is_abnormal=True):
+        self.sigma = sigma
+        self.warmup = warmup
+        self.higher_is_abnormal = higher_is_abnormal
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    @property
+    def threshold(self):
+        if self.count < max(self.warmup, 2):
+            return None
+        std = (self._m2 / (self.count - 1)) ** 0.5
+        return self.mean + self.sigma * std if self.higher_is_abnormal else self.mean - self.sigma * std
+
+    def exceeds(self, score):
+        """Whether the score is more abnormal than the threshold, the score is not added.
+        """
+        threshold = self.threshold
+        if threshold is None:
+            return False
+        return score > threshold if self.higher_is_abnormal else score < threshold
+
+    def update(self, score):
+        self.count += 1
+        delta = score - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (score - self.mean)
+
+
+class _StreamStride(object):
+    __slots__ = ['threshold', 'since', 'dense_left', 'checked', 'scored']
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        # the frames since the last scored one
+        self.since = 0
+        # the frames which are scored after the rising score
+        self.dense_left = 0
+        self.checked = 0
+        self.scored = 0
+
+
+class AdaptiveStride(object):
+    """The adaptive stride of the windows.
+    Args:
+        stride(int): Score every `stride`-th window, 1 means scoring every window
+        dense_window(int): The number of the windows after the rising score which are all scored
+        sigma(float), warmup(int): The running threshold, refer to the RunningThreshold
+        higher_is_abnormal(bool): The direction of the scores
+    """
+    def __init__(self, stride=4, dense_window=8, sigma=2.0, warmup=5, higher_is_abnormal=True):
+        assert stride >= 1, f'The stride should be positive, but got {stride}'
+        self.stride = int(stride)
+        self.dense_window = max(0, int(dense_window))
+        self.sigma = sigma
+        self.warmup = warmup
+        self.higher_is_abnormal = higher_is_abnormal
+        # stream_id -> _StreamStride
+        self._streams = OrderedDict()
+
+    def new_threshold(self):
+        return RunningThreshold(self.sigma, self.warmup, self.higher_is_abnormal)
+
+    def schedule(self, num_windows, score_fn):
+        """Score the windows of one video, used by the evaluation.
+        The coarse windows(every `stride`-th and the last one) are scored first, the threshold of a window runs over the coarse scores before it.
+        For each window above the threshold, the windows from the previous coarse window to dense_window after it are scored, and so on.
+        Args:
+            num_windows(int): The number of the windows in the video
+            score_fn: The function scoring the windows, score_fn(indices) -> [len(indices)] or [len(indices), K] scores
+        Returns:
+            scores(np.ndarray): [num_windows] or [num_windows, K], the scores of the skipped windows are linearly interpolated
+            evaluated(np.ndarray): [num_windows] bool, whether the window is scored by the model
+        """
+        assert num_windows > 0, 'No window to score'
+        coarse = list(range(0, num_windows, self.stride))
+        if coarse[-1] != num_windows - 1:
+            coarse.append(num_windows - 1)
+        coarse = np.asarray(coarse, dtype=np.int64)
+        values = dict(zip(coarse.tolist(), self._score(score_fn, coarse)))
+
+        # the threshold of each window is the one after the coarse windows before it
+        running = self.new_threshold()
+        thresholds = []
+        for index in coarse:
+            thresholds.append(running.threshold)
+            running.update(self._key(values[int(index)]))
+
+        def exceeds(index):
+            threshold = thresholds[int(np.searchsorted(coarse, index, side='right')) - 1]
+            if threshold is None:
+                return False
+            score = self._key(values[index])
+            return score > threshold if self.higher_is_abnormal else score < threshold
+
+        check = coarse.tolist()
+        while len(check) > 0:
+            dense = set()
+            for index in check:
+                if exceeds(index):
+                    dense.update(range(max(0, index - self.stride + 1), min(num_windows, index + self.dense_window + 1)))
+            dense = np.asarray(sorted(item for item in dense if item not in values), dtype=np.int64)
+            if len(dense) > 0:
+                values.update(zip(dense.tolist(), self._score(score_fn, dense)))
+            check = dense.tolist()
+
+        evaluated = np.zeros(num_windows, dtype=bool)
+        scored = np.asarray(sorted(values.keys()), dtype=np.int64)
+        evaluated[scored] = True
+        return interpolate_scores(scored, np.stack([values[int(index)] for index in scored], axis=0), num_windows), evaluated
+
+    @staticmethod
+    def _score(score_fn, indices):
+        scores = score_fn(indices)
+        if hasattr(scores, 'detach'):
+            scores = scores.detach().cpu().numpy()
+        scores = np.asarray(scores, dtype=np.float64)
+        assert len(scores) == len(indices), f'The number of the scores({len(scores)}) does not match the windows({len(indices)})'
+        return list(scores)
+
+    @staticmethod
+    def _key(score):
+        # the score of the last frame is compared with the threshold, when the window has several scores
+        return float(np.asarray(score).reshape(-1)[-1])
+
+    def check(self, stream_id, can_skip=True, commit=True):
+        """Decide whether the model scores the next frame of the stream, used by the service.
+        Args:
+            stream_id: The name of the stream
+            can_skip(bool): False if the frame must be scored, e.g. no score to carry
+            commit(bool): Count the frame as scored if it runs. False if another gate may still skip the frame, call mark_scored after it passes
+        Returns:
+            run(bool): True if the model scores the frame
+        """
+        state = self._streams.get(stream_id)
+        if state is None:
+            state = self._streams[stream_id] = _StreamStride(self.new_threshold())
+        state.checked += 1
+        if can_skip and state.dense_left <= 0 and state.since + 1 < self.stride:
+            state.since += 1
+            return False
+        if commit:
+            self.mark_scored(stream_id)
+        return True
+
+    def mark_scored(self, stream_id):
+        """Count the frame passed by the check as scored, the next stride starts from it.
+        """
+        state = self._streams[stream_id]
+        state.since = 0
+        state.scored += 1
+
+    def update(self, stream_id, score):
+        """Record the score of the scored frame, the next dense_window frames are scored if it exceeds the threshold.
+        """
+        state = self._streams[stream_id]
+        if state.threshold.exceeds(score):
+            state.dense_left = self.dense_window
+        else:
+            state.dense_left = max(0, state.dense_left - 1)
+        state.threshold.update(score)
+
+    def evaluated_ratio(self, stream_id=None):
+        """The ratio of the frames scored by the model in the stream, or in all of the streams if the stream_id is None.
+        """
+        streams = list(self._streams.values()) if stream_id is None else [self._streams[stream_id]] if stream_id in self._streams else []
+        checked = sum(state.checked for state in streams)
+        return sum(state.scored for state in streams) / checked if checked > 0 else 1.0
+
+    def reset(self, stream_id):
+        """Forget the stream.
+        """
+        self._streams.pop(stream_id, None)
+
+
+def build_adaptive_stride(stride_cfg, higher_is_abnormal=True):
+    """Build the AdaptiveStride with the VAL.adaptive_stride or SERVICE.adaptive_stride config, None if it is not used.
+    """
+    if not stride_cfg.use:
+        return None
+    return AdaptiveStride(stride_cfg.stride, stride_cfg.dense_window, stride_cfg.sigma, stride_cfg.warmup, higher_is_abnormal)
+
+
+def interpolate_scores(indices, scores, num_windows):
+    """Linearly interpolate the scores of the windows.
+    Args:
+        indices(np.ndarray): [N] the sorted indices of the scored windows
+        scores(np.ndarray): [N] or [N, K] their scores
+        num_windows(int): The number of all the windows
+    Returns:
+        scores(np.ndarray): [num_windows] or [num_windows, K]
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    positions = np.arange(num_windows)
+    if scores.ndim == 1:
+        return np.interp(positions, indices, scores)
+    flat = scores.reshape(len(scores), -1)
+    output = np.stack([np.interp(positions, indices, flat[:, k]) for k in range(flat.shape[1])], axis=1)
+    return output.reshape((num_windows,) + scores.shape[1:])
+
+
+def adaptive_scores(scores, stride):
+    """Apply the schedule of the evaluation to the dense scores of one video.
+    The schedule only depends on the order of the scores, so the normalized scores give the same windows as the raw ones.
+    Args:
+        scores(np.ndarray): [T] the dense scores
+        stride(AdaptiveStride)
+    Returns:
+        scores(np.ndarray): [T] the scores with the adaptive stride
+        evaluated(np.ndarray): [T] whether the frame is scored
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    return stride.schedule(len(scores), lambda indices: scores[indices])
+
+
+def evaluate_adaptive_stride(result_file, dataset_name, gt_path, data_path, strides, score_type='normal', dense_window=8, sigma=2.0, warmup=5,
+                             output_file=None, gt_cache_dir=''):
+    """Compare the AUC of the dense scores with the scores of the adaptive stride.
+    Args:
+        result_file(str): The result file of the dense scores, saved by the evaluation
+        dataset_name(str): The name of the dataset, e.g. 'Avenue'
+        gt_path(str): The path of the ground truth
+        data_path(str): The path of the testing videos
+        strides(list): The coarse strides
+        score_type(str): 'normal' | 'abnormal'
+        output_file(str): The path of the csv table, None means not write
+    Returns:
+        rows(list): The ratio of the evaluated frames and the AUC of each stride
+    """
+    from pyanomaly.datatools.abstract.readers import GroundTruthLoader
+    from pyanomaly.datatools.evaluate.results import load_score_results
+    from pyanomaly.datatools.evaluate.batch_eval import compute_frame_auc
+    pos_label = 0 if score_type == 'normal' else 1
+    gt = GroundTruthLoader(gt_cache_dir).read(dataset_name, gt_path, data_path)
+    scores = load_score_results(result_file)['score']
+    assert len(scores) == len(gt), f'The number of videos does not match the ground truth, {len(scores)} != {len(gt)}'
+    video_list = sorted(os.listdir(data_path)) if os.path.isdir(data_path) else [str(sn) for sn in range(len(scores))]
+    dense_auc = compute_frame_auc(scores, gt, pos_label)
+
+    rows = []
+    for stride in strides:
+        schedule = AdaptiveStride(stride, dense_window, sigma, warmup, higher_is_abnormal=score_type == 'abnormal')
+        adaptive, evaluated = [], 0
+        for video_name, video_scores in zip(video_list, scores):
+            video_adaptive, video_evaluated = adaptive_scores(video_scores, schedule)
+            adaptive.append(video_adaptive)
+            evaluated += int(video_evaluated.sum())
+            logger.info(f'stride:{stride}, {video_name}: evaluated {int(video_evaluated.sum())}/{len(video_evaluated)} frames')
+        row = OrderedDict()
+        row['stride'] = stride
+        row['evaluated_ratio'] = evaluated / sum(len(item) for item in scores)
+        row['dense_auc'] = dense_auc
+        row['adaptive_auc'] = compute_frame_auc(adaptive, gt, pos_label)
+        row['auc_delta'] = row['adaptive_auc'] - dense_auc
+        logger.info(f'stride:{stride}, evaluated ratio:{row["evaluated_ratio"]:.3f}, AUC:{row["adaptive_auc"]:.4f}(dense:{dense_auc:.4f})')
+        rows.append(row)
+    if output_file is not None:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the evaluated frames and the AUC of the adaptive stride on the dense scores of the val videos')
+    parser.add_argument('result_file', help='the result file of the dense scores')
+    parser.add_argument('--cfg', default=None, help='the config file, use DATASET.name, DATASET.val.gt_path, DATASET.val.data_path, DATASET.score_type and VAL.adaptive_stride in it')
+    parser.add_argument('--dataset', default=None)
+    parser.add_argument('--gt_path', default=None)
+    parser.add_argument('--data_path', default=None)
+    parser.add_argument('--score_type', default=None)
+    parser.add_argument('--strides', type=int, nargs='+', default=None, help='the coarse strides, default is VAL.adaptive_stride.stride')
+    parser.add_argument('--output', default=None, help='the csv file of the table')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dataset_name, gt_path, data_path, score_type = args.dataset, args.gt_path, args.data_path, args.score_type
+    dense_window, sigma, warmup, strides, gt_cache_dir = 8, 2.0, 5, args.strides, ''
+    if args.cfg is not None:
+        from pyanomaly.config import update_config
+        cfg = update_config(args.cfg, [])
+        dataset_name = dataset_name or cfg.DATASET.name
+        gt_path = gt_path or cfg.DATASET.val.gt_path
+        data_path = data_path or cfg.DATASET.val.data_path
+        score_type = score_type or cfg.DATASET.score_type
+        gt_cache_dir = cfg.DATASET.gt_cache_dir
+        stride_cfg = cfg.VAL.adaptive_stride
+        dense_window, sigma, warmup = stride_cfg.dense_window, stride_cfg.sigma, stride_cfg.warmup
+        strides = strides or [stride_cfg.stride]
+    assert dataset_name is not None and gt_path is not None and data_path is not None, 'Please give the dataset, gt_path and data_path, or the cfg file'
+    assert strides is not None, 'Please give the strides, or the cfg file'
+
+    table = evaluate_adaptive_stride(args.result_file, dataset_name, gt_path, data_path, strides, score_type or 'normal', dense_window, sigma, warmup, args.output, gt_cache_dir)
+    print('\t'.join(TABLE_FIELDS))
+    for row in table:
+        print('\t'.join(str(row[field]) for field in TABLE_FIELDS))
@@ -0,0 +1,219 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Score the windows of many streams together.
+The frames of the streams are buffered by the service as soon as they arrive, the ready windows wait in one queue,
+and a background thread stacks them into one batch(up to max_batch_size, or the windows which arrived within max_wait after the first one),
+runs one forward of the model and gives each stream its score.
+The results of each stream are recorded in the order of its frames, the skipped frames wait for the windows pushed before them.
+"""
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+import torch
+from .streaming import LatencyRecorder
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['MicroBatchScheduler']
+
+
+class _Request(object):
+    __slots__ = ['state', 'frame_index', 'window', 'start', 'future', 'skip', 'score', 'error', 'done']
+
+    def __init__(self, state, frame_index, window, start, future, skip=None):
+        self.state = state
+        self.frame_index = frame_index
+        self.window = window
+        self.start = start
+        self.future = future
+        # the skipped frame(refer to the BaseService.check_skip) is not scored by the model
+        self.skip = skip
+        self.score = None
+        self.error = None
+        self.done = skip is not None
+
+
+class MicroBatchScheduler(object):
+    """Collect the ready windows of the streams into the batches of the service.
+    Args:
+        service(BaseService): The service which buffers the frames and scores the windows
+        max_batch_size(int): The max number of the windows in one forward
+        max_wait(float): The max seconds the first window of a batch waits for the others
+        latency_window(int): The number of the latest latencies used by the stats
+    """
+    def __init__(self, service, max_batch_size=8, max_wait=0.01, latency_window=1000):
+        self.service = service
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.latency = LatencyRecorder(latency_window)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        # the ring buffers are not shared between the threads of the producers
+        self._buffer_lock = threading.Lock()
+        # the results are recorded one by one, stream_id -> the requests whose results are not recorded, in the order of the frames
+        self._record_lock = threading.Lock()
+        self._pending = dict()
+        self._closed = False
+        self.num_batches = 0
+        self.num_windows = 0
+        self.max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, name='MicroBatchScheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, stream_id, frame):
+        """Push one frame of the stream.
+        Args:
+            stream_id: The name of the stream
+            frame: The raw frame, refer to the BaseService.preprocess_frame
+        Returns:
+            future(Future|None): The future of the StreamResult, None if the buffer of the stream is not full yet
+        """
+        start = time.perf_counter()
+        with self._buffer_lock:
+            if self._closed:
+                raise Exception('The scheduler is closed')
+            state, frame_index, window = self.service.buffer_frame(stream_id, frame)
+            if window is None:
+                return None
+            with self._record_lock:
+                pending = self._pending.setdefault(stream_id, deque())
+                # the windows waiting for the model will give the score before this frame
+                skip = self.service.check_skip(state, frame, has_score=state.last_score is not None or len(pending) > 0)
+                # the buffer is overwritten by the next frame of the stream
+                request = _Request(state, frame_index, None if skip is not None else window.clone(), start, Future(), skip)
+                pending.append(request)
+                resolved = self._resolve(stream_id) if skip is not None else []
+            if skip is None:
+                with self._cond:
+                    self._queue.append(request)
+                    self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+                    self._cond.notify()
+        self._finish(resolved)
+        return request.future
+
+    def close_stream(self, stream_id):
+        """Close the stream in the service, with the locks of the buffers and the records.
+        Call it after the futures of the stream are done, the frames of the stream submitted after it start a new stream.
+        Returns:
+            summary(dict): The latency summary of the stream, refer to the BaseService.close_stream
+        """
+        with self._buffer_lock:
+            with self._record_lock:
+                if len(self._pending.get(stream_id, ())) > 0:
+                    logger.warning(f'Close the stream {stream_id} with {len(self._pending[stream_id])} frames not scored')
+                return self.service.close_stream(stream_id)
+
+    @property
+    def queue_depth(self):
+        """The number of the windows waiting for the forward.
+        """
+        return len(self._queue)
+
+    def _next_batch(self):
+        with self._cond:
+            while len(self._queue) == 0 and not self._closed:
+                self._cond.wait()
+            if len(self._queue) == 0:
+                return None
+            # wait for more windows after the first one arrives, unless the batch is full
+            deadline = self._queue[0].start + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # the windows of different sizes(e.g. the streams without the resize) wait for their own batches
+            shape = self._queue[0].window.shape
+            batch, others = [], deque()
+            while len(self._queue) > 0 and len(batch) < self.max_batch_size:
+                request = self._queue.popleft()
+                (batch if request.window.shape == shape else others).append(request)
+            self._queue.extendleft(reversed(others))
+            return batch
+
+    def _resolve(self, stream_id):
+        """Record the results at the head of the pending requests of the stream, until the first window waiting for the model.
+        It is called with the _record_lock.
+        Returns:
+            resolved(list): The (request, result) pairs, the result is None if the request failed
+        """
+        pending = self._pending.get(stream_id)
+        resolved = []
+        while pending and pending[0].done:
+            request = pending.popleft()
+            if request.skip is not None and request.state.last_score is None and request.error is None:
+                # the windows before it failed, so there is no score to keep
+                request.error = Exception(f'No score of the stream {stream_id} before the skipped frame {request.frame_index}')
+            if request.error is not None:
+                resolved.append((request, None))
+                continue
+            score = request.score if request.skip is None else self.service.skipped_score(request.state, request.skip)
+            result = self.service.record_result(request.state, request.frame_index, score, request.start, skipped=request.skip is not None)
+            self.latency.update(result.latency)
+            resolved.append((request, result))
+        if not pending:
+            self._pending.pop(stream_id, None)
+        return resolved
+
+    @staticmethod
+    def _finish(resolved):
+        for request, result in resolved:
+            if result is None:
+                request.future.set_exception(request.error)
+            else:
+                request.future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                with torch.no_grad():
+                    # the batch keeps the order of the frames of each stream, which the incremental encoder needs
+                    scores = self.service.score_stream_windows([request.state for request in batch], [request.frame_index for request in batch],
+                                                               torch.stack([request.window for request in batch], dim=0))
+                scores = [float(score) for score in scores]
+            except Exception as e:
+                logger.error(f'Failed to score the batch of {len(batch)} windows: {e}')
+                scores = None
+                for request in batch:
+                    request.error = e
+            else:
+                self.num_batches += 1
+                self.num_windows += len(batch)
+            resolved = []
+            with self._record_lock:
+                for i, request in enumerate(batch):
+                    request.window = None
+                    request.score = scores[i] if scores is not None else None
+                    request.done = True
+                for stream_id in OrderedDict.fromkeys(request.state.stream_id for request in batch):
+                    resolved.extend(self._resolve(stream_id))
+            self._finish(resolved)
+
+    def stats(self):
+        """Returns:
+            stats(dict): The queue depth(now and max), the batch fill ratio(the mean batch size / max_batch_size),
+                the number of the batches and the p50/p99 latency in seconds
+        """
+        latency = self.latency.summary()
+        fill_ratio = self.num_windows / (self.num_batches * self.max_batch_size) if self.num_batches > 0 else 0.0
+        return {'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth, 'batches': self.num_batches, 'windows': self.num_windows,
+                'fill_ratio': fill_ratio, 'p50': latency['p50'], 'p99': latency['p99']}
+
+    def close(self):
+        """Score the waiting windows and stop the thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        stats = self.stats()
+        logger.info(f'Close the scheduler: {stats["windows"]} windows in {stats["batches"]} batches, fill ratio:{stats["fill_ratio"]:.2f}, '
+                    f'latency p50:{stats["p50"] * 1000:.2f}ms, p99:{stats["p99"] * 1000:.2f}ms')
+        return stats
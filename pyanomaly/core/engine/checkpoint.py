@@ -0,0 +1,323 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The fast-resume checkpoint format.
+torch.load deserializes the whole file before the engine picks the networks it needs, e.g. the service only needs G but it also loads D, F and the optimizers.
+In this format, each top-level key of the checkpoint(G, D, optimizer_G, step, ...) is pickled separately without the tensors,
+and the tensors are stored as raw contiguous buffers which are memory-mapped when loading.
+So only the keys which are used are unpickled, and the weights are read from the disk when they are copied into the networks.
+Layout: magic(8 bytes) | version(uint32) | header length(uint32) | json header | aligned buffers
+For example, compare the cold-start time of the two formats:
+    python -m pyanomaly.core.engine.checkpoint convert ./output/best_ped2_anopred.pth ./output/best_ped2_anopred.fast.pth
+    python -m pyanomaly.core.engine.checkpoint benchmark ./output/best_ped2_anopred.pth ./output/best_ped2_anopred.fast.pth --keys G
+"""
+import io
+import os
+import json
+import time
+import struct
+import pickle
+import argparse
+import numpy as np
+import torch
+from collections import OrderedDict
+from collections.abc import Mapping
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['LazyCheckpoint', 'save_fast_checkpoint', 'is_fast_checkpoint', 'load_fast_checkpoint', 'load_checkpoint']
+
+_FAST_MAGIC = b'PYACKPT\x00'
+_FAST_VERSION = 1
+_FAST_ALIGN = 64
+
+
+def _align(value):
+    return value + (-value) % _FAST_ALIGN
+
+
+class _TensorPickler(pickle.Pickler):
+    """Pickle the object and take the tensors out of it.
+    """
+    def __init__(self, file):
+        super(_TensorPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tensors = []
+        self._index = dict()
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, torch.Tensor):
+            return None
+        # the tensors shared in the object are stored once
+        key = id(obj)
+        if key not in self._index:
+            self._index[key] = len(self.tensors)
+            self.tensors.append(obj)
+        return self._index[key]
+
+
+# the classes which can be made by unpickling the checkpoint, like the weights_only unpickler of torch.load
+# the state dicts of the networks, the optimizers, the lr schedulers(e.g. the milestones of MultiStepLR) and the data stream only use them
+_SAFE_GLOBALS = {
+    ('collections', 'OrderedDict'),
+    ('collections', 'Counter'),
+    ('builtins', 'set'),
+    ('builtins', 'frozenset'),
+    ('builtins', 'slice'),
+    ('builtins', 'complex'),
+    ('torch', 'Size'),
+    ('torch', 'device'),
+    ('numpy', 'dtype'),
+    ('numpy', 'ndarray'),
+    ('numpy.core.multiarray', 'scalar'),
+    ('numpy.core.multiarray', '_reconstruct'),
+    ('numpy._core.multiarray', 'scalar'),
+    ('numpy._core.multiarray', '_reconstruct'),
+    ('numpy.core.numeric', '_frombuffer'),
+    ('numpy._core.numeric', '_frombuffer'),
+}
+
+
+class _TensorUnpickler(pickle.Unpickler):
+    """Unpickle the object and put the tensors back.
+    Only the classes in the _SAFE_GLOBALS and the dtypes of torch can be loaded, so the file can not run any code.
+    """
+    def __init__(self, file, tensors):
+        super(_TensorUnpickler, self).__init__(file)
+        self.tensors = tensors
+
+    def persistent_load(self, pid):
+        return self.tensors(pid)
+
+    def find_class(self, module, name):
+        if (module, name) in _SAFE_GLOBALS or (module == 'torch' and isinstance(getattr(torch, name, None), torch.dtype)):
+            return super(_TensorUnpickler, self).find_class(module, name)
+        raise pickle.UnpicklingError(f'The global {module}.{name} is not allowed in the fast checkpoint')
+
+
+def _tensor_bytes(tensor):
+    tensor = tensor.detach().cpu().contiguous().reshape(-1)
+    if tensor.numel() == 0:
+        return b''
+    return tensor.view(torch.uint8).numpy().tobytes()
+
+
+def save_fast_checkpoint(checkpoint, path):
+    """Save the checkpoint in the fast-resume format.
+    Args:
+        checkpoint(dict): The checkpoint made by the engine_save, the keys should be str
+        path(str): The path of the file
+    Returns:
+        bytes_written(int)
+    """
+    entries = []
+    buffers = []
+    offset = 0
+    for key, value in checkpoint.items():
+        assert isinstance(key, str), f'The key of the checkpoint should be str, but got {type(key)}'
+        f = io.BytesIO()
+        pickler = _TensorPickler(f)
+        pickler.dump(value)
+        blob = f.getvalue()
+        entry = OrderedDict(key=key, blob=[offset, len(blob)], tensors=[])
+        buffers.append((offset, blob))
+        offset = _align(offset + len(blob))
+        for tensor in pickler.tensors:
+            data = _tensor_bytes(tensor)
+            entry['tensors'].append([offset, len(data), str(tensor.dtype).replace('torch.', ''), list(tensor.shape)])
+            buffers.append((offset, data))
+            offset = _align(offset + len(data))
+        entries.append(entry)
+
+    header = OrderedDict(entries=entries, data_size=offset)
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_len = len(_FAST_MAGIC) + 8 + len(header_bytes)
+    header_bytes += b' ' * ((-prefix_len) % _FAST_ALIGN)
+    data_start = prefix_len + (-prefix_len) % _FAST_ALIGN
+
+    with open(path, 'wb') as f:
+        f.write(_FAST_MAGIC)
+        f.write(struct.pack('<II', _FAST_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for buffer_offset, data in buffers:
+            f.seek(data_start + buffer_offset)
+            f.write(data)
+        f.truncate(data_start + offset)
+    return data_start + offset
+
+
+def is_fast_checkpoint(path):
+    """Check whether the file is written by save_fast_checkpoint.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(_FAST_MAGIC)) == _FAST_MAGIC
+
+
+class LazyCheckpoint(Mapping):
+    """The checkpoint loaded by load_fast_checkpoint.
+    It can be used as the dict returned by torch.load. The value of one key is unpickled when it is used for the first time,
+    and its tensors are the views of the memory-mapped file, which are read from the disk when they are copied into the networks.
+    Args:
+        path(str): The path of the file
+        mmap(bool): Memory-map the file, otherwise the whole file is read into the memory
+    """
+    def __init__(self, path, mmap=True):
+        with open(path, 'rb') as f:
+            magic = f.read(len(_FAST_MAGIC))
+            if magic != _FAST_MAGIC:
+                raise Exception(f'{path} is not a fast checkpoint file')
+            version, header_len = struct.unpack('<II', f.read(8))
+            if version > _FAST_VERSION:
+                raise Exception(f'Not support the version {version} of {path}')
+            header = json.loads(f.read(header_len).decode('utf-8'), object_pairs_hook=OrderedDict)
+        data_start = len(_FAST_MAGIC) + 8 + header_len
+        data_size = header['data_size']
+        if data_size == 0:
+            self._data = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            # copy-on-write, so the tensors are writable and the file is never changed
+            self._data = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start, shape=(data_size,))
+        else:
+            self._data = np.fromfile(path, dtype=np.uint8, offset=data_start, count=data_size)
+        self.path = path
+        self._entries = OrderedDict((entry['key'], entry) for entry in header['entries'])
+        self._cache = dict()
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._materialize(self._entries[key])
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _tensor(self, spec):
+        offset, nbytes, dtype, shape = spec
+        dtype = getattr(torch, dtype)
+        if nbytes == 0:
+            return torch.empty(shape, dtype=dtype)
+        return torch.from_numpy(self._data[offset:offset + nbytes]).view(dtype).reshape(shape)
+
+    def _materialize(self, entry):
+        specs = entry['tensors']
+        tensors = dict()
+        def get_tensor(index):
+            if index not in tensors:
+                tensors[index] = self._tensor(specs[index])
+            return tensors[index]
+        offset, nbytes = entry['blob']
+        unpickler = _TensorUnpickler(io.BytesIO(self._data[offset:offset + nbytes].tobytes()), get_tensor)
+        return unpickler.load()
+
+    def copy(self):
+        """Get the dict of all keys, used by the load_state_dict when the checkpoint is a state dict.
+        """
+        return OrderedDict((key, self[key]) for key in self)
+
+    def materialize(self):
+        """Get the dict of all keys and copy the tensors out of the file.
+        """
+        return OrderedDict((key, _clone_tensors(self[key])) for key in self)
+
+
+def _clone_tensors(value):
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    if isinstance(value, dict):
+        cloned = type(value)((k, _clone_tensors(v)) for k, v in value.items())
+        if hasattr(value, '_metadata'):
+            cloned._metadata = value._metadata
+        return cloned
+    if isinstance(value, (list, tuple)):
+        return type(value)(_clone_tensors(v) for v in value)
+    return value
+
+
+def load_fast_checkpoint(path, mmap=True):
+    """Load the file written by save_fast_checkpoint.
+    Args:
+        path(str): The path of the file
+        mmap(bool): Memory-map the file
+    Returns:
+        checkpoint(LazyCheckpoint)
+    """
+    return LazyCheckpoint(path, mmap=mmap)
+
+
+def load_checkpoint(path, map_location=None):
+    """Load the checkpoint or the model file in either the torch format or the fast format.
+    Args:
+        path(str): The path of the file
+        map_location: Used by torch.load, the tensors in the fast format are always on the cpu
+    Returns:
+        checkpoint(dict|LazyCheckpoint)
+    """
+    if is_fast_checkpoint(path):
+        logger.info(f'=> Use the fast checkpoint:{path}')
+        return load_fast_checkpoint(path)
+    return torch.load(path, map_location=map_location)
+
+
+def _touch(value):
+    # read every tensor, so the time of reading the disk is counted
+    if isinstance(value, torch.Tensor):
+        return float(value.float().sum()) if value.numel() > 0 else 0.0
+    if isinstance(value, dict):
+        return sum(_touch(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_touch(v) for v in value)
+    return 0.0
+
+
+def benchmark(paths, keys=None, repeat=3):
+    """Compare the time of loading the checkpoints.
+    The page cache makes the later runs faster, so drop it(echo 3 > /proc/sys/vm/drop_caches) to measure the real cold start.
+    Args:
+        paths(list): The checkpoint files
+        keys(list): The keys used by the process, e.g. ['G'] for the service. None means all of the keys
+        repeat(int): The times of loading
+    Returns:
+        results(OrderedDict): {path: the best time in seconds}
+    """
+    results = OrderedDict()
+    for path in paths:
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            checkpoint = load_checkpoint(path, map_location='cpu')
+            used = list(checkpoint.keys()) if keys is None else keys
+            for key in used:
+                _touch(checkpoint[key])
+            timings.append(time.time() - start)
+            del checkpoint
+        results[path] = min(timings)
+        logger.info(f'{path}: {min(timings):.4f}s(best of {repeat}), keys:{"all" if keys is None else keys}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the checkpoints into the fast format, or compare the time of loading them')
+    subparsers = parser.add_subparsers(dest='command')
+    convert_parser = subparsers.add_parser('convert', help='convert a torch checkpoint into the fast format')
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('target')
+    benchmark_parser = subparsers.add_parser('benchmark', help='compare the time of loading the checkpoints')
+    benchmark_parser.add_argument('paths', nargs='+')
+    benchmark_parser.add_argument('--keys', nargs='*', default=None, help='the keys used by the process, default is all')
+    benchmark_parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'convert':
+        checkpoint = torch.load(args.source, map_location='cpu')
+        size = save_fast_checkpoint(checkpoint, args.target)
+        logger.info(f'Convert {args.source} => {args.target}({size / 2**20:.1f}MB)')
+    elif args.command == 'benchmark':
+        benchmark(args.paths, args.keys, args.repeat)
+    else:
+        parser.print_help()
@@ -24,6 +24,8 @@ class EngineAPI(object):
         self.model_name = self.cfg.MODEL.name
         self.is_training = is_training
         self.phase = 'TRAIN' if self.is_training else 'VAL'
+        if not self.is_training and self.cfg.SERVICE.use:
+            self.phase = 'SERVICE'
         self.engine_name = self.cfg.get(self.phase)['engine_name']
     
     def build(self):
@@ -5,6 +5,7 @@
 from .amc import *
 from .anopcn import *
 from .anopred import *
+from .cascade import *
 from .memae import *
 from .ocae import *
 from .stae import *
\ No newline at end of file
@@ -19,11 +19,11 @@ from torch.utils.data import DataLoader
 
 from pyanomaly.core.utils import AverageMeter, flow_batch_estimate, tensorboard_vis_images, make_info_message, ParamSet
 from pyanomaly.datatools.evaluate.utils import psnr_error
-from ..abstract.base_engine import BaseTrainer, BaseInference
+from ..abstract.base_engine import BaseTrainer, BaseInference, BaseService
 
 from ..engine_registry import ENGINE_REGISTRY
 
-__all__ = ['ANOPCNTrainer', 'ANOPCNInference']
+__all__ = ['ANOPCNTrainer', 'ANOPCNInference', 'ANOPCNService']
 @ENGINE_REGISTRY.register()
 class ANOPCNTrainer(BaseTrainer):
     NAME = ["ANOPCN.TRAIN"]
@@ -33,6 +33,10 @@ class ANOPCNTrainer(BaseTrainer):
         self.loss_predmeter_D = AverageMeter(name='loss_pred_D')
         self.loss_refinemeter_G = AverageMeter(name='loss_refine_G')
         self.loss_refinemeter_D = AverageMeter(name='loss_refine_D')
+        # the pcm and the erm update the same optimizers, so the accumulation window should not cross the two stages
+        accumulate_steps = self.accumulate_state.accumulate_steps
+        assert all(step % accumulate_steps == 0 for step in self.steps.param['dynamic_steps']), \
+            f'The TRAIN.dynamic_steps {self.steps.param["dynamic_steps"]} should be the multiples of the TRAIN.accumulate_steps {accumulate_steps}'
 
     def train(self,current_step):
         # Pytorch [N, C, D, H, W]
@@ -51,6 +55,13 @@ class ANOPCNTrainer(BaseTrainer):
         elif temp_step in range(dynamic_steps[1], dynamic_steps[2]):
             self.train_erm(current_step)
     
+    def prepare_frozen(self, data):
+        # the optical flow between the t-1 frame and the t frame, used by both of the pcm and the erm
+        gtFlowEstim = torch.cat([data[:, :, -2, :, :], data[:, :, -1, :, :]], 1)
+        gtFlow_vis, gtFlow = flow_batch_estimate(self.F, gtFlowEstim, self.normalize.param['train'], 
+                                                 output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
+        return {'gtFlow_vis': gtFlow_vis, 'gtFlow': gtFlow}
+
     def train_pcm(self, current_step):
         # Pytorch [N, C, D, H, W]
         # initialize
@@ -65,24 +76,22 @@ class ANOPCNTrainer(BaseTrainer):
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
         
         # get the data
-        data, anno, meta = next(self._train_loader_iter)  # the core for dataloader
+        data, anno, meta, frozen = self.next_batch()  # the core for dataloader
         self.data_time.update(time.time() - start)
         
         # base on the D to get each frame
-        target = data[:, :, -1, :, :].cuda() # t frame 
-        pred_last = data[:, :, -2, :, :].cuda() # t-1 frame
-        input_data = data[:, :, :-1, :, :].cuda() # 0 ~ t-1 frame
-        # input_data = data.cuda() # 0 ~ t frame
+        target = data[:, :, -1, :, :].to(self.device) # t frame 
+        pred_last = data[:, :, -2, :, :].to(self.device) # t-1 frame
+        input_data = data[:, :, :-1, :, :].to(self.device) # 0 ~ t-1 frame
+        # input_data = data.to(self.device) # 0 ~ t frame
         
         # True Process =================Start===================
         #---------update optim_G ---------
         self.set_requires_grad(self.D, False)
         output_predframe_G, _ = self.G(input_data, target)
         
-        predFlowEstim = torch.cat([pred_last, output_predframe_G],1).cuda()
-        gtFlowEstim = torch.cat([pred_last, target], 1).cuda()
-        gtFlow_vis, gtFlow = flow_batch_estimate(self.F, gtFlowEstim, self.normalize.param['train'], 
-                                                 output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
+        predFlowEstim = torch.cat([pred_last, output_predframe_G],1).to(self.device)
+        gtFlow_vis, gtFlow = frozen['gtFlow_vis'], frozen['gtFlow']
         predFlow_vis, predFlow = flow_batch_estimate(self.F, predFlowEstim, self.normalize.param['train'], 
                                                  output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
         
@@ -139,9 +148,6 @@ class ANOPCNTrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        self.saved_model = {'G':self.G, 'D':self.D}
-        self.saved_optimizer = {'optim_G': self.optimizer_G, 'optim_D': self.optimizer_D}
-        self.saved_loss = {'loss_G':self.loss_predmeter_G.val, 'loss_D':self.loss_predmeter_D.val}
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
 
     def train_erm(self, current_step):
@@ -158,25 +164,23 @@ class ANOPCNTrainer(BaseTrainer):
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
         
         # get the data
-        data, _ = next(self._train_loader_iter)  # the core for dataloader
+        data, anno, meta, frozen = self.next_batch()  # the core for dataloader
         self.data_time.update(time.time() - start)
         
         # base on the D to get each frame
-        target = data[:, :, -1, :, :].cuda() # t frame 
-        pred_last = data[:, :, -2, :, :].cuda() # t-1 frame
-        input_data = data[:, :, :-1, :, :].cuda() # 0 ~ t-1 frame
-        # input_data = data.cuda() # 0 ~ t frame
+        target = data[:, :, -1, :, :].to(self.device) # t frame 
+        pred_last = data[:, :, -2, :, :].to(self.device) # t-1 frame
+        input_data = data[:, :, :-1, :, :].to(self.device) # 0 ~ t-1 frame
+        # input_data = data.to(self.device) # 0 ~ t frame
         
         # True Process =================Start===================
         #---------update optim_G ---------
         self.set_requires_grad(self.D, False)
         _, output_refineframe_G = self.G(input_data, target)
         
-        gtFlowEstim = torch.cat([pred_last, target], 1).cuda()
-        predFlowEstim = torch.cat([pred_last, output_refineframe_G],1).cuda()
+        predFlowEstim = torch.cat([pred_last, output_refineframe_G],1).to(self.device)
 
-        gtFlow_vis, gtFlow = flow_batch_estimate(self.F, gtFlowEstim, self.normalize.param['train'], 
-                                                 output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
+        gtFlow_vis, gtFlow = frozen['gtFlow_vis'], frozen['gtFlow']
         predFlow_vis, predFlow = flow_batch_estimate(self.F, predFlowEstim, self.normalize.param['train'], 
                                                      output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
         
@@ -234,15 +238,6 @@ class ANOPCNTrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        # self.saved_model = {'G':self.G, 'D':self.D}
-        self.saved_model['G'] = self.G
-        self.saved_model['D'] = self.D
-        # self.saved_optimizer = {'optim_G': self.optimizer_G, 'optim_D': self.optimizer_D}
-        self.saved_optimizer['optimizer_G'] = self.optimizer_G
-        self.saved_optimizer['optimizer_D'] = self.optimizer_D
-        # self.saved_loss = {'loss_G':self.loss_refinemeter_G.val, 'loss_D':self.loss_refinemeter_D.val}
-        self.saved_loss['loss_G'] = self.loss_refinemeter_G.val
-        self.saved_loss['loss_D'] = self.loss_refinemeter_D.val
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
 
 @ENGINE_REGISTRY.register()
@@ -251,4 +246,49 @@ class ANOPCNInference(BaseInference):
     def inference(self):
         for h in self._hooks:
             h.inference()
+
+
+@ENGINE_REGISTRY.register()
+class ANOPCNService(BaseService):
+    """The service of AnoPCN.
+    With SERVICE.stateful, the PCM of each stream carries its ConvLSTM state from frame to frame, so one frame costs two steps of the PCM
+    instead of the recurrence over the whole window. The 'window' of the frame is [C, 2, H, W]: the prediction of the frame and the frame,
+    and the ERM refines the prediction in the score_windows, so the batching, the motion gate and the adaptive stride work in the same way.
+    The state is re-seeded from the zero state every window_length - 1 frames(the input frames of the window), so it never holds more than
+    2 * (window_length - 1) - 1 frames, and the score is the same as the windowed one on every (window_length - 1)-th frame.
+    """
+    NAME = ["ANOPCN.SERVICE"]
+    def custom_setup(self):
+        self.window_length = self.config.DATASET.val.clip_length
+        self.stateful = self.config.SERVICE.stateful
+        # the streaming methods are on the model, not on the DataParallel
+        self.anopcn = getattr(self.G, 'module', self.G)
+
+    def buffer_frame(self, stream_id, frame):
+        if not self.stateful:
+            return super(ANOPCNService, self).buffer_frame(stream_id, frame)
+        state = self.open_stream(stream_id)
+        frame = self.preprocess_frame(frame)
+        frame_index = state.num_frames
+        state.num_frames += 1
+        with torch.no_grad():
+            prediction = self.anopcn.stream_predict(stream_id, frame.unsqueeze(0), horizon=self.window_length - 1)
+        if prediction is None:
+            return state, frame_index, None
+        return state, frame_index, torch.stack([prediction[0], frame], dim=1)
+
+    def close_stream(self, stream_id):
+        self.anopcn.reset_stream(stream_id)
+        return super(ANOPCNService, self).close_stream(stream_id)
+
+    def score_windows(self, windows):
+        target = windows[:, :, -1, :, :]
+        if self.stateful:
+            # the windows are the predictions and the frames
+            output = self.anopcn.refine(windows[:, :, 0, :, :], target)
+        else:
+            _, output = self.G(windows[:, :, :-1, :, :], target)
+        # the psnr is high on the normal frames
+        scores = [-float(psnr_error(output[i:i+1], target[i:i+1], hat=False)) for i in range(windows.shape[0])]
+        return np.array(scores, dtype=np.float32)
     
\ No newline at end of file
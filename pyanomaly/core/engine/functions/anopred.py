@@ -17,12 +17,12 @@ from torch.utils.data import DataLoader
 # torch.autograd.set_detect_anomaly(True)
 
 from pyanomaly.core.utils import AverageMeter, flow_batch_estimate, tensorboard_vis_images, make_info_message, ParamSet
-# from pyanomaly.datatools.evaluate.utils import psnr_error
-from ..abstract.base_engine import BaseTrainer, BaseInference
+from pyanomaly.datatools.evaluate.utils import psnr_error
+from ..abstract.base_engine import BaseTrainer, BaseInference, BaseService
 
 from ..engine_registry import ENGINE_REGISTRY
 
-__all__ = ['ANOPREDTrainer', 'ANOPREDInference']
+__all__ = ['ANOPREDTrainer', 'ANOPREDInference', 'ANOPREDService']
 
 @ENGINE_REGISTRY.register()
 class ANOPREDTrainer(BaseTrainer):
@@ -36,6 +36,12 @@ class ANOPREDTrainer(BaseTrainer):
         self.optical = ParamSet(name='optical', size=self.config.DATASET.optical_size, output_format=self.config.DATASET.optical_format)
 
     
+    def prepare_frozen(self, data):
+        # the optical flow between the t frame and the t+1 frame
+        gtFlowEstim = torch.cat([data[:, :, -2, :, :], data[:, :, -1, :, :]], 1)
+        gtFlow_vis, gtFlow = flow_batch_estimate(self.F, gtFlowEstim, self.normalize.param['train'], output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
+        return {'gtFlow_vis': gtFlow_vis, 'gtFlow': gtFlow}
+
     def train(self,current_step):
         # Pytorch [N, C, D, H, W]
         # initialize
@@ -49,17 +55,17 @@ class ANOPREDTrainer(BaseTrainer):
         writer = self.kwargs['writer_dict']['writer']
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
 
-        # get the data
-        data, anno, meta = next(self._train_loader_iter) 
+        # get the data, the optical flow of the target is computed with it
+        data, anno, meta, frozen = self.next_batch()
         self.data_time.update(time.time() - start)
 
         # base on the D to get each frame
-        target = data[:, :, -1, :, :].cuda() # t+1 frame 
+        target = data[:, :, -1, :, :].to(self.device) # t+1 frame 
         input_data = data[:, :, :-1, :, :] # 0 ~ t frame
-        input_last = input_data[:, :, -1, :, :].cuda() # t frame
+        input_last = input_data[:, :, -1, :, :].to(self.device) # t frame
 
         # squeeze the D dimension to C dimension, shape comes to [N, C, H, W]
-        input_data = input_data.reshape(input_data.shape[0], -1, input_data.shape[-2], input_data.shape[-1]).cuda()
+        input_data = input_data.reshape(input_data.shape[0], -1, input_data.shape[-2], input_data.shape[-1]).to(self.device)
 
         # True Process =================Start===================
         #---------update optim_G ---------
@@ -67,8 +73,7 @@ class ANOPREDTrainer(BaseTrainer):
         output_pred_G = self.G(input_data)
         # import ipdb; ipdb.set_trace()
         predFlowEstim = torch.cat([input_last, output_pred_G],1)
-        gtFlowEstim = torch.cat([input_last, target], 1)
-        gtFlow_vis, gtFlow = flow_batch_estimate(self.F, gtFlowEstim, self.normalize.param['train'], output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
+        gtFlow_vis, gtFlow = frozen['gtFlow_vis'], frozen['gtFlow']
         predFlow_vis, predFlow = flow_batch_estimate(self.F, predFlowEstim, self.normalize.param['train'], output_format=self.config.DATASET.optical_format, optical_size=self.config.DATASET.optical_size)
 
         loss_g_adv = self.GANLoss(self.D(output_pred_G), True)
@@ -126,15 +131,6 @@ class ANOPREDTrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        # self.saved_model = {'G':self.G, 'D':self.D}
-        self.saved_model['G'] = self.G
-        self.saved_model['D'] = self.D
-        # self.saved_optimizer = {'optim_G': self.optimizer_G, 'optim_D': self.optimizer_D}
-        self.saved_optimizer['optimizer_G'] = self.optimizer_G
-        self.saved_optimizer['optimizer_D'] = self.optimizer_D
-        # self.saved_loss = {'loss_G':self.loss_meter_G.val, 'loss_D':self.loss_meter_D.val}
-        self.saved_loss['loss_G'] = self.loss_meter_G.val
-        self.saved_loss['loss_D'] = self.loss_meter_D.val
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
     
 @ENGINE_REGISTRY.register()
@@ -142,4 +138,19 @@ class ANOPREDInference(BaseInference):
     NAME = ["ANOPRED.INFERENCE"]    
     def inference(self):
         for h in self._hooks:
-            h.inference()
\ No newline at end of file
+            h.inference()
+
+@ENGINE_REGISTRY.register()
+class ANOPREDService(BaseService):
+    NAME = ["ANOPRED.SERVICE"]
+    def custom_setup(self):
+        self.window_length = self.config.DATASET.val.clip_length
+
+    def score_windows(self, windows):
+        # predict the last frame with the previous ones
+        target = windows[:, :, -1, :, :]
+        inputs = windows[:, :, :-1, :, :].reshape(windows.shape[0], -1, windows.shape[-2], windows.shape[-1])
+        output = self.G(inputs)
+        # the psnr is high on the normal frames
+        scores = [-float(psnr_error(output[i:i+1], target[i:i+1], hat=True)) for i in range(windows.shape[0])]
+        return np.array(scores, dtype=np.float32)
@@ -0,0 +1,226 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The cascade of a cheap model and an expensive model.
+The cheap stage(e.g. STAE, MemAE) scores all of the frames of the val videos, and only the segments around the frames with the highest cheap scores
+are scored by the expensive stage(e.g. AMC, AnoPred which need the optical flow or the large generator), then the two scores are fused.
+Each stage is the service engine of its model(built with its own config and model file), so the windows are scored in the same way as the service.
+The cost per frame and the AUC of the cascade are compared with the ones of each stage alone.
+"""
+import os
+import csv
+import math
+import time
+import numpy as np
+import torch
+from collections import OrderedDict
+
+from pyanomaly.core.utils import save_score_results
+from pyanomaly.datatools.abstract.readers import GroundTruthLoader
+from pyanomaly.datatools.evaluate.batch_eval import compute_frame_auc
+from ..abstract.abstract_engine import AbstractInference
+from ..streaming import FileFrameSource
+from ..engine_registry import ENGINE_REGISTRY
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['CascadeInference', 'escalate_segments', 'fuse_scores']
+
+TABLE_FIELDS = ['stage', 'escalated_ratio', 'seconds_per_frame', 'auc']
+_FUSIONS = ('weighted', 'max', 'replace')
+
+
+def _minmax(scores):
+    scores = np.asarray(scores, dtype=np.float64)
+    value_range = scores.max() - scores.min()
+    return (scores - scores.min()) / value_range if value_range > 0 else np.zeros_like(scores)
+
+
+def escalate_segments(scores, escalate_ratio, segment_length):
+    """Choose the frames scored by the expensive stage.
+    Args:
+        scores(np.ndarray): [T] the cheap scores of the video, higher means more abnormal
+        escalate_ratio(float): The ratio of the frames with the highest scores, the segments are centered at them
+        segment_length(int): The number of the frames in each segment
+    Returns:
+        mask(np.ndarray): [T] bool, whether the frame is escalated
+    """
+    num_frames = len(scores)
+    mask = np.zeros(num_frames, dtype=bool)
+    num_top = min(num_frames, int(math.ceil(escalate_ratio * num_frames)))
+    if num_top <= 0:
+        return mask
+    half = max(1, int(segment_length)) // 2
+    for index in np.argsort(np.asarray(scores), kind='stable')[-num_top:]:
+        mask[max(0, index - half):min(num_frames, index - half + max(1, int(segment_length)))] = True
+    return mask
+
+
+def fuse_scores(cheap, expensive, mask, fusion='weighted', weight=0.5):
+    """Fuse the scores of the two stages of one video.
+    The cheap scores are normalized to [0, 1], and the expensive scores are mapped to the range of the normalized cheap scores on the escalated frames,
+    so the escalated frames keep the scale of the cheap stage.
+    Args:
+        cheap(np.ndarray): [T] the cheap scores, higher means more abnormal
+        expensive(np.ndarray): [N] the expensive scores of the escalated frames, N = mask.sum()
+        mask(np.ndarray): [T] the escalated frames
+        fusion(str): 'weighted': (1 - weight) * cheap + weight * expensive, 'max': the max of them, 'replace': the expensive score
+    Returns:
+        scores(np.ndarray): [T] the fused scores in [0, 1]
+    """
+    assert fusion in _FUSIONS, f'Not support the fusion:{fusion}'
+    fused = _minmax(cheap)
+    if mask.sum() == 0:
+        return fused
+    low, high = fused[mask].min(), fused[mask].max()
+    expensive = low + (high - low) * _minmax(expensive)
+    if fusion == 'weighted':
+        fused[mask] = (1 - weight) * fused[mask] + weight * expensive
+    elif fusion == 'max':
+        fused[mask] = np.maximum(fused[mask], expensive)
+    else:
+        fused[mask] = expensive
+    return fused
+
+
+@ENGINE_REGISTRY.register()
+class CascadeInference(AbstractInference):
+    """Evaluate the cascade on the val videos, the options are in the CASCADE config.
+    The model of the config is the cheap stage when CASCADE.cheap.cfg_file is '', and the expensive stage is built from CASCADE.expensive.cfg_file.
+    """
+    NAME = ["CASCADE.INFERENCE"]
+
+    def __init__(self, **kwargs):
+        self._hooks = []
+        self.config = kwargs['config']
+        self.kwargs = kwargs
+        self.verbose = kwargs['verbose']
+        self.config_name = kwargs['config_name']
+        self.result_path = ''
+        self.cascade = self.config.CASCADE
+        assert self.cascade.fusion in _FUSIONS, f'Not support the fusion:{self.cascade.fusion}'
+        self.cheap = self._build_stage(self.cascade.cheap, kwargs['model_dict'])
+        self.expensive = self._build_stage(self.cascade.expensive)
+
+    def _build_stage(self, stage_cfg, model_dict=None):
+        """Build the service engine of one stage.
+        Args:
+            stage_cfg: The CASCADE.cheap or CASCADE.expensive config
+            model_dict(OrderedDict): The models of this config, used when the stage uses this config
+        """
+        from pyanomaly import ModelAPI
+        from pyanomaly.config import update_config
+        if stage_cfg.cfg_file == '':
+            config = self.config.clone()
+        else:
+            config = update_config(stage_cfg.cfg_file, [])
+            model_dict = None
+        config.defrost()
+        config.VAL.model_file = stage_cfg.model_file
+        if model_dict is None:
+            model_dict = ModelAPI(config)()
+        service = ENGINE_REGISTRY.get(stage_cfg.engine_name)
+        logger.info(f'Build the stage {stage_cfg.engine_name} with the model file: {stage_cfg.model_file}')
+        return service(model_dict=model_dict, config=config, parallel=False, verbose=self.verbose, config_name=self.config_name, hooks=[], evaluate_function=None)
+
+    def run(self, *args):
+        """Evaluate the cascade once, the steps given by the main function are not used.
+        """
+        super(CascadeInference, self).run()
+
+    def _read_video(self, video_path):
+        # the frames are processed by each stage, and kept on the cpu
+        cheap_frames, expensive_frames = [], []
+        for frame in FileFrameSource(video_path):
+            cheap_frames.append(self.cheap.preprocess_frame(frame).cpu())
+            expensive_frames.append(self.expensive.preprocess_frame(frame).cpu())
+        return torch.stack(cheap_frames, dim=0), torch.stack(expensive_frames, dim=0)
+
+    def score_frames(self, service, frames, indices):
+        """Score the windows which end at the frames.
+        The frames before the first full window use the score of the first window, the same as the service.
+        Args:
+            service(BaseService): The stage
+            frames(torch.Tensor): [T, C, H, W] the processed frames of the video
+            indices(np.ndarray): The indices of the scored frames
+        Returns:
+            scores(np.ndarray): [len(indices)], higher means more abnormal
+            seconds(float): The time of the model
+        """
+        window_length = service.window_length
+        if len(indices) == 0 or len(frames) < window_length:
+            return np.zeros(len(indices), dtype=np.float64), 0.0
+        ends, inverse = np.unique(np.maximum(np.asarray(indices), window_length - 1), return_inverse=True)
+        batch_size = max(1, self.cascade.batch_size)
+        scores, seconds = [], 0.0
+        for i in range(0, len(ends), batch_size):
+            windows = torch.stack([frames[end - window_length + 1:end + 1].permute(1, 0, 2, 3) for end in ends[i:i + batch_size]], dim=0)
+            start = time.perf_counter()
+            with torch.no_grad():
+                # the scores are numpy arrays, so the device is synchronized
+                scores.append(np.asarray(service.score_windows(windows.to(service.device)), dtype=np.float64))
+            seconds += time.perf_counter() - start
+        return np.concatenate(scores)[inverse], seconds
+
+    def inference(self):
+        cfg = self.config
+        data_path = cfg.DATASET.val.data_path
+        video_list = sorted(item for item in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, item)))
+        gt = GroundTruthLoader(cfg.DATASET.gt_cache_dir).read(cfg.DATASET.name, cfg.DATASET.val.gt_path, data_path)
+        assert len(video_list) == len(gt), f'The number of videos does not match the ground truth, {len(video_list)} != {len(gt)}'
+        compare = self.cascade.compare_stages
+
+        records = OrderedDict((key, []) for key in ['cheap', 'expensive', 'cascade'])
+        seconds = OrderedDict((key, 0.0) for key in records.keys())
+        num_frames, num_escalated = 0, 0
+        for video_name in video_list:
+            cheap_frames, expensive_frames = self._read_video(os.path.join(data_path, video_name))
+            all_frames = np.arange(len(cheap_frames))
+            cheap, cheap_seconds = self.score_frames(self.cheap, cheap_frames, all_frames)
+            mask = escalate_segments(cheap, self.cascade.escalate_ratio, self.cascade.segment_length)
+            escalated = np.nonzero(mask)[0]
+            if compare:
+                # the expensive stage scores all of the frames once, and the cascade takes the escalated ones
+                dense, dense_seconds = self.score_frames(self.expensive, expensive_frames, all_frames)
+                expensive, expensive_seconds = dense[escalated], dense_seconds * len(escalated) / max(len(all_frames), 1)
+                records['expensive'].append(_minmax(dense))
+                seconds['expensive'] += dense_seconds
+            else:
+                expensive, expensive_seconds = self.score_frames(self.expensive, expensive_frames, escalated)
+            records['cheap'].append(_minmax(cheap))
+            records['cascade'].append(fuse_scores(cheap, expensive, mask, self.cascade.fusion, self.cascade.weight))
+            seconds['cheap'] += cheap_seconds
+            seconds['cascade'] += cheap_seconds + expensive_seconds
+            num_frames += len(all_frames)
+            num_escalated += len(escalated)
+            logger.info(f'{video_name}: escalated {len(escalated)}/{len(all_frames)} frames')
+
+        rows = []
+        for stage, scores in records.items():
+            if len(scores) == 0:
+                continue
+            row = OrderedDict()
+            row['stage'] = stage
+            row['escalated_ratio'] = {'cheap': 0.0, 'expensive': 1.0}.get(stage, num_escalated / max(num_frames, 1))
+            row['seconds_per_frame'] = seconds[stage] / max(num_frames, 1)
+            # the scores are the abnormal scores
+            row['auc'] = compute_frame_auc(scores, gt, pos_label=1)
+            logger.info(f'{stage}: escalated ratio:{row["escalated_ratio"]:.3f}, cost per frame:{row["seconds_per_frame"] * 1000:.2f}ms, AUC:{row["auc"]:.4f}')
+            rows.append(row)
+
+        if not os.path.exists(cfg.VAL.result_output):
+            os.makedirs(cfg.VAL.result_output)
+        table_path = os.path.join(cfg.VAL.result_output, f'{self.verbose}_cfg#{self.config_name}@{self.kwargs["time_stamp"]}_cascade.csv')
+        with open(table_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f'Save the table of the cascade in {table_path}')
+
+        # the result file uses the score type of the dataset, so it can be used by the evaluation functions
+        fused = records['cascade'] if cfg.DATASET.score_type == 'abnormal' else [1.0 - item for item in records['cascade']]
+        self.result_path = save_score_results(fused, cfg, logger, verbose=self.verbose, config_name=self.config_name, time_stamp=self.kwargs['time_stamp'])
+        self.rows = rows
+        return rows
@@ -56,6 +56,13 @@ class MATrainer(BaseTrainer):
         self.optical = ParamSet(name='optical', size=self.config.DATASET.optical_size, output_format=self.config.DATASET.optical_format)
         # import ipdb; ipdb.set_trace()
     
+    def prepare_frozen(self, data):
+        # the optical flow between the input frame and the target frame
+        gt_flow_esti_tensor = torch.cat([data[:, :, 0, :, :], data[:, :, 1, :, :]], 1)
+        flow_gt_vis, flow_gt  = flow_batch_estimate(self.F, gt_flow_esti_tensor, self.normalize.param['train'],
+                                                    optical_size=self.config.DATASET.optical_size, output_format=self.config.DATASET.optical_format)
+        return {'flow_gt_vis': flow_gt_vis, 'flow_gt': flow_gt}
+
     def train(self,current_step):
         # Pytorch [N, C, D, H, W]
         # initialize
@@ -69,22 +76,20 @@ class MATrainer(BaseTrainer):
         writer = self.kwargs['writer_dict']['writer']
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
         
-        # get the data
-        data, anno, meta = next(self._train_loader_iter)
+        # get the data, the optical flow of the target is computed with it
+        data, anno, meta, frozen = self.next_batch()
         self.data_time.update(time.time() - start)
         
         # base on the D to get each frame
         # in this method, D = 2 and not change
-        input_data = data[:, :, 0, :, :].cuda() # input(1-st) frame
-        target = data[:, :, 1,:, :].cuda() # target(2-nd) frame 
+        input_data = data[:, :, 0, :, :].to(self.device) # input(1-st) frame
+        target = data[:, :, 1,:, :].to(self.device) # target(2-nd) frame 
         
         # True Process =================Start===================
         #---------update optim_G ---------
         self.set_requires_grad(self.D, False)
         output_flow_G,  output_frame_G = self.G(input_data)
-        gt_flow_esti_tensor = torch.cat([input_data, target], 1)
-        flow_gt_vis, flow_gt  = flow_batch_estimate(self.F, gt_flow_esti_tensor, self.normalize.param['train'],
-                                                    optical_size=self.config.DATASET.optical_size, output_format=self.config.DATASET.optical_format)
+        flow_gt_vis, flow_gt = frozen['flow_gt_vis'], frozen['flow_gt']
         fake_g = self.D(torch.cat([target, output_flow_G], dim=1))
 
         loss_g_adv = self.GANLoss(fake_g, True)
@@ -142,15 +147,6 @@ class MATrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        # self.saved_model = {'G':self.G, 'D':self.D}
-        self.saved_model['G'] = self.G
-        self.saved_model['D'] = self.D
-        # self.saved_optimizer = {'optim_G': self.optimizer_G, 'optim_D': self.optimizer_D}
-        self.saved_optimizer['optimizer_G'] = self.optimizer_G
-        self.saved_optimizer['optimizer_D'] = self.optimizer_D
-        # self.saved_loss = {'loss_G':self.loss_meter_G.val, 'loss_D':self.loss_meter_D.val}
-        self.saved_loss['loss_G'] = self.loss_meter_G.val
-        self.saved_loss['loss_D'] = self.loss_meter_D.val
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
 
 
@@ -185,8 +181,8 @@ class AMCService(BaseService):
         scores = np.empty(shape=(len(clip_list), ), dtype=np.float32)
 
         for index, clip in enumerate(clip_list):
-            first_frame = clip[:, :, 0, :, :].cuda()
-            second_frame = clip[:, :, 1, :, :].cuda()
+            first_frame = clip[:, :, 0, :, :].to(self.device)
+            second_frame = clip[:, :, 1, :, :].to(self.device)
 
             generated_flow, generated_frame = self.G(first_frame)
             gtFlowEstim = torch.cat([first_frame, second_frame], 1)
@@ -19,10 +19,11 @@ from torch.utils.data import DataLoader
 
 from pyanomaly.core.utils import AverageMeter, flow_batch_estimate, tensorboard_vis_images, make_info_message, ParamSet
 from pyanomaly.datatools.evaluate.utils import psnr_error
-from ..abstract.base_engine import BaseTrainer, BaseInference
+from pyanomaly.networks.meta.base.incremental import build_incremental_encoder
+from ..abstract.base_engine import BaseTrainer, BaseInference, BaseService
 from ..engine_registry import ENGINE_REGISTRY
 
-__all__ = ['MEMAETrainer', 'MEMAEInference']
+__all__ = ['MEMAETrainer', 'MEMAEInference', 'MEMAEService']
 
 @ENGINE_REGISTRY.register()
 class MEMAETrainer(BaseTrainer):
@@ -43,10 +44,10 @@ class MEMAETrainer(BaseTrainer):
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
         
         # get the data
-        data, anno, meta = next(self._train_loader_iter)  # the core for dataloader
+        data, anno, meta, _ = self.next_batch()  # the core for dataloader
         self.data_time.update(time.time() - start)
         
-        input_data = data.cuda() 
+        input_data = data.to(self.device) 
         
         # True Process =================Start===================
         output_rec, att = self.MemAE(input_data)
@@ -83,12 +84,6 @@ class MEMAETrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        # self.saved_model = {'MemAE':self.MemAE}
-        self.saved_model['MemAE'] = self.MemAE
-        # self.saved_optimizer = {'optim_MemAE': self.optim_MemAE}
-        self.saved_optimizer['optimizer_MemAE']= self.optim_MemAE
-        # self.saved_loss = {'loss_MemAE':self.loss_meter_MemAE.val}
-        self.saved_loss['loss_MemAE'] = self.loss_meter_MemAE.val
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
 
 
@@ -97,4 +92,19 @@ class MEMAEInference(BaseInference):
     NAME = ["MEMAE.INFERENCE"]
     def inference(self):
         for h in self._hooks:
-            h.inference()
\ No newline at end of file
+            h.inference()
+
+@ENGINE_REGISTRY.register()
+class MEMAEService(BaseService):
+    NAME = ["MEMAE.SERVICE"]
+    def custom_setup(self):
+        self.window_length = self.config.DATASET.val.clip_length
+        # the memory and the decoder run on the features of the incremental encoder
+        self.memae = getattr(self.MemAE, 'module', self.MemAE)
+        self.incremental = build_incremental_encoder(self.config.SERVICE.incremental, self.memae.encoder)
+
+    def score_windows(self, windows, features=None):
+        output, _ = self.MemAE(windows) if features is None else self.memae.decode(features)
+        # the reconstruction error of the last frame, the same as the reconstruction_loss used by the hook
+        frame_error = torch.abs(output - windows).mean(dim=(1, 3, 4))
+        return frame_error[:, -1].cpu().numpy()
@@ -44,6 +44,10 @@ class OCAETrainer(BaseTrainer):
         self.cluster_dataset_keys = self.train_dataloaders_dict['cluster_dataset_dict'].keys()
         # import ipdb; ipdb.set_trace()
 
+    def prepare_frozen(self, data):
+        # detect the objects in the t frame
+        return {'bboxs': get_batch_dets(self.Detector, data[:, :, 1, :, :])}
+
     def train(self,current_step):
         # Pytorch [N, C, D, H, W]
         # initialize
@@ -60,16 +64,16 @@ class OCAETrainer(BaseTrainer):
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
 
         # get the data
-        data, anno, meta = next(self._train_loader_iter)  # the core for dataloader
+        data, anno, meta, frozen = self.next_batch()  # the core for dataloader, the objects are detected with it
         self.data_time.update(time.time() - start)
         
         # base on the D to get each frame
         # in this method, D = 3 and not change
-        future = data[:, :, -1, :, :].cuda() # t+1 frame 
-        current = data[:, :, 1, :, :].cuda() # t frame
-        past = data[:, :, 0, :, :].cuda() # t-1 frame
+        future = data[:, :, -1, :, :].to(self.device) # t+1 frame 
+        current = data[:, :, 1, :, :].to(self.device) # t frame
+        past = data[:, :, 0, :, :].to(self.device) # t-1 frame
 
-        bboxs = get_batch_dets(self.Detector, current)
+        bboxs = frozen['bboxs']
         # this method is based on the objects to train the model insted of frames
         for index, bbox in enumerate(bboxs):
             if bbox.numel() == 0:
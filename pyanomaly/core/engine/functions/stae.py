@@ -19,10 +19,11 @@ from torch.utils.data import DataLoader
 
 from pyanomaly.core.utils import AverageMeter, flow_batch_estimate, tensorboard_vis_images, make_info_message, ParamSet
 from pyanomaly.datatools.evaluate.utils import psnr_error
-from ..abstract.base_engine import BaseTrainer, BaseInference
+from pyanomaly.networks.meta.base.incremental import build_incremental_encoder
+from ..abstract.base_engine import BaseTrainer, BaseInference, BaseService
 from ..engine_registry import ENGINE_REGISTRY
 
-__all__ = ['STAETrainer', 'STAEInference']
+__all__ = ['STAETrainer', 'STAEInference', 'STAEService']
 
 @ENGINE_REGISTRY.register()
 class STAETrainer(BaseTrainer):
@@ -41,14 +42,14 @@ class STAETrainer(BaseTrainer):
         global_steps = self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])]
         
         # get the data
-        data, anno, meta  = next(self._train_loader_iter)  # the core for dataloader
+        data, anno, meta, _ = self.next_batch()  # the core for dataloader
         self.data_time.update(time.time() - start)
 
         # get the reconstruction and prediction video clip
         time_len = data.shape[2]
         rec_time = time_len // 2
-        input_rec = data[:, :, 0:rec_time, :, :].cuda() # 0 ~ t//2 frame 
-        input_pred = data[:, :, rec_time:time_len, :, :].cuda() # t//2 ~ t frame
+        input_rec = data[:, :, 0:rec_time, :, :].to(self.device) # 0 ~ t//2 frame 
+        input_pred = data[:, :, rec_time:time_len, :, :].to(self.device) # t//2 ~ t frame
 
         # True Process =================Start===================
         output_rec,  output_pred = self.STAE(input_rec)
@@ -93,13 +94,6 @@ class STAETrainer(BaseTrainer):
         # reset start
         start = time.time()
         
-        # self.saved_model = {'STAE':self.STAE}
-        self.saved_model['STAE'] = self.STAE
-        # self.saved_optimizer = {'optim_STAE': self.optim_STAE}
-        # self.saved_optimizer = {'optim_STAE': self.optimizer_STAE}
-        self.saved_optimizer['optimizer_STAE'] = self.optimizer_STAE
-        # self.saved_loss = {'loss_STAE':self.loss_meter_STAE}
-        self.saved_loss['loss_STAE'] = self.loss_meter_STAE
         self.kwargs['writer_dict']['global_steps_{}'.format(self.kwargs['model_type'])] = global_steps
     
 @ENGINE_REGISTRY.register()
@@ -107,4 +101,19 @@ class STAEInference(BaseInference):
     NAME = ["STAE.INFERENCE"]
     def inference(self):
         for h in self._hooks:
-            h.inference()
\ No newline at end of file
+            h.inference()
+
+@ENGINE_REGISTRY.register()
+class STAEService(BaseService):
+    NAME = ["STAE.SERVICE"]
+    def custom_setup(self):
+        self.window_length = self.config.DATASET.val.sampled_clip_length
+        # the decoders run on the features of the incremental encoder
+        self.stae = getattr(self.STAE, 'module', self.STAE)
+        self.incremental = build_incremental_encoder(self.config.SERVICE.incremental, self.stae.encoder)
+
+    def score_windows(self, windows, features=None):
+        output, _ = self.STAE(windows) if features is None else self.stae.decode(features)
+        # the reconstruction error of the last frame, the same as the reconstruction_loss used by the hook
+        frame_error = torch.abs(output - windows).mean(dim=(1, 3, 4))
+        return frame_error[:, -1].cpu().numpy()
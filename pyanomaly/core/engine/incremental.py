@@ -0,0 +1,108 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Compare the incremental encoder(SERVICE.incremental) with the windowed encoder on the val videos.
+Each val video is pushed into the service as a stream with the windowed encoder and with each mode of the IncrementalEncoder3D,
+and the ratio of the computed slices, the cost per frame and the AUC are compared, for example:
+    python -m pyanomaly.core.engine.incremental --cfg ./configuration/stae/avenue/avenue_default.yaml --model_file ./output/xxx.pth --engine STAEService
+"""
+import os
+import csv
+import time
+import argparse
+import numpy as np
+from collections import OrderedDict
+from pyanomaly.networks.meta.base.incremental import IncrementalEncoder3D
+from .streaming import FileFrameSource
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['evaluate_incremental']
+
+TABLE_FIELDS = ['mode', 'computed_ratio', 'seconds_per_frame', 'auc', 'auc_delta', 'max_score_diff']
+
+
+def evaluate_incremental(service, encoder, data_path, gt, modes=('exact', 'approximate'), output_file=None):
+    """Score the val videos with the windowed encoder and the incremental encoder.
+    Args:
+        service(BaseService): The service of the model, e.g. STAEService, MEMAEService
+        encoder(nn.Sequential): The encoder of the model
+        data_path(str): The path of the testing videos, each directory is one video
+        gt(list): The frame labels of each video
+        modes(tuple): The modes of the IncrementalEncoder3D
+        output_file(str): The path of the csv table, None means not write
+    Returns:
+        rows(list): The computed ratio, the seconds per frame and the AUC of each mode
+    """
+    from pyanomaly.datatools.evaluate.batch_eval import compute_frame_auc
+    video_list = sorted(item for item in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, item)))
+    assert len(video_list) == len(gt), f'The number of videos does not match the ground truth, {len(video_list)} != {len(gt)}'
+    original = service.incremental
+    encoders = OrderedDict([('windowed', None)] + [(mode, IncrementalEncoder3D(encoder, mode)) for mode in modes])
+    scores = OrderedDict((mode, []) for mode in encoders.keys())
+    seconds = OrderedDict((mode, 0.0) for mode in encoders.keys())
+    num_frames = 0
+    try:
+        for video_name in video_list:
+            # the processed frames are kept, so the time is mainly the model
+            frames = [service.preprocess_frame(frame).cpu() for frame in FileFrameSource(os.path.join(data_path, video_name))]
+            for mode, incremental in encoders.items():
+                service.incremental = incremental
+                start = time.perf_counter()
+                scores[mode].append(service.execute(frames, stream_id=video_name)['scores'])
+                seconds[mode] += time.perf_counter() - start
+            num_frames += len(frames)
+    finally:
+        service.incremental = original
+
+    rows = []
+    for mode, incremental in encoders.items():
+        row = OrderedDict()
+        row['mode'] = mode
+        row['computed_ratio'] = 1.0 if incremental is None else incremental.computed_ratio
+        row['seconds_per_frame'] = seconds[mode] / max(num_frames, 1)
+        # the scores of the service are the abnormal scores
+        row['auc'] = compute_frame_auc(scores[mode], gt, pos_label=1)
+        row['auc_delta'] = row['auc'] - rows[0]['auc'] if len(rows) > 0 else 0.0
+        row['max_score_diff'] = max(float(np.abs(item - dense).max()) if len(item) > 0 else 0.0 for item, dense in zip(scores[mode], scores['windowed']))
+        logger.info(f'{mode}: computed ratio:{row["computed_ratio"]:.3f}, cost per frame:{row["seconds_per_frame"] * 1000:.2f}ms, AUC:{row["auc"]:.4f}(delta:{row["auc_delta"]:+.4f})')
+        rows.append(row)
+    if output_file is not None:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the computed slices, the cost and the AUC of the incremental encoder on the val videos')
+    parser.add_argument('--cfg', required=True, help='the config file, use DATASET.name, DATASET.val.gt_path, DATASET.val.data_path and SERVICE.engine_name in it')
+    parser.add_argument('--model_file', default=None, help='the model file, default is VAL.model_file')
+    parser.add_argument('--engine', default=None, help='the service, e.g. STAEService, MEMAEService, default is SERVICE.engine_name')
+    parser.add_argument('--modes', nargs='+', default=['exact', 'approximate'], help='the modes of the incremental encoder')
+    parser.add_argument('--output', default=None, help='the csv file of the table')
+    parser.add_argument('opts', help='change the config from the command-line, e.g. SYSTEM.device cpu', default=None, nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from pyanomaly import ModelAPI
+    from pyanomaly.config import update_config
+    from pyanomaly.core.engine.engine_api import ENGINE_REGISTRY
+    from pyanomaly.datatools.abstract.readers import GroundTruthLoader
+    cfg = update_config(args.cfg, args.opts or [])
+    cfg.defrost()
+    cfg.VAL.model_file = args.model_file or cfg.VAL.model_file
+    service = ENGINE_REGISTRY.get(args.engine or cfg.SERVICE.engine_name)(model_dict=ModelAPI(cfg)(), config=cfg, parallel=False, verbose='incremental',
+                                                                          config_name=os.path.splitext(os.path.basename(args.cfg))[0], hooks=[], evaluate_function=None)
+    # the encoder of the model in the service
+    model = getattr(service, str(list(service.model.keys())[0]))
+    encoder = getattr(model, 'module', model).encoder
+    gt = GroundTruthLoader(cfg.DATASET.gt_cache_dir).read(cfg.DATASET.name, cfg.DATASET.val.gt_path, cfg.DATASET.val.data_path)
+
+    table = evaluate_incremental(service, encoder, cfg.DATASET.val.data_path, gt, args.modes, args.output)
+    print('\t'.join(TABLE_FIELDS))
+    for row in table:
+        print('\t'.join(str(row[field]) for field in TABLE_FIELDS))
@@ -0,0 +1,289 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Feed the service from the asyncio sources: a directory watcher(the dropped frame files and video files) and a unix socket.
+The decoding and the buffering run in a thread pool, so the event loop only waits.
+The number of the frames which are submitted but not scored is bounded, the sources wait when it is reached(the backpressure),
+and the socket stops reading, so its clients are slowed down by the socket buffer.
+"""
+import os
+import json
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['AsyncIngestor', 'DirectoryWatcher', 'UnixSocketSource', 'pack_frame', 'serve_sources']
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif')
+_VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+# the header of one message on the socket: the length of the json header and the length of the encoded image
+_MESSAGE_HEADER = struct.Struct('!II')
+
+
+def _read_image(path):
+    image = cv2.imread(path)
+    if image is None:
+        raise Exception(f'Can not read the image: {path}')
+    return image[:, :, [2, 1, 0]]
+
+
+def _decode_image(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise Exception('Can not decode the image')
+    return image[:, :, [2, 1, 0]]
+
+
+def _read_video_frame(capture):
+    ret, image = capture.read()
+    return image[:, :, [2, 1, 0]] if ret else None
+
+
+def pack_frame(stream_id, data):
+    """Make the socket message of one frame, used by the clients of the UnixSocketSource.
+    Args:
+        stream_id(str): The name of the stream
+        data(bytes): The encoded image, e.g. the jpg or png file
+    Returns:
+        message(bytes)
+    """
+    header = json.dumps({'stream_id': str(stream_id)}).encode('utf-8')
+    return _MESSAGE_HEADER.pack(len(header), len(data)) + header + data
+
+
+class AsyncIngestor(object):
+    """Submit the frames of the asyncio sources to the MicroBatchScheduler.
+    Args:
+        scheduler(MicroBatchScheduler): The scheduler of the service
+        decode_workers(int): The threads which decode and buffer the frames
+        max_pending(int): The max number of the frames which are submitted but not scored
+        on_result: The function called with each StreamResult in the event loop, on_result(result)
+    """
+    def __init__(self, scheduler, decode_workers=4, max_pending=64, on_result=None):
+        self.scheduler = scheduler
+        self.service = scheduler.service
+        self.max_pending = max(1, int(max_pending))
+        self.on_result = on_result
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(decode_workers)), thread_name_prefix='ingest')
+        # made in the event loop
+        self._slots = None
+        self._pending = 0
+
+    async def run_blocking(self, func, *args):
+        """Run the blocking function(e.g. decoding) in the thread pool.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def push(self, stream_id, frame):
+        """Submit one frame, it waits when max_pending frames are not scored.
+        The frames of one stream should be pushed one after another(await each push), so they keep their order.
+        Returns:
+            future(asyncio.Future|None): The future of the StreamResult, None if the buffer of the stream is not full yet
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        await self._slots.acquire()
+        try:
+            future = await self.run_blocking(self.scheduler.submit, stream_id, frame)
+        except Exception:
+            self._slots.release()
+            raise
+        if future is None:
+            self._slots.release()
+            return None
+        self._pending += 1
+        future = asyncio.wrap_future(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        self._pending -= 1
+        self._slots.release()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f'Failed to score the frame: {future.exception()}')
+        elif self.on_result is not None:
+            self.on_result(future.result())
+
+    @property
+    def pending(self):
+        """The number of the frames which are submitted but not scored.
+        """
+        return self._pending
+
+    async def finish_stream(self, stream_id, last_future=None):
+        """Wait for the last frame of the stream and close it through the scheduler.
+        """
+        if last_future is not None:
+            await asyncio.wait([last_future])
+        await self.run_blocking(self.scheduler.close_stream, stream_id)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class DirectoryWatcher(object):
+    """Watch a directory for the dropped frame files and video files.
+    The images in the directory belong to the stream named by the directory, the images in its sub-directories belong to the streams named by them,
+    and they are scored in the order of the names. Each video file is one stream named by the file.
+    A file is used when its size does not change between two polls, so the files being written are not read.
+    Args:
+        ingestor(AsyncIngestor)
+        path(str): The watched directory
+        poll_interval(float): The seconds between two scans
+    """
+    def __init__(self, ingestor, path, poll_interval=0.5):
+        assert os.path.isdir(path), f'The watched directory does not exist: {path}'
+        self.ingestor = ingestor
+        self.path = path
+        self.poll_interval = poll_interval
+        self._sizes = dict()
+        self._used = set()
+
+    def _scan(self):
+        # the files whose size is the same as in the last scan
+        ready = []
+        sizes = dict()
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                if file_path in self._used or os.path.splitext(name)[1].lower() not in _IMAGE_EXTENSIONS + _VIDEO_EXTENSIONS:
+                    continue
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    continue
+                sizes[file_path] = size
+                if size > 0 and self._sizes.get(file_path) == size:
+                    ready.append(file_path)
+        self._sizes = sizes
+        return sorted(ready)
+
+    async def _push_images(self, stream_id, paths):
+        for path in paths:
+            try:
+                frame = await self.ingestor.run_blocking(_read_image, path)
+            except Exception as e:
+                logger.warning(str(e))
+                continue
+            await self.ingestor.push(stream_id, frame)
+
+    async def _push_video(self, stream_id, path):
+        capture = await self.ingestor.run_blocking(cv2.VideoCapture, path)
+        last_future = None
+        try:
+            while True:
+                frame = await self.ingestor.run_blocking(_read_video_frame, capture)
+                if frame is None:
+                    break
+                future = await self.ingestor.push(stream_id, frame)
+                last_future = future if future is not None else last_future
+        finally:
+            capture.release()
+            # the stream is closed even if the reading fails or the task is cancelled
+            await self.ingestor.finish_stream(stream_id, last_future)
+        logger.info(f'Finish the video: {path}')
+
+    async def run(self):
+        """Watch the directory until the task is cancelled.
+        """
+        logger.info(f'Watch the directory: {self.path}')
+        video_tasks = set()
+        while True:
+            ready = await self.ingestor.run_blocking(self._scan)
+            self._used.update(ready)
+            images = dict()
+            for path in ready:
+                if os.path.splitext(path)[1].lower() in _VIDEO_EXTENSIONS:
+                    stream_id = os.path.relpath(path, self.path)
+                    task = asyncio.ensure_future(self._push_video(stream_id, path))
+                    video_tasks.add(task)
+                    task.add_done_callback(video_tasks.discard)
+                else:
+                    images.setdefault(os.path.relpath(os.path.dirname(path), os.path.dirname(self.path)), []).append(path)
+            # the streams of the images are pushed at the same time, the images of one stream one after another
+            if len(images) > 0:
+                await asyncio.gather(*[self._push_images(stream_id, paths) for stream_id, paths in images.items()])
+            await asyncio.sleep(self.poll_interval)
+
+
+class UnixSocketSource(object):
+    """Receive the encoded frames from a unix socket.
+    Each message is made by pack_frame: the lengths of the json header and the image, the json header({'stream_id': ...}) and the encoded image.
+    One connection can send the frames of many streams, the frames of one stream should be sent by one connection.
+    Args:
+        ingestor(AsyncIngestor)
+        path(str): The path of the socket
+    """
+    def __init__(self, ingestor, path):
+        self.ingestor = ingestor
+        self.path = path
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readexactly(_MESSAGE_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                header_size, data_size = _MESSAGE_HEADER.unpack(head)
+                header = json.loads((await reader.readexactly(header_size)).decode('utf-8'))
+                data = await reader.readexactly(data_size)
+                try:
+                    frame = await self.ingestor.run_blocking(_decode_image, data)
+                except Exception as e:
+                    logger.warning(f'{e} of the stream {header["stream_id"]}')
+                    continue
+                # the next message is not read until the frame is submitted
+                await self.ingestor.push(header['stream_id'], frame)
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Start to serve the socket.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        logger.info(f'Receive the frames from the socket: {self.path}')
+        return self._server
+
+    async def run(self):
+        """Serve the socket until the task is cancelled.
+        """
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+
+async def serve_sources(service, watch_dir=None, socket_path=None, on_result=None):
+    """Score the frames from the directory and the socket with the service, until the task is cancelled.
+    The options are in the SERVICE.batching and SERVICE.ingest config.
+    Args:
+        service(BaseService)
+        watch_dir(str): The watched directory, None means not watching
+        socket_path(str): The path of the unix socket, None means not using the socket
+        on_result: The function called with each StreamResult, on_result(result)
+    """
+    ingest_cfg = service.config.SERVICE.ingest
+    scheduler = service.build_scheduler()
+    ingestor = AsyncIngestor(scheduler, ingest_cfg.decode_workers, ingest_cfg.max_pending, on_result)
+    sources = []
+    if watch_dir is not None:
+        sources.append(DirectoryWatcher(ingestor, watch_dir, ingest_cfg.poll_interval).run())
+    if socket_path is not None:
+        sources.append(UnixSocketSource(ingestor, socket_path).run())
+    assert len(sources) > 0, 'No source of the frames'
+    try:
+        await asyncio.gather(*sources)
+    finally:
+        ingestor.close()
+        scheduler.close()
@@ -0,0 +1,94 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Launch the multi-process training, refer https://github.com/facebookresearch/detectron2/blob/master/detectron2/engine/launch.py
+Each process trains the DistributedDataParallel models with its own shard of the data(DistTrainSampler).
+With the gloo backend, the processes run on the cpu, and the cores of the machine are shared among them.
+"""
+import os
+import socket
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from pyanomaly.datatools.dataclass.sampler import common as comm
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['launch', 'get_device', 'is_distributed']
+
+
+def _find_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # binding to port 0 will cause the OS to find an available port
+    sock.bind(('', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def launch(main_func, num_processes=1, num_machines=1, machine_rank=0, backend='gloo', init_method=None, args=()):
+    """Run the main_func in the processes.
+    Args:
+        main_func: The function executed in each process, main_func(*args)
+        num_processes(int): The number of processes on this machine
+        num_machines(int): The number of machines
+        machine_rank(int): The rank of this machine
+        backend(str): 'gloo' | 'nccl'
+        init_method(str): The url of the process group, e.g. 'tcp://127.0.0.1:23456'. None means a free port on the local machine
+        args(tuple): The arguments of the main_func
+    """
+    world_size = num_machines * num_processes
+    if world_size <= 1:
+        main_func(*args)
+        return
+    if init_method is None:
+        assert num_machines == 1, 'The init_method is needed when using multiple machines'
+        init_method = f'tcp://127.0.0.1:{_find_free_port()}'
+    logger.info(f'Launch {num_processes} processes with the {backend} backend, world size:{world_size}')
+    mp.spawn(_distributed_worker, nprocs=num_processes, args=(main_func, world_size, num_processes, machine_rank, backend, init_method, args), daemon=False)
+
+
+def _distributed_worker(local_rank, main_func, world_size, num_processes, machine_rank, backend, init_method, args):
+    global_rank = machine_rank * num_processes + local_rank
+    if backend == 'nccl':
+        assert torch.cuda.device_count() >= num_processes, f'Not enough gpus for {num_processes} processes'
+        torch.cuda.set_device(local_rank)
+    else:
+        # share the cores among the processes, otherwise the threads of the processes compete for the same cores
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_processes))
+    dist.init_process_group(backend=backend, init_method=init_method, world_size=world_size, rank=global_rank)
+
+    # setup the local process group(which contains ranks within the same machine)
+    assert comm._LOCAL_PROCESS_GROUP is None
+    num_machines = world_size // num_processes
+    for i in range(num_machines):
+        ranks_on_i = list(range(i * num_processes, (i + 1) * num_processes))
+        pg = dist.new_group(ranks_on_i)
+        if i == machine_rank:
+            comm._LOCAL_PROCESS_GROUP = pg
+
+    comm.synchronize()
+    try:
+        main_func(*args)
+    finally:
+        dist.destroy_process_group()
+
+
+def is_distributed(cfg):
+    """Whether the engine uses the DistributedDataParallel.
+    """
+    return cfg.SYSTEM.distributed.use and comm.get_world_size() > 1
+
+
+def get_device(cfg):
+    """Get the device of the process.
+    Returns:
+        device(torch.device): cpu, or the gpu of the local rank in the distributed training
+    """
+    if cfg.SYSTEM.device == 'cpu':
+        return torch.device('cpu')
+    if is_distributed(cfg):
+        return torch.device('cuda', comm.get_local_rank())
+    return torch.device('cuda')
@@ -0,0 +1,252 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Skip the model on the static frames.
+The frame is downsampled to a small gray image and compared with the last scored frame of the stream,
+if the mean absolute difference is lower than the threshold, the model is not run and the frame gets the last score(or the baseline).
+The re-scoring tool applies the gate to the dense scores of the val videos and compares the AUC, for example:
+    python -m pyanomaly.core.engine.motion_gate ./output/results/xxx.pkl --cfg ./configuration/amc/avenue/avenue_default.yaml --thresholds 0.005 0.01 0.02
+"""
+import os
+import csv
+import argparse
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['MotionGate', 'build_motion_gate', 'gate_scores', 'evaluate_motion_gate']
+
+TABLE_FIELDS = ['threshold', 'skip_rate', 'dense_auc', 'gated_auc', 'auc_delta']
+
+
+class MotionGate(object):
+    """The frame-differencing gate of the streams.
+    Args:
+        threshold(float): The frame is static if the mean absolute difference(the gray value in [0, 1]) is lower than it
+        size(int): The side of the downsampled gray frame
+        max_skip(int): Score the frame after max_skip static frames in a row, 0 means no limit
+        mode(str): The score of the skipped frame, 'carry': the last score, 'baseline': the baseline
+        baseline(float): The score used in the 'baseline' mode
+    """
+    _MODES = ('carry', 'baseline')
+
+    def __init__(self, threshold=0.01, size=32, max_skip=0, mode='carry', baseline=0.0):
+        assert mode in MotionGate._MODES, f'Not support the mode of the motion gate: {mode}'
+        self.threshold = threshold
+        self.size = size
+        self.max_skip = max_skip
+        self.mode = mode
+        self.baseline = baseline
+        # stream_id -> the downsampled last scored frame
+        self._reference = dict()
+        # stream_id -> the number of the static frames in a row
+        self._run = dict()
+        # stream_id -> [checked frames, skipped frames]
+        self._counts = OrderedDict()
+
+    def downsample(self, frame):
+        """Turn the frame into the small gray image.
+        Args:
+            frame(np.ndarray|torch.Tensor): [H, W, C] uint8 image, [C, H, W] float tensor, or the [size, size] downsampled image
+        Returns:
+            image(torch.Tensor): [size, size] float
+        """
+        if not torch.is_tensor(frame):
+            frame = torch.from_numpy(np.ascontiguousarray(frame))
+        if frame.dim() == 2 and tuple(frame.shape) == (self.size, self.size):
+            return frame.float()
+        if frame.dtype == torch.uint8:
+            if frame.dim() == 2:
+                frame = frame.unsqueeze(-1)
+            frame = frame.permute(2, 0, 1).float().div_(255.0)
+        gray = frame.float().mean(dim=0, keepdim=True)
+        return F.adaptive_avg_pool2d(gray.unsqueeze(0), (self.size, self.size))[0, 0]
+
+    def check(self, stream_id, frame, can_skip=True):
+        """Decide whether the model scores the frame.
+        Args:
+            stream_id: The name of the stream
+            frame: The frame, refer to the downsample
+            can_skip(bool): False if the frame must be scored, e.g. no score to carry
+        Returns:
+            run(bool): True if the model scores the frame
+        """
+        image = self.downsample(frame).cpu()
+        counts = self._counts.setdefault(stream_id, [0, 0])
+        counts[0] += 1
+        reference = self._reference.get(stream_id)
+        run_length = self._run.get(stream_id, 0)
+        static = (can_skip and reference is not None and reference.shape == image.shape
+                  and float((image - reference).abs().mean()) < self.threshold
+                  and (self.max_skip <= 0 or run_length < self.max_skip))
+        if static:
+            counts[1] += 1
+            self._run[stream_id] = run_length + 1
+            return False
+        self._reference[stream_id] = image
+        self._run[stream_id] = 0
+        return True
+
+    def skipped_score(self, last_score):
+        """The score of the skipped frame.
+        """
+        if self.mode == 'carry' and last_score is not None:
+            return last_score
+        return self.baseline
+
+    def skip_rate(self, stream_id=None):
+        """The ratio of the skipped frames in the stream, or in all of the streams if the stream_id is None.
+        """
+        if stream_id is None:
+            checked = sum(item[0] for item in self._counts.values())
+            skipped = sum(item[1] for item in self._counts.values())
+        else:
+            checked, skipped = self._counts.get(stream_id, [0, 0])
+        return skipped / checked if checked > 0 else 0.0
+
+    def summary(self):
+        """Returns:
+            summary(dict): The checked frames, the skipped frames and the skip rate of all streams
+        """
+        checked = sum(item[0] for item in self._counts.values())
+        skipped = sum(item[1] for item in self._counts.values())
+        return {'frames': checked, 'skipped': skipped, 'skip_rate': skipped / checked if checked > 0 else 0.0}
+
+    def reset(self, stream_id):
+        """Forget the stream, the counts are kept.
+        """
+        self._reference.pop(stream_id, None)
+        self._run.pop(stream_id, None)
+
+
+def build_motion_gate(gate_cfg):
+    """Build the MotionGate with the SERVICE.motion_gate config, None if it is not used.
+    """
+    if not gate_cfg.use:
+        return None
+    return MotionGate(gate_cfg.threshold, gate_cfg.size, gate_cfg.max_skip, gate_cfg.mode, gate_cfg.baseline)
+
+
+def gate_scores(scores, frames, gate, stream_id='video'):
+    """Apply the gate to the dense scores of one video, as the service does on its frames.
+    Args:
+        scores(np.ndarray): [T] the dense scores
+        frames: The T frames of the video, refer to the MotionGate.downsample
+        gate(MotionGate)
+    Returns:
+        gated(np.ndarray): [T] the scores with the gate
+        run(np.ndarray): [T] whether the model scores the frame
+    """
+    # the frames which are not read keep the dense scores
+    gated = np.array(scores, dtype=np.float64)
+    run = np.ones(len(scores), dtype=bool)
+    last_score = None
+    for index, frame in enumerate(frames):
+        if index >= len(scores):
+            break
+        run[index] = gate.check(stream_id, frame, can_skip=gate.mode == 'baseline' or last_score is not None)
+        if run[index]:
+            last_score = float(scores[index])
+            gated[index] = last_score
+        else:
+            gated[index] = gate.skipped_score(last_score)
+    gate.reset(stream_id)
+    return gated, run
+
+
+def _read_thumbnails(video_dir, size):
+    gate = MotionGate(size=size)
+    thumbnails = []
+    for name in sorted(os.listdir(video_dir)):
+        image = cv2.imread(os.path.join(video_dir, name))
+        if image is None:
+            continue
+        thumbnails.append(gate.downsample(image[:, :, [2, 1, 0]]))
+    return thumbnails
+
+
+def evaluate_motion_gate(result_file, dataset_name, gt_path, data_path, thresholds, score_type='normal', size=32, max_skip=0, mode='carry', baseline=0.0,
+                         output_file=None, gt_cache_dir=''):
+    """Compare the AUC of the dense scores with the gated scores.
+    The frames of the val videos(the sorted directories in data_path) are downsampled once, and the gate with each threshold is applied to them.
+    Args:
+        result_file(str): The result file of the dense scores, saved by the evaluation
+        dataset_name(str): The name of the dataset, e.g. 'Avenue'
+        gt_path(str): The path of the ground truth
+        data_path(str): The path of the testing videos
+        thresholds(list): The thresholds of the gate
+        score_type(str): 'normal' | 'abnormal'
+        output_file(str): The path of the csv table, None means not write
+    Returns:
+        rows(list): The skip rate and the AUC of each threshold
+    """
+    from pyanomaly.datatools.abstract.readers import GroundTruthLoader
+    from pyanomaly.datatools.evaluate.results import load_score_results
+    from pyanomaly.datatools.evaluate.batch_eval import compute_frame_auc
+    pos_label = 0 if score_type == 'normal' else 1
+    gt = GroundTruthLoader(gt_cache_dir).read(dataset_name, gt_path, data_path)
+    scores = load_score_results(result_file)['score']
+    assert len(scores) == len(gt), f'The number of videos does not match the ground truth, {len(scores)} != {len(gt)}'
+    video_list = sorted(os.listdir(data_path))
+    thumbnails = [_read_thumbnails(os.path.join(data_path, video), size) for video in video_list]
+    dense_auc = compute_frame_auc(scores, gt, pos_label)
+
+    rows = []
+    for threshold in thresholds:
+        gate = MotionGate(threshold, size, max_skip, mode, baseline)
+        gated = [gate_scores(np.asarray(video_scores), frames, gate, stream_id=sn)[0] for sn, (video_scores, frames) in enumerate(zip(scores, thumbnails))]
+        row = OrderedDict()
+        row['threshold'] = threshold
+        row['skip_rate'] = gate.skip_rate()
+        row['dense_auc'] = dense_auc
+        row['gated_auc'] = compute_frame_auc(gated, gt, pos_label)
+        row['auc_delta'] = row['gated_auc'] - dense_auc
+        logger.info(f'threshold:{threshold}, skip rate:{row["skip_rate"]:.3f}, AUC:{row["gated_auc"]:.4f}(dense:{dense_auc:.4f})')
+        rows.append(row)
+    if output_file is not None:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the skip rate and the AUC of the motion gate on the dense scores of the val videos')
+    parser.add_argument('result_file', help='the result file of the dense scores')
+    parser.add_argument('--cfg', default=None, help='the config file, use DATASET.name, DATASET.val.gt_path, DATASET.val.data_path, DATASET.score_type and SERVICE.motion_gate in it')
+    parser.add_argument('--dataset', default=None)
+    parser.add_argument('--gt_path', default=None)
+    parser.add_argument('--data_path', default=None)
+    parser.add_argument('--score_type', default=None)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=None, help='the thresholds of the gate, default is SERVICE.motion_gate.threshold')
+    parser.add_argument('--output', default=None, help='the csv file of the table')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dataset_name, gt_path, data_path, score_type = args.dataset, args.gt_path, args.data_path, args.score_type
+    size, max_skip, mode, baseline, thresholds, gt_cache_dir = 32, 0, 'carry', 0.0, args.thresholds, ''
+    if args.cfg is not None:
+        from pyanomaly.config import update_config
+        cfg = update_config(args.cfg, [])
+        dataset_name = dataset_name or cfg.DATASET.name
+        gt_path = gt_path or cfg.DATASET.val.gt_path
+        data_path = data_path or cfg.DATASET.val.data_path
+        score_type = score_type or cfg.DATASET.score_type
+        gt_cache_dir = cfg.DATASET.gt_cache_dir
+        gate_cfg = cfg.SERVICE.motion_gate
+        size, max_skip, mode, baseline = gate_cfg.size, gate_cfg.max_skip, gate_cfg.mode, gate_cfg.baseline
+        thresholds = thresholds or [gate_cfg.threshold]
+    assert dataset_name is not None and gt_path is not None and data_path is not None, 'Please give the dataset, gt_path and data_path, or the cfg file'
+    assert thresholds is not None, 'Please give the thresholds, or the cfg file'
+
+    table = evaluate_motion_gate(args.result_file, dataset_name, gt_path, data_path, thresholds, score_type or 'normal', size, max_skip, mode, baseline, args.output, gt_cache_dir)
+    print('\t'.join(TABLE_FIELDS))
+    for row in table:
+        print('\t'.join(str(row[field]) for field in TABLE_FIELDS))
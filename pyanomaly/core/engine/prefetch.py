@@ -0,0 +1,144 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Prepare the next batches in a background thread while the current step trains.
+The preparation moves the data to the device and runs the frozen models(e.g. the optical flow F, the Detector) on it,
+so the training step only runs the networks which are updated. On the gpu, the preparation uses its own cuda stream.
+"""
+import queue
+import threading
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['BatchPrefetcher']
+
+# mark the end of the data in the queue
+_END = object()
+
+
+def _record_stream(value, stream):
+    # the memory allocated in the side stream is used by the current stream
+    if torch.is_tensor(value):
+        if value.is_cuda:
+            value.record_stream(stream)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _record_stream(item, stream)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _record_stream(item, stream)
+
+
+class BatchPrefetcher(object):
+    """The iterator which prepares the batches of the source in a background thread.
+    The thread starts at the first next(), at most `depth` prepared batches wait in the queue.
+    It can be saved in the checkpoint instead of the DataStream: the batches which are read but not used by the training are not counted,
+    so the resumed training starts from the first unused batch. The random states in the checkpoint are the ones after the read batches.
+    Args:
+        source: The iterator of the batches, e.g. the DataStream
+        prepare: The function of one batch, prepare(batch). It is run in the background thread without the gradients. None means returning the batch
+        device(torch.device): The device of the prepared tensors, a cuda stream is used for the gpu
+        depth(int): The number of the batches prepared ahead
+    """
+    def __init__(self, source, prepare=None, device=torch.device('cpu'), depth=1):
+        self.source = source
+        self.prepare = prepare
+        self.device = torch.device(device)
+        self.depth = max(1, int(depth))
+        self._queue = queue.Queue(maxsize=self.depth)
+        # held when reading the source, so the state of the source is consistent with the counters
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._read = 0
+        self._used = 0
+        self._stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    try:
+                        batch = next(self.source)
+                    except StopIteration:
+                        batch = _END
+                    else:
+                        self._read += 1
+                if batch is _END:
+                    self._put((_END, None, None))
+                    return
+                with torch.no_grad():
+                    if self._stream is not None:
+                        with torch.cuda.stream(self._stream):
+                            prepared = self.prepare(batch) if self.prepare is not None else batch
+                            event = torch.cuda.Event()
+                            event.record(self._stream)
+                    else:
+                        prepared = self.prepare(batch) if self.prepare is not None else batch
+                        event = None
+                self._put((prepared, event, None))
+            except Exception as e:
+                self._put((None, None, e))
+                return
+
+    def _put(self, item):
+        # wait for the space in the queue, and give up when the prefetcher is closed
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='BatchPrefetcher', daemon=True)
+            self._thread.start()
+        prepared, event, error = self._queue.get()
+        if error is not None:
+            raise error
+        if prepared is _END:
+            raise StopIteration
+        if event is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            _record_stream(prepared, current_stream)
+        with self._lock:
+            self._used += 1
+        return prepared
+
+    @property
+    def pending(self):
+        """The number of the batches which are read from the source but not used.
+        """
+        return self._read - self._used
+
+    def state_dict(self):
+        with self._lock:
+            state = self.source.state_dict()
+            pending = self.pending
+        if pending > 0 and 'position' in state:
+            # go back to the first unused batch
+            batch_size = getattr(self.source, 'batch_size', 1)
+            state['position'] -= pending * batch_size
+            if 'sampler' in state:
+                state['sampler']['start'] = state['position']
+        return state
+
+    def load_state_dict(self, state):
+        assert self._thread is None, 'The state can only be loaded before the prefetching starts'
+        self.source.load_state_dict(state)
+
+    def close(self):
+        """Stop the background thread, the prepared batches are dropped.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
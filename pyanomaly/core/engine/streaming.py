@@ -0,0 +1,166 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The tools of the streaming service: the frames of each stream are pushed one by one into a fixed-capacity ring buffer,
+and the latest window of the buffer is scored once it is full.
+"""
+import os
+import glob
+from collections import deque, namedtuple
+import cv2
+import numpy as np
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['FrameRingBuffer', 'LatencyRecorder', 'StreamState', 'StreamResult', 'FileFrameSource']
+
+# the result of one pushed frame
+# score: the anomaly score of the frame(higher means more abnormal), latency: the seconds from pushing the frame to getting the score
+# skipped: the model is not run on the frame(e.g. the static frame of the motion gate)
+# smoothed_index, smoothed: the frame and its smoothed score given by the CausalSmoother(SERVICE.smoothing), the frame is `lag` frames before the frame_index,
+# and is_anomaly belongs to the smoothed score when the smoothing is used. None if the smoothing is not used or the first `lag` frames
+StreamResult = namedtuple('StreamResult', ['stream_id', 'frame_index', 'score', 'is_anomaly', 'latency', 'skipped', 'smoothed_index', 'smoothed'], defaults=(False, None, None))
+
+
+class FrameRingBuffer(object):
+    """The latest `capacity` frames of one stream.
+    The memory is allocated at the first frame and reused, pushing a frame only copies it into the oldest slot.
+    Args:
+        capacity(int): The number of the kept frames, e.g. the clip length of the model
+    """
+    def __init__(self, capacity):
+        assert capacity > 0, f'The capacity should be positive, but got {capacity}'
+        self.capacity = int(capacity)
+        self._frames = None
+        # the slot of the next frame
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def full(self):
+        return self._size == self.capacity
+
+    def push(self, frame):
+        """Push one frame.
+        Args:
+            frame(torch.Tensor): [C, H, W]
+        """
+        if self._frames is None or self._frames.shape[1:] != frame.shape or self._frames.device != frame.device:
+            if self._frames is not None:
+                logger.warning(f'The shape of the frames changes from {tuple(self._frames.shape[1:])} to {tuple(frame.shape)}, clear the buffer')
+            self._frames = torch.empty((self.capacity,) + tuple(frame.shape), dtype=frame.dtype, device=frame.device)
+            self._head = 0
+            self._size = 0
+        self._frames[self._head].copy_(frame)
+        self._head = (self._head + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def window(self):
+        """Get the kept frames in the temporal order.
+        Returns:
+            window(torch.Tensor): [C, D, H, W], D is the number of the kept frames
+        """
+        assert self._size > 0, 'The buffer is empty'
+        if self._size < self.capacity:
+            frames = self._frames[:self._size]
+        elif self._head == 0:
+            frames = self._frames
+        else:
+            frames = torch.cat([self._frames[self._head:], self._frames[:self._head]], dim=0)
+        return frames.permute(1, 0, 2, 3)
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+
+class LatencyRecorder(object):
+    """Keep the latest latencies and summarize them.
+    Args:
+        window(int): The number of the kept latencies
+    """
+    def __init__(self, window=1000):
+        self._values = deque(maxlen=max(1, int(window)))
+        self.count = 0
+
+    def update(self, value):
+        self._values.append(value)
+        self.count += 1
+
+    def summary(self):
+        """Returns:
+            summary(dict): The count, mean, p50 and p99 of the latencies in seconds
+        """
+        if len(self._values) == 0:
+            return {'count': self.count, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0}
+        values = np.asarray(self._values, dtype=np.float64)
+        return {'count': self.count, 'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)), 'p99': float(np.percentile(values, 99))}
+
+
+class StreamState(object):
+    """The state of one stream in the service.
+    Args:
+        stream_id: The name of the stream
+        window_length(int): The number of the frames in the window of the model
+        latency_window(int): The number of the latencies kept by the stream
+    """
+    def __init__(self, stream_id, window_length, latency_window=1000):
+        self.stream_id = stream_id
+        self.buffer = FrameRingBuffer(window_length)
+        self.latency = LatencyRecorder(latency_window)
+        # the number of the pushed frames, which is the index of the next frame
+        self.num_frames = 0
+        # the score of the last frame scored by the model
+        self.last_score = None
+
+
+class FileFrameSource(object):
+    """Read the frames of a local video file or a directory of images, one by one.
+    Args:
+        path(str): The video file, or the directory which contains the images(sorted by the names)
+        loop(bool): Start again from the first frame at the end, which simulates a live feed
+        extensions(tuple): The extensions of the images in the directory
+    Yields:
+        frame(np.ndarray): [H, W, 3] uint8 RGB
+    """
+    def __init__(self, path, loop=False, extensions=('.jpg', '.jpeg', '.png', '.bmp', '.tif')):
+        assert os.path.exists(path), f'The frame source does not exist: {path}'
+        self.path = path
+        self.loop = loop
+        self.images = None
+        if os.path.isdir(path):
+            self.images = sorted(item for item in glob.glob(os.path.join(path, '*')) if os.path.splitext(item)[1].lower() in extensions)
+            assert len(self.images) > 0, f'No images in {path}'
+
+    def _read_images(self):
+        for name in self.images:
+            image = cv2.imread(name)
+            if image is None:
+                logger.warning(f'Can not read the image: {name}')
+                continue
+            yield image[:, :, [2, 1, 0]]
+
+    def _read_video(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            while True:
+                ret, image = capture.read()
+                if not ret:
+                    break
+                yield image[:, :, [2, 1, 0]]
+        finally:
+            capture.release()
+
+    def __iter__(self):
+        while True:
+            frames = self._read_images() if self.images is not None else self._read_video()
+            for frame in frames:
+                yield frame
+            if not self.loop:
+                return
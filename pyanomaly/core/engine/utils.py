@@ -2,9 +2,17 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
+import os
+import time
+import queue
+import shutil
+import threading
 import torch
 from pathlib import Path
 from collections import OrderedDict
+from pyanomaly.core.utils import state_dict_to_cpu, StateDictSnapshot
+from pyanomaly.datatools.tools import make_temp_file
+from .checkpoint import save_fast_checkpoint
 import logging
 logger = logging.getLogger(__name__)
 class EngineAverageMeter(object):
@@ -106,7 +114,145 @@ class EngineAverageMeter(object):
 #     if best:
 #         torch.save(checkpoint, output_best)
 #         logger.info(f'\033[1;32m =>Save Best checkpoint:{file_name} \033[0m')
-def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter', verbose='None', best=False, save_model=False):
+
+
+def _write_checkpoint(checkpoint, paths, file_format='torch'):
+    """Serialize the checkpoint once and link it to the other paths.
+    Args:
+        checkpoint(OrderedDict): The checkpoint
+        paths(list): The first one is written, the others are the hard links of the first one(copied if the link is not supported)
+        file_format(str): 'torch': torch.save, 'fast': save_fast_checkpoint
+    Returns:
+        bytes_written(int)
+    """
+    main_path = str(paths[0])
+    if file_format not in ('fast', 'torch'):
+        raise Exception(f'Not support the checkpoint format:{file_format}')
+    # the writer thread and the synchronous saves(or the processes) may write the same path at the same time
+    fd, temp_path = make_temp_file(main_path)
+    os.close(fd)
+    try:
+        if file_format == 'fast':
+            save_fast_checkpoint(checkpoint, temp_path)
+        else:
+            torch.save(checkpoint, temp_path)
+        os.replace(temp_path, main_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    for alias in paths[1:]:
+        alias = str(alias)
+        if os.path.abspath(alias) == os.path.abspath(main_path):
+            continue
+        # link to a temp file and replace the alias with it, so the concurrent writers do not remove the links of each other
+        fd, temp_alias = make_temp_file(alias)
+        os.close(fd)
+        os.remove(temp_alias)
+        try:
+            os.link(main_path, temp_alias)
+        except OSError:
+            shutil.copyfile(main_path, temp_alias)
+        os.replace(temp_alias, alias)
+        # rename does nothing if the alias is already the link of the same file
+        if os.path.lexists(temp_alias):
+            os.remove(temp_alias)
+    return os.path.getsize(main_path)
+
+
+class CheckpointWriter(object):
+    """Write the checkpoints of the engine_save.
+    Each checkpoint is serialized once, and the model file is the hard link of the checkpoint file.
+    In the asynchronous mode, the state dicts are copied to the cpu on the training thread and serialized in a background thread.
+    Args:
+        async_write(bool): Write in the background thread
+        max_pending(int): The max number of checkpoints waiting to be written, the training waits when it is reached
+        file_format(str): 'torch' | 'fast', the fast format can be lazily memory-mapped when loading, see checkpoint.py
+    """
+    def __init__(self, async_write=False, max_pending=2, file_format='torch'):
+        self.async_write = async_write
+        self.file_format = file_format
+        self.stats = OrderedDict(num_writes=0, bytes_written=0, snapshot_time=0.0, write_time=0.0, last_write_time=0.0)
+        self._error = None
+        self._lock = threading.Lock()
+        if self.async_write:
+            self._queue = queue.Queue(maxsize=max(1, int(max_pending)))
+            self._thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+            self._thread.start()
+    
+    def _write(self, checkpoint, paths):
+        start = time.time()
+        bytes_written = _write_checkpoint(checkpoint, paths, self.file_format)
+        latency = time.time() - start
+        with self._lock:
+            self.stats['num_writes'] += 1
+            self.stats['bytes_written'] += bytes_written
+            self.stats['write_time'] += latency
+            self.stats['last_write_time'] = latency
+        logger.info(f'=> Write {paths[0]} ({bytes_written / 2**20:.1f}MB) in {latency:.3f}s, linked to {len(paths) - 1} file(s)')
+    
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            try:
+                self._write(*job)
+            except Exception as e:
+                logger.exception(f'Failed to write the checkpoint {job[1][0]}')
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+    
+    def snapshot(self, stuff):
+        """Get the state dict which is safe to be written later.
+        """
+        if isinstance(stuff, StateDictSnapshot):
+            return stuff.state_dict()
+        if not self.async_write:
+            return stuff.state_dict()
+        return state_dict_to_cpu(stuff.state_dict())
+
+    def submit(self, checkpoint, paths, snapshot_time=0.0):
+        """Write the checkpoint to the paths.
+        Args:
+            checkpoint(OrderedDict): The checkpoint
+            paths(list): The paths of the files, the first one is written and the others are linked to it
+            snapshot_time(float): The time spent on copying the state dicts, only used in the statistics
+        """
+        self._check_error()
+        with self._lock:
+            self.stats['snapshot_time'] += snapshot_time
+        if self.async_write:
+            self._queue.put((checkpoint, paths))
+        else:
+            self._write(checkpoint, paths)
+
+    def flush(self):
+        """Wait until all of the checkpoints are written.
+        """
+        if self.async_write:
+            self._queue.join()
+        self._check_error()
+    
+    def close(self):
+        """Write the remaining checkpoints and stop the thread.
+        """
+        if self.async_write and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check_error()
+        logger.info(f'=> Checkpoint writer: {self.stats["num_writes"]} files, {self.stats["bytes_written"] / 2**20:.1f}MB, '
+                    f'snapshot {self.stats["snapshot_time"]:.3f}s, write {self.stats["write_time"]:.3f}s')
+
+
+def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter', verbose='None', best=False, save_model=False, writer=None):
     """Save the checkpoint file.
     Save the checkpoint of training, in order to resume the training process. 
     The saving ckpt path is: OUTPUT_DIR / DATASET.DATASET / MODEL.NAME / cfg@xxx / time_stamp / xxx.pth
@@ -143,10 +289,12 @@ def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter',
         verbose(str): some comments 
         best(bool): if the ckpt is the best one, it will be True; else it will be False
         save_model: if the engine saves the model(network), it will be True; else it will be False
+        writer(CheckpointWriter): the writer of the files, None means writing synchronously on this thread
+    The checkpoint is serialized once, the model file is the hard link of the checkpoint file since they are the same.
     """
     assert save_cfg != None, 'The save_cfg should not be none'
-    # set a the lowest metric
-    low = 20.0 # in order to filter the really low accuracy
+    # filter the really low accuracy
+    low = save_cfg.low
     if metric < low:
         logger.info(f'|*_*| ==> Not save the model, because the low metric: {metric:.3f}')
         return {'ckpt_file': None, 'model_file': None}
@@ -159,6 +307,10 @@ def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter',
     output_model.mkdir(parents=True, exist_ok=True)
     logger.info(f'=>Save the model in:{output_model}')
 
+    if writer is None:
+        writer = CheckpointWriter(async_write=False)
+
+    snapshot_start = time.time()
     saved_keys = list(saved_stuff.keys())
     # Save in a dict
     checkpoint = OrderedDict() # make the type of the checkpoint is OrderedDict
@@ -175,10 +327,11 @@ def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter',
     for key in saved_keys:
         stuff = saved_stuff[key]
         if type(stuff) == type(dict()):
-            temp = {k:v.state_dict() for k, v in stuff.items()}
+            temp = {k:writer.snapshot(v) for k, v in stuff.items()}
             checkpoint[key] = temp
         else:
-            checkpoint[key] = stuff.state_dict()
+            checkpoint[key] = writer.snapshot(stuff)
+    snapshot_time = time.time() - snapshot_start
     
     # make the ckpt file name
     file_name_ckpt = f'{flag}_step{current_step}#{metric:.3f}^{verbose}.pth.tar'
@@ -187,14 +340,13 @@ def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter',
     ckpt_best = Path(save_cfg.output_dir) / file_name_ckpt_best
 
     if best:
-        torch.save(checkpoint, ckpt_best)
         logger.info(f'\033[1;32m =>Save Best checkpoint:{ckpt_best} \033[0m')
         ckpt_str = str(ckpt_best)
     else:
-        torch.save(checkpoint, ckpt)
         logger.info(f'\033[1;34m =>Save checkpoint:{ckpt} \033[0m')
         ckpt_str = str(ckpt)
     # return ckpt_str
+    saved_paths = [ckpt_str]
 
     mdl_str = 'None'
     if save_model:
@@ -204,12 +356,14 @@ def engine_save(saved_stuff, current_step, metric, save_cfg=None, flag='inter',
         mdl = output_model / model_name    # mdl addr. model
         mdl_best = Path(save_cfg.output_dir) / model_name_best
         if best:
-            torch.save(checkpoint, mdl_best)
             logger.info(f'\033[1;31m =>Saved Best Model name:{mdl_best} \033[0m')
             mdl_str = str(mdl_best)
         else:
-            torch.save(checkpoint, mdl)
             logger.info(f'\033[1;31m =>Saved Model name:{mdl} \033[0m')
             mdl_str = str(mdl)
+        # the model file is the same as the checkpoint file
+        saved_paths.append(mdl_str)
+    
+    writer.submit(checkpoint, saved_paths, snapshot_time=snapshot_time)
         
     return {'ckpt_file': ckpt_str, 'model_file': mdl_str}
@@ -2,4 +2,5 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
-from .abstract_hook import *
\ No newline at end of file
+from .abstract_hook import *
+from .eval_executor import *
\ No newline at end of file
@@ -2,9 +2,26 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
+import os
+import time
 import torch
+import copy
+import numpy as np
+import queue
+import threading
+import traceback
+import collections
+import multiprocessing as mp
 from ..hook_registry import HOOK_REGISTRY
+from pyanomaly.core.utils import snapshot_saved_stuff
+from pyanomaly.datatools.dataclass.sampler.common import is_main_process, get_rank, get_world_size, gather
+from pyanomaly.datatools.dataclass.sampler.dist_inf_sampler import balance_video_shards
+from .eval_executor import VideoEvalExecutor
+from pyanomaly.core.engine.adaptive_stride import build_adaptive_stride
 import abc
+import logging
+logger = logging.getLogger(__name__)
+
 __all__ = ['HookBase', 'EvaluateHook']
 
 @HOOK_REGISTRY.register()
@@ -59,26 +76,327 @@ class HookBase(object):
         """
         pass
 
+def _unwrap_distributed(model):
+    # the DistributedDataParallel can not be copied, copy the module in it
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        return model.module
+    return model
+
+class _EngineSnapshot(object):
+    """The view of the engine used by the background evaluation.
+    The trainable models are the copies taken at the evaluation step, the frozen models and the other attributes are from the engine.
+    The attributes set by the evaluation (e.g. pkl_path) stay in the view.
+    """
+    def __init__(self, engine, models):
+        self.__dict__['_engine'] = engine
+        self.__dict__['_models'] = models
+    
+    def __getattr__(self, name):
+        models = self.__dict__['_models']
+        if name in models:
+            return models[name]
+        return getattr(self.__dict__['_engine'], name)
+    
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+
+    def set_requires_grad(self, nets, requires_grad=False):
+        if not isinstance(nets, list):
+            nets = [nets]
+        for net in nets:
+            if net is not None:
+                for param in net.parameters():
+                    param.requires_grad = requires_grad
+
+    def set_all(self, is_train):
+        # only change the copied models, the models in training are not touched
+        for model in self.__dict__['_models'].values():
+            self.set_requires_grad(model, is_train)
+            model.train(is_train)
+
+
+def _trainable_keys(engine):
+    # the models updated by the optimizers, the others(e.g. the auxiliary models) are frozen and not changed by the training
+    params = set()
+    for key in engine.optimizer.keys():
+        for group in getattr(engine, str(key)).param_groups:
+            params.update(id(param) for param in group['params'])
+    return [str(key) for key in engine.model.keys() if any(id(param) in params for param in getattr(engine, str(key)).parameters())]
+
+def _evaluate_in_process(hook, current_step, conn):
+    # the process is forked at the submit, so its models are the ones at the evaluation step and the training process is not touched
+    engine = hook.engine
+    # the forward of the DistributedDataParallel may use the collective ops of the training processes
+    for key in engine.model.keys():
+        setattr(engine, str(key), _unwrap_distributed(getattr(engine, str(key))))
+    writer_dict = engine.kwargs['writer_dict']
+    # the thread of the tensorboard writer is not copied by the fork, so write the events of the evaluation to its own file in the same dir
+    writer = writer_dict['writer']
+    writer_dict['writer'] = type(writer)(log_dir=writer.get_logdir(), filename_suffix=f'.eval{os.getpid()}')
+    try:
+        with torch.no_grad():
+            acc = hook.evaluate(current_step)
+        # the result files are used by the other hooks(e.g. VisScoreHook) of the training process
+        conn.send((acc, getattr(engine, 'pkl_path', None), None))
+    except Exception:
+        conn.send((None, None, traceback.format_exc()))
+    finally:
+        writer_dict['writer'].close()
+        conn.close()
+
+class _AsyncEvaluateWorker(object):
+    """Run the evaluations of the hook in the background processes.
+    At each evaluation step, a process is forked from the training process. It has the models of that step(copy-on-write), its own val data pipeline and tensorboard writer,
+    so the training continues at the same time and nothing is copied or pickled but the result. The forked process can not use cuda,
+    so on the gpu the evaluation runs in a background thread with the copies of the trainable models, and the frozen models are shared with the training.
+    The checkpoints are saved by the training process from the snapshot of the saving things taken at the submit, in the same layout as the synchronous saves.
+    The results are applied in the order of the steps.
+    Args:
+        hook(EvaluateHook): The hook which provides the evaluate method
+        max_staleness(int): The max number of the evaluations which are not finished, the training waits when it is reached
+    """
+    def __init__(self, hook, max_staleness=1):
+        self.hook = hook
+        self.max_staleness = max(1, int(max_staleness))
+        # (current_step, saved_stuff, the process or thread, the connection or the queue of the result)
+        self._jobs = collections.deque()
+        self.use_process = hook.engine.device.type == 'cpu'
+        if not self.use_process:
+            logger.warning(f'The forked evaluation process can not use {hook.engine.device}, evaluate in a background thread')
+    
+    def _run_thread(self, evaluate_hook, current_step, results):
+        try:
+            with torch.no_grad():
+                acc = evaluate_hook.evaluate(current_step)
+            results.put((acc, getattr(evaluate_hook.engine, 'pkl_path', None), None))
+        except Exception:
+            results.put((None, None, traceback.format_exc()))
+
+    def submit(self, current_step):
+        """Snapshot the saving things and start the evaluation in the background.
+        """
+        while len(self._jobs) >= self.max_staleness:
+            self.collect(block=True)
+        engine = self.hook.engine
+        trainable_keys = _trainable_keys(engine)
+        # the frozen models are not changed by the training, so they are shared instead of copied
+        saved_stuff = snapshot_saved_stuff(engine.saved_stuff, share=[key for key in engine.model.keys() if str(key) not in trainable_keys])
+        if self.use_process:
+            receiver, sender = mp.get_context('fork').Pipe(duplex=False)
+            worker = mp.get_context('fork').Process(target=_evaluate_in_process, args=(self.hook, current_step, sender), name=f'AsyncEvaluate-{current_step}', daemon=True)
+            worker.start()
+            sender.close()
+        else:
+            with torch.no_grad():
+                models = {key: copy.deepcopy(_unwrap_distributed(getattr(engine, key))) for key in trainable_keys}
+            evaluate_hook = copy.copy(self.hook)
+            evaluate_hook.engine = _EngineSnapshot(engine, models)
+            receiver = queue.Queue()
+            worker = threading.Thread(target=self._run_thread, args=(evaluate_hook, current_step, receiver), name=f'AsyncEvaluate-{current_step}', daemon=True)
+            worker.start()
+        self._jobs.append((current_step, saved_stuff, worker, receiver))
+        logger.info(f'Submit the evaluation of step {current_step}, {len(self._jobs)} evaluations are running')
+
+    def _receive(self, receiver, block):
+        if isinstance(receiver, queue.Queue):
+            try:
+                return receiver.get(block=block)
+            except queue.Empty:
+                return None
+        if not block and not receiver.poll():
+            return None
+        try:
+            return receiver.recv()
+        except EOFError:
+            return (None, None, 'The evaluation process exits without the result')
+
+    def collect(self, block=False):
+        """Apply the finished results in the order of the steps.
+        Args:
+            block(bool): wait for at least one result
+        """
+        while len(self._jobs) > 0:
+            current_step, saved_stuff, worker, receiver = self._jobs[0]
+            result = self._receive(receiver, block)
+            if result is None:
+                break
+            self._jobs.popleft()
+            worker.join()
+            acc, pkl_path, error = result
+            if error is not None:
+                raise Exception(f'The evaluation of step {current_step} fails:\n{error}')
+            if pkl_path is not None:
+                self.hook.engine.pkl_path = pkl_path
+            self.hook._update_accuracy(current_step, acc, saved_stuff)
+            block = False
+    
+    def close(self):
+        """Wait all of the evaluations.
+        """
+        while len(self._jobs) > 0:
+            self.collect(block=True)
+
+
 @HOOK_REGISTRY.register()
 class EvaluateHook(HookBase):
+    """The base class of the evaluation hooks.
+    The evaluation is executed every TRAIN.eval_step. If TRAIN.eval_async.use is True, it is executed in a background process forked at the step(_AsyncEvaluateWorker),
+    and the result is applied when it arrives, at most TRAIN.eval_async.max_staleness evaluations can run behind the training.
+    In the distributed training with SYSTEM.distributed.shard_eval, each process evaluates its own part of the val videos(local_video_keys),
+    and the records are gathered on the first process(gather_records) which computes the metric once.
+    With VAL.parallel.num_workers > 1, the videos of the process are evaluated concurrently by the pinned processes(map_videos).
+    With VAL.adaptive_stride.use, the hooks score the windows at the coarse stride and densify around the rising scores(score_adaptive).
+    """
+    def _sharded(self):
+        config = self.engine.config
+        # the background evaluation can not use the collective ops, since the training uses them at the same time
+        return config.SYSTEM.distributed.shard_eval and get_world_size() > 1 and not config.TRAIN.eval_async.use
+
+    def local_video_keys(self):
+        """Get the val videos evaluated by this process.
+        In the sharded evaluation, the videos are split among the processes and the numbers of frames are balanced, otherwise all of the videos.
+        Returns:
+            video_keys(list): The keys of the val_dataloaders_dict['general_dataset_dict']
+        """
+        video_keys = list(self.engine.val_dataset_keys)
+        if not self._sharded():
+            return video_keys
+        dataloaders = self.engine.val_dataloaders_dict['general_dataset_dict']
+        lengths = [dataloaders[key].dataset.pics_len for key in video_keys]
+        shard = balance_video_shards(lengths, get_world_size())[get_rank()]
+        logger.info(f'Rank {get_rank()} evaluates {len(shard)}/{len(video_keys)} videos, {sum(lengths[i] for i in shard)}/{sum(lengths)} frames')
+        return [video_keys[i] for i in shard]
+
+    def map_videos(self, func, video_keys):
+        """Evaluate the videos with the VideoEvalExecutor.
+        Args:
+            func: The function of one video, func(sn, video_name). It should not write the tensorboard, return the vis objects instead
+            video_keys(list): The videos, got from local_video_keys
+        Returns:
+            results(list): The results of func in the order of the video_keys
+        """
+        parallel_cfg = self.engine.config.VAL.parallel
+        executor = VideoEvalExecutor(parallel_cfg.num_workers, parallel_cfg.threads_per_worker, parallel_cfg.pin_cores, device=self.engine.device)
+        return executor.map(func, list(enumerate(video_keys)))
+
+    def gather_records(self, video_keys, *records):
+        """Gather the records of the videos on the first process.
+        All of the processes must call it in the sharded evaluation.
+        Args:
+            video_keys(list): The videos evaluated by this process, got from local_video_keys
+            records(list): The lists of the records, e.g. the scores, and the i-th record belongs to video_keys[i]
+        Returns:
+            records(tuple): The lists in the order of val_dataset_keys. None on the other processes, which should skip the metric
+        """
+        if not self._sharded():
+            return records
+        for item in records:
+            assert len(item) == len(video_keys), f'The number of the records does not match the videos, {len(item)} != {len(video_keys)}'
+        local = {key: [item[i] for item in records] for i, key in enumerate(video_keys)}
+        parts = gather(local, dst=0)
+        if not is_main_process():
+            return None
+        merged = dict()
+        for part in parts:
+            merged.update(part)
+        missing = [key for key in self.engine.val_dataset_keys if key not in merged]
+        assert len(missing) == 0, f'The records of the videos are missing:{missing}'
+        return tuple([merged[key][j] for key in self.engine.val_dataset_keys] for j in range(len(records)))
+
+    def read_clips(self, dataset, num_windows):
+        """Read the clips of one video in order, one clip per frame, in this process.
+        The val dataloaders are not used here, their sampler is shuffled and endless, and each worker moves its own cursor of the dataset.
+        Args:
+            dataset: The val dataset of the video
+            num_windows(int): The number of the windows in the video
+        Returns:
+            clips: The generator of the [1, C, D, H, W] clips on the cpu, the i-th clip starts at the frame i
+        """
+        for start in range(num_windows):
+            yield dataset.read_clip(start).unsqueeze(0)
+
+    @property
+    def adaptive_stride(self):
+        """Whether the windows are scored with the adaptive stride(VAL.adaptive_stride.use).
+        """
+        return self.engine.config.VAL.adaptive_stride.use
+
+    def score_adaptive(self, dataset, num_windows, score_fn, higher_is_abnormal=True, video_name=''):
+        """Score the windows of one video with the adaptive stride.
+        The clips are read at their starts(dataset.read_clip), so only the scored windows are loaded.
+        Args:
+            dataset: The val dataset of the video
+            num_windows(int): The number of the windows in the video
+            score_fn: The function scoring one clip, score_fn(clip) -> the score or [K] scores of the window, clip is the [1, C, D, H, W] tensor on the cpu
+            higher_is_abnormal(bool): The direction of the scores, e.g. False for the psnr
+        Returns:
+            scores(np.ndarray): [num_windows] or [num_windows, K], the interpolated scores of all the windows, used with the ScoreAssembler
+            evaluated(np.ndarray): [num_windows] bool, whether the window is scored by the model
+        """
+        schedule = build_adaptive_stride(self.engine.config.VAL.adaptive_stride, higher_is_abnormal)
+        def read_and_score(starts):
+            scores = []
+            for start in starts:
+                score = score_fn(dataset.read_clip(int(start)).unsqueeze(0))
+                if torch.is_tensor(score):
+                    score = score.detach().cpu().numpy()
+                scores.append(np.asarray(score, dtype=np.float64).reshape(-1))
+            scores = np.stack(scores, axis=0)
+            return scores[:, 0] if scores.shape[1] == 1 else scores
+        scores, evaluated = schedule.schedule(num_windows, read_and_score)
+        logger.info(f'Evaluated {int(evaluated.sum())}/{num_windows} windows of the video:{video_name}')
+        return scores, evaluated
+
+    def _get_async_worker(self):
+        if not hasattr(self, '_async_worker'):
+            async_cfg = self.engine.config.TRAIN.eval_async
+            self._async_worker = _AsyncEvaluateWorker(self, async_cfg.max_staleness) if async_cfg.use else None
+        return self._async_worker
+
+    def _update_accuracy(self, current_step, acc, saved_stuff=None):
+        if acc > self.engine.accuarcy:
+            self.engine.accuarcy = acc
+            # save the model & checkpoint
+            self.engine.save(current_step, best=True, saved_stuff=saved_stuff)
+        elif current_step % self.engine.steps.param['save'] == 0 and current_step != 0:
+            # save the checkpoint
+            self.engine.save(current_step, saved_stuff=saved_stuff)
+            logger.info('LOL==>the accuracy is not imporved in epcoh{} but save'.format(current_step))
+
     def after_step(self, current_step):
+        sharded = self._sharded()
+        if not is_main_process() and not sharded:
+            # in the distributed training, only the first process evaluates and saves the models
+            return
+        async_worker = self._get_async_worker()
+        if async_worker is not None:
+            async_worker.collect()
+            if current_step % self.engine.steps.param['eval'] == 0 and current_step != 0:
+                async_worker.submit(current_step)
+            return
+
         acc = 0.0
         if current_step % self.engine.steps.param['eval'] == 0 and current_step != 0:
+            start = time.time()
             with torch.no_grad():
                 acc = self.evaluate(current_step)
-                if acc > self.engine.accuarcy:
-                    self.engine.accuarcy = acc
-                    # save the model & checkpoint
-                    self.engine.save(current_step, best=True)
-                elif current_step % self.engine.steps.param['save'] == 0 and current_step != 0:
-                    # save the checkpoint
-                    self.engine.save(current_step)
-                    self.engine.logger.info('LOL==>the accuracy is not imporved in epcoh{} but save'.format(current_step))
+                if is_main_process():
+                    self._update_accuracy(current_step, acc)
+            logger.info(f'The evaluation of step {current_step} takes {time.time() - start:.1f}s' + (f' on {get_world_size()} processes' if sharded else ''))
+    
+    def after_train(self):
+        async_worker = self._get_async_worker()
+        if async_worker is not None:
+            async_worker.close()
     
     def inference(self):
         acc = self.evaluate(0)
-        self.engine.logger.info(f'The inference metric is:{acc:.3f}')
+        if is_main_process():
+            self.engine.logger.info(f'The inference metric is:{acc:.3f}')
     
     @abc.abstractmethod
     def evaluate(self, current_step)->float:
-        pass
\ No newline at end of file
+        """Evaluate the videos got from local_video_keys, and compute the metric with the records returned by gather_records.
+        The processes except the first one return after gather_records.
+        """
+        pass
@@ -0,0 +1,103 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Evaluate the videos in a pool of processes on the cpu.
+The workers are forked from the process of the hook, so they use the models in it without copying or pickling them.
+Each worker is pinned to its own slice of the cores and uses the same number of torch threads, so the workers do not compete for the cores.
+Only the arguments(the videos) and the results(the scores) are sent between the processes.
+"""
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['VideoEvalExecutor']
+
+# the function evaluating one video, which is inherited by the forked workers
+_WORKER_FUNC = None
+
+
+def _split_cores(cores, num_workers, threads_per_worker):
+    if threads_per_worker <= 0:
+        threads_per_worker = max(1, len(cores) // num_workers)
+    slices = []
+    for i in range(num_workers):
+        begin = (i * threads_per_worker) % len(cores)
+        core_slice = cores[begin:begin + threads_per_worker]
+        slices.append(core_slice if len(core_slice) > 0 else cores)
+    return threads_per_worker, slices
+
+
+def _init_worker(slots, core_slices, num_threads, pin_cores):
+    slot = slots.get()
+    if pin_cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, core_slices[slot])
+    torch.set_num_threads(num_threads)
+
+
+def _run_worker(args):
+    with torch.no_grad():
+        return _WORKER_FUNC(*args)
+
+
+class VideoEvalExecutor(object):
+    """Run the evaluation function of each video concurrently, and return the results in the order of the videos.
+    The pool is only used on the cpu, in the main thread and with more than one worker, otherwise the videos are evaluated one by one in this process.
+    Args:
+        num_workers(int): The number of the processes
+        threads_per_worker(int): The number of the torch threads and the pinned cores of each process, 0 means sharing the cores equally
+        pin_cores(bool): Pin each process to its own cores
+        device(torch.device): The device of the models. The forked processes can not use cuda
+    """
+    def __init__(self, num_workers=1, threads_per_worker=0, pin_cores=True, device=torch.device('cpu')):
+        self.num_workers = max(1, int(num_workers))
+        self.threads_per_worker = int(threads_per_worker)
+        self.pin_cores = pin_cores
+        self.device = torch.device(device)
+
+    def _use_pool(self, num_items):
+        if self.num_workers <= 1 or num_items <= 1:
+            return False
+        if self.device.type != 'cpu':
+            logger.warning(f'The parallel evaluation only supports the cpu, evaluate the videos one by one on {self.device}')
+            return False
+        if threading.current_thread() is not threading.main_thread():
+            # forking in a background thread(e.g. the asynchronous evaluation) may copy the locks held by the training thread
+            logger.warning('The parallel evaluation is not used in the background thread, evaluate the videos one by one')
+            return False
+        return True
+
+    def map(self, func, items):
+        """Evaluate the videos.
+        Args:
+            func: The function of one video, func(*item). Its results should be picklable, e.g. the numpy arrays or the cpu tensors
+            items(list): The arguments of each video, e.g. [(sn, video_name), ...]
+        Returns:
+            results(list): The results in the order of the items
+        """
+        global _WORKER_FUNC
+        items = [tuple(item) for item in items]
+        if not self._use_pool(len(items)):
+            return [func(*item) for item in items]
+
+        num_workers = min(self.num_workers, len(items))
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        num_threads, core_slices = _split_cores(cores, num_workers, self.threads_per_worker)
+        ctx = mp.get_context('fork')
+        slots = ctx.Queue()
+        for slot in range(num_workers):
+            slots.put(slot)
+        logger.info(f'Evaluate {len(items)} videos with {num_workers} processes, {num_threads} threads in each process')
+        _WORKER_FUNC = func
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_init_worker, initargs=(slots, core_slices, num_threads, self.pin_cores)) as executor:
+                # one video in each task, the lengths of the videos are different
+                results = list(executor.map(_run_worker, items, chunksize=1))
+        finally:
+            _WORKER_FUNC = None
+        return results
@@ -16,6 +16,7 @@ from ..abstract import EvaluateHook
 from pyanomaly.datatools.evaluate.utils import psnr_error
 from pyanomaly.core.utils import flow_batch_estimate, tensorboard_vis_images, save_score_results, vis_optical_flow
 from pyanomaly.datatools.evaluate.utils import simple_diff, find_max_patch, amc_score, calc_w
+from pyanomaly.datatools.evaluate.score_assembler import ScoreAssembler
 
 from ..hook_registry import HOOK_REGISTRY
 
@@ -58,8 +59,8 @@ class AMCEvaluateHook(EvaluateHook):
             scores = [0.0 for i in range(len_dataset)]
 
             for data, _, _ in data_loader:
-                input_data_test = data[:, :, 0, :, :].cuda()
-                target_test = data[:, :, 1, :, :].cuda()
+                input_data_test = data[:, :, 0, :, :].to(self.engine.device)
+                target_test = data[:, :, 1, :, :].to(self.engine.device)
                 # import ipdb; ipdb.set_trace()
                 output_flow_G, output_frame_G = self.engine.G(input_data_test)
                 gtFlowEstim = torch.cat([input_data_test, target_test], 1)
@@ -87,59 +88,67 @@ class AMCEvaluateHook(EvaluateHook):
         logger.info(f'wf:{wf}, wi:{wi}')
 
         # calc the score for the test dataset
-        num_videos = 0
-        random_video_sn = torch.randint(0, len(self.engine.test_dataset_keys), (1,))
+        video_keys = self.local_video_keys()
+        random_video_sn = int(torch.randint(0, max(len(video_keys), 1), (1,)))
         
-        for sn, video_name in enumerate(self.engine.test_dataset_keys):
-            num_videos += 1
-            # need to improve
-            dataloader = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name]
-            len_dataset = dataloader.dataset.pics_len
+        def evaluate_video(sn, video_name):
+            dataset = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name].dataset
+            len_dataset = dataset.pics_len
             test_iters = len_dataset - frame_num + 1
-            test_counter = 0
 
             vis_range = range(int(len_dataset*0.5), int(len_dataset*0.5 + 5))
-            # psnrs = np.empty(shape=(len_dataset,),dtype=np.float32)
-            scores = np.empty(shape=(len_dataset,),dtype=np.float32)
+            vis_list = []
+            assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize='max')
+            if self.adaptive_stride:
+                def score_clip(data):
+                    test_input = data[:, :, 0, :, :].to(self.engine.device)
+                    test_target = data[:, :, 1, :, :].to(self.engine.device)
+                    g_output_flow, g_output_frame = self.engine.G(test_input)
+                    _, flow_gt = flow_batch_estimate(self.engine.F, torch.cat([test_input, test_target], 1), self.engine.normalize.param['val'], 
+                                                     output_format=self.engine.config.DATASET.optical_format, optical_size=self.engine.config.DATASET.optical_size)
+                    score, _, _ = amc_score(test_target, g_output_frame, flow_gt, g_output_flow, wf, wi)
+                    return score
+                scores, _ = self.score_adaptive(dataset, test_iters, score_clip, video_name=video_name)
+                assembler.update(scores, starts=np.arange(test_iters))
+                return assembler.assemble(), vis_list
 
-            for frame_sn, (data, anno, meta) in enumerate(dataloader):
-                test_input = data[:, :, 0, :, :].cuda()
-                test_target = data[:, :, 1, :, :].cuda()
+            for frame_sn, data in enumerate(self.read_clips(dataset, test_iters)):
+                test_input = data[:, :, 0, :, :].to(self.engine.device)
+                test_target = data[:, :, 1, :, :].to(self.engine.device)
 
                 g_output_flow, g_output_frame = self.engine.G(test_input)
                 gt_flow_esti_tensor = torch.cat([test_input, test_target], 1)
-                flow_gt_vis, flow_gt = flow_batch_estimate(self.engine.F, gt_flow_esti_tensor, self.engine.param['val'], 
+                flow_gt_vis, flow_gt = flow_batch_estimate(self.engine.F, gt_flow_esti_tensor, self.engine.normalize.param['val'], 
                                                           output_format=self.engine.config.DATASET.optical_format, optical_size=self.engine.config.DATASET.optical_size)
                 # test_psnr = psnr_error(g_output_frame, test_target)
                 score, _, _ = amc_score(test_target, g_output_frame, flow_gt, g_output_flow, wf, wi)
-                # test_psnr = test_psnr.tolist()
-                score = score.tolist()
-                # psnrs[test_counter+frame_num-1]=test_psnr
-                scores[test_counter+frame_num-1] = score
-                test_counter += 1
+                assembler.update(score)
 
                 if sn == random_video_sn and (frame_sn in vis_range):
                     temp = vis_optical_flow(g_output_flow.detach(), output_format=self.engine.config.DATASET.optical_format, output_size=(g_output_flow.shape[-2], g_output_flow.shape[-1]), 
                                             normalize=self.engine.normalize.param['val'])
-                    vis_objects = OrderedDict({
-                        'amc_eval_frame': test_target.detach(),
-                        'amc_eval_frame_hat': g_output_frame.detach(),
-                        'amc_eval_flow': flow_gt_vis.detach(),
-                        'amc_eval_flow_hat': temp 
-                    })
-                    tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+                    vis_list.append(OrderedDict({
+                        'amc_eval_frame': test_target.detach().cpu(),
+                        'amc_eval_frame_hat': g_output_frame.detach().cpu(),
+                        'amc_eval_flow': flow_gt_vis.detach().cpu(),
+                        'amc_eval_flow_hat': temp.cpu()
+                    }))
                 
-                if test_counter >= test_iters:
-                    # psnrs[:frame_num-1]=psnrs[frame_num-1]
-                    # import ipdb; ipdb.set_trace()
-                    scores[:frame_num-1]=(scores[frame_num-1],) # fix the bug: TypeError: can only assign an iterable
-                    smax = max(scores)
-                    normal_scores = np.array([np.divide(s, smax) for s in scores])
-                    normal_scores = np.clip(normal_scores, 0, None)
-                    # psnr_records.append(psnrs)
-                    score_records.append(normal_scores)
+                if assembler.num_windows >= test_iters:
                     logger.info(f'Finish test video set {video_name}')
                     break
+            return assembler.assemble(), vis_list
+
+        for video_score, vis_list in self.map_videos(evaluate_video, video_keys):
+            score_records.append(video_score)
+            for vis_objects in vis_list:
+                tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+
+        gathered = self.gather_records(video_keys, score_records)
+        if gathered is None:
+            # the metric is computed on the first process
+            return 0.0
+        score_records, = gathered
         
         # Compute the metrics based on the model's results
         self.engine.pkl_path = save_score_results(score_records, self.engine.config, self.engine.logger, verbose=self.engine.verbose, config_name=self.engine.config_name, current_step=current_step, time_stamp=self.engine.kwargs["time_stamp"])
@@ -12,6 +12,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from pyanomaly.datatools.evaluate.utils import psnr_error
+from pyanomaly.datatools.evaluate.score_assembler import ScoreAssembler
 from pyanomaly.core.utils import save_score_results, tensorboard_vis_images
 
 from ..abstract import EvaluateHook
@@ -35,59 +36,54 @@ class AnoPCNEvaluateHook(EvaluateHook):
         tb_writer = self.engine.kwargs['writer_dict']['writer']
         global_steps = self.engine.kwargs['writer_dict']['global_steps_{}'.format(self.engine.kwargs['model_type'])]
 
-        frame_num = self.engine.config.DATASET.test_clip_length
+        frame_num = self.engine.config.DATASET.val.clip_length
         # psnr_records=[]
         score_records=[]
         total = 0
 
         # for dirs in video_dirs:
-        random_video_sn = torch.randint(0, len(self.engine.test_dataset_keys), (1,))
+        video_keys = self.local_video_keys()
+        random_video_sn = int(torch.randint(0, max(len(video_keys), 1), (1,)))
 
-        for sn, video_name in enumerate(self.engine.test_dataset_keys):
+        def evaluate_video(sn, video_name):
             # need to improve
             # dataset = self.engine.test_dataset_dict[video_name]
-            dataloader = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name]
-            len_dataset = dataloader.dataset.pics_len
+            dataset = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name].dataset
+            len_dataset = dataset.pics_len
             test_iters = len_dataset - frame_num + 1
-            test_counter = 0
 
-            # data_loader = DataLoader(dataset=dataset, batch_size=1, shuffle=False, num_workers=1)
-            # import ipdb; ipdb.set_trace()
-            # psnrs = np.empty(shape=(len_dataset,),dtype=np.float32)
-            scores = np.empty(shape=(len_dataset,),dtype=np.float32)
+            assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize='minmax')
             vis_range = range(int(len_dataset*0.5), int(len_dataset*0.5 + 5))
-            for frame_sn, (test_input, anno, meta) in enumerate(dataloader):
-                test_target = test_input[:, :, -1, :, :].cuda()
-                test_input = test_input[:, :, :-1, :, :].cuda()
+            vis_list = []
+            for frame_sn, test_input in enumerate(self.read_clips(dataset, test_iters)):
+                test_target = test_input[:, :, -1, :, :].to(self.engine.device)
+                test_input = test_input[:, :, :-1, :, :].to(self.engine.device)
 
                 _, g_output = self.engine.G(test_input, test_target)
                 test_psnr = psnr_error(g_output, test_target, hat=False)
-                test_psnr = test_psnr.tolist()
-                # psnrs[test_counter+frame_num-1]=test_psnr
-                scores[test_counter+frame_num-1]=test_psnr
+                assembler.update(test_psnr)
                 
                 if sn == random_video_sn and (frame_sn in vis_range):
-                    vis_objects = OrderedDict({
-                        'anopcn_eval_frame': test_target.detach(),
-                        'anopcn_eval_frame_hat': g_output.detach()
-                    })
-                    # vis_objects['anopcn_eval_frame'] = test_target.detach()
-                    # vis_objects['anopcn_eval_frame_hat'] = g_output.detach()
-                    tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
-                test_counter += 1
-                total+=1
-
-                if test_counter >= test_iters:
-                    # psnrs[:frame_num-1]=psnrs[frame_num-1]
-                    scores[:frame_num-1]=(scores[frame_num-1],)
-                    smax = max(scores)
-                    smin = min(scores)
-                    normal_scores = np.array([np.divide(s-smin, smax-smin) for s in scores])
-                    normal_scores = np.clip(normal_scores, 0, None)
-                    # psnr_records.append(psnrs)
-                    score_records.append(normal_scores)
+                    vis_list.append(OrderedDict({
+                        'anopcn_eval_frame': test_target.detach().cpu(),
+                        'anopcn_eval_frame_hat': g_output.detach().cpu()
+                    }))
+
+                if assembler.num_windows >= test_iters:
                     logger.info(f'finish test video set {video_name}')
                     break
+            return assembler.assemble(), vis_list
+
+        for video_score, vis_list in self.map_videos(evaluate_video, video_keys):
+            score_records.append(video_score)
+            for vis_objects in vis_list:
+                tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+
+        gathered = self.gather_records(video_keys, score_records)
+        if gathered is None:
+            # the metric is computed on the first process
+            return 0.0
+        score_records, = gathered
 
         # Compute the metrics based on the model's results
         self.engine.pkl_path = save_score_results(score_records, self.engine.config, self.engine.logger, verbose=self.engine.verbose, config_name=self.engine.config_name, current_step=current_step, time_stamp=self.engine.kwargs["time_stamp"])
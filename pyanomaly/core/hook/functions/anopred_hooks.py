@@ -11,6 +11,7 @@ from torch.utils.data import DataLoader
 from pyanomaly.datatools.evaluate.utils import psnr_error
 from pyanomaly.core.utils import flow_batch_estimate, tensorboard_vis_images, save_score_results
 from pyanomaly.datatools.evaluate.utils import simple_diff, find_max_patch, amc_score, calc_w
+from pyanomaly.datatools.evaluate.score_assembler import ScoreAssembler
 
 from ..abstract import EvaluateHook
 from ..hook_registry import HOOK_REGISTRY
@@ -41,51 +42,60 @@ class AnoPredEvaluateHook(EvaluateHook):
         # total = 0
 
         # for dirs in video_dirs:
-        random_video_sn = torch.randint(0, len(self.engine.val_dataset_keys), (1,))
-        for sn, video_name in enumerate(self.engine.val_dataset_keys):
-
-            # need to improve
-            dataset = self.engine.val_dataset_dict[video_name]
+        video_keys = self.local_video_keys()
+        random_video_sn = int(torch.randint(0, max(len(video_keys), 1), (1,)))
+        def evaluate_video(sn, video_name):
+            dataset = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name].dataset
             len_dataset = dataset.pics_len
             test_iters = len_dataset - frame_num + 1
-            test_counter = 0
-
-            data_loader = DataLoader(dataset=dataset, batch_size=1, shuffle=False, num_workers=1)
             
-            psnrs = np.empty(shape=(len_dataset,),dtype=np.float32)
-            scores = np.empty(shape=(len_dataset,),dtype=np.float32)
+            # the psnr belongs to the last frame of the clip
+            psnr_assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize=None)
+            score_assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize='minmax')
             vis_range = range(int(len_dataset*0.5), int(len_dataset*0.5 + 5))
+            vis_list = []
+            if self.adaptive_stride:
+                def score_clip(clip):
+                    target = clip[:, :, -1, :, :].to(self.engine.device)
+                    clip = clip[:, :, :-1, :, :].reshape(clip.shape[0], -1, clip.shape[-2], clip.shape[-1]).to(self.engine.device)
+                    return psnr_error(self.engine.G(clip).detach(), target, hat=True)
+                # the low psnr means the anomaly
+                psnr, _ = self.score_adaptive(dataset, test_iters, score_clip, higher_is_abnormal=False, video_name=video_name)
+                psnr_assembler.update(psnr, starts=np.arange(test_iters))
+                score_assembler.update(psnr, starts=np.arange(test_iters))
+                return score_assembler.assemble(), psnr_assembler.assemble(), vis_list
             
-            for frame_sn, (test_input, anno, meta) in enumerate(data_loader):
-                test_target = test_input[:, :, -1, :, :].cuda()
-                test_input = test_input[:, :, :-1, :, :].reshape(test_input.shape[0], -1, test_input.shape[-2],test_input.shape[-1]).cuda()
+            for frame_sn, test_input in enumerate(self.read_clips(dataset, test_iters)):
+                test_target = test_input[:, :, -1, :, :].to(self.engine.device)
+                test_input = test_input[:, :, :-1, :, :].reshape(test_input.shape[0], -1, test_input.shape[-2],test_input.shape[-1]).to(self.engine.device)
 
                 g_output = self.engine.G(test_input)
                 test_psnr = psnr_error(g_output.detach(), test_target, hat=True)
-                test_psnr = test_psnr.tolist()
-                psnrs[test_counter+frame_num-1]=test_psnr
-                scores[test_counter+frame_num-1]=test_psnr
+                psnr_assembler.update(test_psnr)
+                score_assembler.update(test_psnr)
 
-                test_counter += 1
-                # total+=1
                 if sn == random_video_sn and (frame_sn in vis_range):
-                    vis_objects = OrderedDict({
-                        'anopred_eval_frame': test_target.detach(),
-                        'anopred_eval_frame_hat': g_output.detach()
-                    })
-                    tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+                    vis_list.append(OrderedDict({
+                        'anopred_eval_frame': test_target.detach().cpu(),
+                        'anopred_eval_frame_hat': g_output.detach().cpu()
+                    }))
                 
-                if test_counter >= test_iters:
-                    psnrs[:frame_num-1]=psnrs[frame_num-1]
-                    scores[:frame_num-1]=(scores[frame_num-1],)
-                    smax = max(scores)
-                    smin = min(scores)
-                    normal_scores = np.array([np.divide(s-smin, smax-smin) for s in scores])
-                    normal_scores = np.clip(normal_scores, 0, None)
-                    psnr_records.append(psnrs)
-                    score_records.append(normal_scores)
+                if score_assembler.num_windows >= test_iters:
                     # print(f'finish test video set {video_name}')
                     break
+            return score_assembler.assemble(), psnr_assembler.assemble(), vis_list
+
+        for video_score, video_psnr, vis_list in self.map_videos(evaluate_video, video_keys):
+            score_records.append(video_score)
+            psnr_records.append(video_psnr)
+            for vis_objects in vis_list:
+                tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+
+        gathered = self.gather_records(video_keys, score_records, psnr_records)
+        if gathered is None:
+            # the metric is computed on the first process
+            return 0.0
+        score_records, psnr_records = gathered
 
         self.engine.pkl_path = save_score_results(self.engine.config, self.engine.logger, verbose=self.engine.verbose, config_name=self.engine.config_name, current_step=current_step, time_stamp=self.engine.kwargs["time_stamp"],score=score_records, psnr=psnr_records)
         results = self.engine.evaluate_function(self.engine.pkl_path, self.engine.logger, self.engine.config, self.engine.config.DATASET.score_type)
@@ -54,6 +54,10 @@ class VisScoreHook(HookBase):
             os.mkdir(self.engine.config.LOG.vis_dir)
         
         if current_step % self.engine.steps.param['eval'] == 0 and current_step != 0:
+            if getattr(self.engine, 'pkl_path', None) is None:
+                # the asynchronous evaluation(TRAIN.eval_async) sets the results when it finishes, the later steps show the latest ones
+                logger.info(f'No results of the evaluation @{current_step}, skip the vis')
+                return
             for key, item in self.engine.pkl_path.items():
                 logger.info(f'Vis the results in {item}')
                 self._vis_score_function(item, key, writer, global_steps)
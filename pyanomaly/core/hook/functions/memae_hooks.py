@@ -12,9 +12,12 @@ from collections import OrderedDict
 import matplotlib.pyplot as plt
 from tsnecuda import TSNE
 from scipy.ndimage import gaussian_filter1d
+import logging
+logger = logging.getLogger(__name__)
 
 from ..abstract import EvaluateHook
 from pyanomaly.datatools.evaluate.utils import reconstruction_loss
+from pyanomaly.datatools.evaluate.score_assembler import ScoreAssembler
 from pyanomaly.datatools.abstract.readers import GroundTruthLoader
 from pyanomaly.core.utils import tsne_vis, save_score_results, tensorboard_vis_images
 
@@ -39,56 +42,55 @@ class MemAEEvaluateHook(EvaluateHook):
         psnr_records=[]
         score_records=[]
         # total = 0
-        num_videos = 0
-        random_video_sn = torch.randint(0, len(self.engine.test_dataset_keys), (1,))
+        video_keys = self.local_video_keys()
+        random_video_sn = int(torch.randint(0, max(len(video_keys), 1), (1,)))
         # calc the score for the test dataset
-        for sn, video_name in enumerate(self.engine.test_dataset_keys):
-            num_videos += 1
-            # need to improve
-            dataset = self.engine.test_dataset_dict[video_name]
+        def evaluate_video(sn, video_name):
+            dataset = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name].dataset
             len_dataset = dataset.pics_len
             test_iters = len_dataset - frame_num + 1
             # test_iters = len_dataset // clip_step
-            test_counter = 0
 
-            data_loader = DataLoader(dataset=dataset, batch_size=1, shuffle=False, num_workers=1)
             vis_range = range(int(len_dataset*0.5), int(len_dataset*0.5 + 5))
-            # scores = np.empty(shape=(len_dataset,),dtype=np.float32)
-            scores = torch.zeros(len_dataset)
-            # scores = [0.0 for i in range(len_dataset)]
-            for clip_sn, (test_input, anno, meta) in enumerate(data_loader):
-                test_target = test_input.cuda()
+            vis_list = []
+            assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize='minmax', inverse=True)
+            if self.adaptive_stride:
+                def score_clip(clip):
+                    clip = clip.to(self.engine.device)
+                    output, _ = self.engine.MemAE(clip)
+                    return reconstruction_loss(output, clip)
+                scores, _ = self.score_adaptive(dataset, test_iters, score_clip, video_name=video_name)
+                assembler.update(scores, starts=np.arange(test_iters))
+                return assembler.assemble(), vis_list
+
+            for clip_sn, test_input in enumerate(self.read_clips(dataset, test_iters)):
+                test_target = test_input.to(self.engine.device)
                 time_len = test_input.shape[2]
                 output, _ = self.engine.MemAE(test_target)
                 clip_score = reconstruction_loss(output, test_target)
-                
-                # scores[test_counter*time_len:(test_counter + 1)*time_len] = clip_score.squeeze(0)
-                if (frame_num + test_counter) > len_dataset:
-                    temp = test_counter + frame_num - len_dataset
-                    scores[test_counter:len_dataset] = clip_score[temp:]
-                else:
-                    scores[test_counter:(frame_num + test_counter)] = clip_score
-                        
-                test_counter += 1
+                assembler.update(clip_score.unsqueeze(0))
 
                 if sn == random_video_sn and (clip_sn in vis_range):
-                    vis_objects = OrderedDict({
-                        'memae_eval_clip': test_target.detach(),
-                        'memae_eval_clip_hat': output.detach()
-                    })
-                    tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+                    vis_list.append(OrderedDict({
+                        'memae_eval_clip': test_target.detach().cpu(),
+                        'memae_eval_clip_hat': output.detach().cpu()
+                    }))
                 
-                if test_counter >= test_iters:
-                    # import ipdb; ipdb.set_trace()
-                    # scores[:frame_num-1]=(scores[frame_num-1],) # fix the bug: TypeError: can only assign an iterable
-                    smax = max(scores)
-                    smin = min(scores)
-                    # normal_scores = np.array([(1.0 - np.divide(s-smin, smax)) for s in scores])
-                    normal_scores = (1.0 - torch.div(scores-smin, smax-smin)).detach().cpu().numpy()
-                    normal_scores = np.clip(normal_scores, 0, None)
-                    score_records.append(normal_scores)
-                    print(f'finish test video set {video_name}')
+                if assembler.num_windows >= test_iters:
+                    logger.info(f'finish test video set {video_name}')
                     break
+            return assembler.assemble(), vis_list
+
+        for video_score, vis_list in self.map_videos(evaluate_video, video_keys):
+            score_records.append(video_score)
+            for vis_objects in vis_list:
+                tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+
+        gathered = self.gather_records(video_keys, score_records)
+        if gathered is None:
+            # the metric is computed on the first process
+            return 0.0
+        score_records, = gathered
         
         self.engine.pkl_path = save_score_results(self.engine.config, self.engine.logger, verbose=self.engine.verbose, config_name=self.engine.config_name, current_step=current_step, time_stamp=self.engine.kwargs["time_stamp"],score=score_records)
         results = self.engine.evaluate_function(self.engine.pkl_path, self.engine.logger, self.engine.config, self.engine.config.DATASET.score_type)
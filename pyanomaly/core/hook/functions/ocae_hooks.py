@@ -52,9 +52,9 @@ class ClusterHook(HookBase):
             data_loader = DataLoader(dataset=dataset, batch_size=1, shuffle=False, num_workers=1)
             # import ipdb; ipdb.set_trace()
             for test_input, anno, meta in data_loader:
-                future = data[:, :, 2, :, :].cuda() # t+1 frame 
-                current = data[:, :, 1, :, :].cuda() # t frame
-                past = data[:, :, 0, :, :].cuda() # t frame
+                future = data[:, :, 2, :, :].to(self.engine.device) # t+1 frame 
+                current = data[:, :, 1, :, :].to(self.engine.device) # t frame
+                past = data[:, :, 0, :, :].to(self.engine.device) # t frame
                 bboxs = get_batch_dets(self.engine.Detector, current)
                 for index, bbox in enumerate(bboxs):
                     # import ipdb; ipdb.set_trace()
@@ -177,9 +177,9 @@ class OCEvaluateHook(EvaluateHook):
             random_frame_sn = torch.randint(0, len_dataset,(1,))
             for frame_sn, (test_input, anno, meta) in enumerate(data_loader):
                 feature_record_object = []
-                future = test_input[:, :, 2, :, :].cuda()
-                current = test_input[:, :, 1, :, :].cuda()
-                past = test_input[:, :, 0, :, :].cuda()
+                future = test_input[:, :, 2, :, :].to(self.engine.device)
+                current = test_input[:, :, 1, :, :].to(self.engine.device)
+                past = test_input[:, :, 0, :, :].to(self.engine.device)
                 bboxs = get_batch_dets(self.engine.Detector, current)
                 for index, bbox in enumerate(bboxs):
                     # import ipdb; ipdb.set_trace()
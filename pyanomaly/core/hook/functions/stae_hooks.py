@@ -12,6 +12,7 @@ from ..abstract import EvaluateHook
 from ..hook_registry import HOOK_REGISTRY
 
 from pyanomaly.datatools.evaluate.utils import reconstruction_loss
+from pyanomaly.datatools.evaluate.score_assembler import ScoreAssembler
 from pyanomaly.core.utils import tensorboard_vis_images, save_score_results
 
 __all__ = ['STAEEvaluateHook']
@@ -39,54 +40,60 @@ class STAEEvaluateHook(EvaluateHook):
         frame_num = self.engine.config.DATASET.val.sampled_clip_length
         score_records=[]
         # num_videos = 0
-        random_video_sn = torch.randint(0, len(self.engine.val_dataset_keys), (1,))
+        video_keys = self.local_video_keys()
+        random_video_sn = int(torch.randint(0, max(len(video_keys), 1), (1,)))
 
         # calc the score for the test dataset
-        for sn, video_name in enumerate(self.engine.val_dataset_keys):
-            # num_videos += 1
-            # need to improve
-            dataloader = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name]
-            len_dataset = dataloader.dataset.pics_len
+        def evaluate_video(sn, video_name):
+            dataset = self.engine.val_dataloaders_dict['general_dataset_dict'][video_name].dataset
+            len_dataset = dataset.pics_len
             test_iters = len_dataset - frame_num + 1
             # test_iters = len_dataset // clip_step
-            test_counter = 0
 
             vis_range = range(int(len_dataset*0.5), int(len_dataset*0.5 + 5))
+            vis_list = []
 
-            scores = np.empty(shape=(len_dataset,),dtype=np.float32)
-            for clip_sn, (test_input, anno, meta) in enumerate(dataloader):
-                test_input = test_input.cuda()
-                # test_target = data[:,:,16:,:,:].cuda()
+            # the reconstruction error is high on the abnormal frames, so inverse it into the normal score
+            assembler = ScoreAssembler(len_dataset, frame_num, reduction='last', normalize='minmax', inverse=True)
+            if self.adaptive_stride:
+                def score_clip(clip):
+                    clip = clip.to(self.engine.device)
+                    output, _ = self.engine.STAE(clip)
+                    return reconstruction_loss(output, clip)
+                scores, _ = self.score_adaptive(dataset, test_iters, score_clip, video_name=video_name)
+                assembler.update(scores, starts=np.arange(test_iters))
+                return assembler.assemble(), vis_list
+
+            for clip_sn, test_input in enumerate(self.read_clips(dataset, test_iters)):
+                test_input = test_input.to(self.engine.device)
+                # test_target = data[:,:,16:,:,:].to(self.engine.device)
                 time_len = test_input.shape[2]
                 output, _ = self.engine.STAE(test_input)
                 clip_score = reconstruction_loss(output, test_input)
-                clip_score = clip_score.tolist()
-
-                if (frame_num + test_counter) > len_dataset:
-                    temp = test_counter + frame_num - len_dataset
-                    scores[test_counter:len_dataset] = clip_score[temp:]
-                else:
-                    scores[test_counter:(frame_num + test_counter)] = clip_score
-
-                test_counter += 1
+                assembler.update(clip_score.unsqueeze(0))
 
                 if sn == random_video_sn and (clip_sn in vis_range):
-                    vis_objects = OrderedDict({
-                        'stae_eval_clip': test_input.detach(),
-                        'stae_eval_clip_hat': output.detach()
-                    })
-                    tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
+                    vis_list.append(OrderedDict({
+                        'stae_eval_clip': test_input.detach().cpu(),
+                        'stae_eval_clip_hat': output.detach().cpu()
+                    }))
                 
-                if test_counter >= test_iters:
-                    # scores[:frame_num-1]=(scores[frame_num-1],) # fix the bug: TypeError: can only assign an iterable
-                    smax = max(scores)
-                    smin = min(scores)
-                    normal_scores = np.array([(1.0 - np.divide(s-smin, smax)) for s in scores])
-                    normal_scores = np.clip(normal_scores, 0, None)
-                    score_records.append(normal_scores)
+                if assembler.num_windows >= test_iters:
                     logger.info(f'Finish testing the video:{video_name}')
                     break
+            return assembler.assemble(), vis_list
+
+        for video_score, vis_list in self.map_videos(evaluate_video, video_keys):
+            score_records.append(video_score)
+            for vis_objects in vis_list:
+                tensorboard_vis_images(vis_objects, tb_writer, global_steps, normalize=self.engine.normalize.param['val'])
         
+        gathered = self.gather_records(video_keys, score_records)
+        if gathered is None:
+            # the metric is computed on the first process
+            return 0.0
+        score_records, = gathered
+
         # Compute the metrics based on the model's results
         self.engine.pkl_path = save_score_results(score_records, self.engine.config, self.engine.logger, verbose=self.engine.verbose, config_name=self.engine.config_name, current_step=current_step, time_stamp=self.engine.kwargs["time_stamp"])
         results = self.engine.evaluate_function.compute({'val': self.engine.pkl_path})        
@@ -17,6 +17,9 @@ import torch.nn.functional as F
 import torchvision.transforms.functional as tf
 from tsnecuda import TSNE
 from pyanomaly.utils import flow2img
+from pyanomaly.datatools.evaluate.results import save_score_archive, PICKLE_SUFFIX, COLUMNAR_SUFFIX
+from pyanomaly.datatools.evaluate.smoothing import smooth_scores
+from pyanomaly.datatools.dataclass.sampler.common import get_world_size, reduce_dict
 # from skimage.measure import compare_ssim as ssim
 from collections import OrderedDict
 import matplotlib.pyplot as plt
@@ -57,6 +60,58 @@ class ParamSet(object):
         return self.param_names
 
 
+def state_dict_to_cpu(state):
+    """Copy the tensors in the state dict to the cpu memory.
+    The nested dict/list (e.g. the state dict of the optimizer) are also supported. The copy does not share the memory with the original one,
+    so the training can continue while the copy is used.
+    Args:
+        state: The state dict or the tensor
+    Returns:
+        state_cpu: The same structure as the state
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return type(state)((k, state_dict_to_cpu(v)) for k, v in state.items())
+    elif isinstance(state, (list, tuple)):
+        return type(state)(state_dict_to_cpu(v) for v in state)
+    else:
+        return state
+
+class StateDictSnapshot(object):
+    """
+    Keep a copied state dict, it can be saved like a model or an optimizer by the engine_save
+    """
+    def __init__(self, state_dict):
+        self._state_dict = state_dict
+    
+    def state_dict(self):
+        return self._state_dict
+
+def snapshot_saved_stuff(saved_stuff, replace=None, share=None):
+    """Snapshot the saving things of the engine on the cpu.
+    Args:
+        saved_stuff(OrderedDict): The saving things, {'step':..., 'loss':..., $model_name: model, $optimizer_name: optimizer}
+        replace(dict): Use these objects instead of the ones in the saved_stuff with the same key, e.g. the copied model
+        share(list): The keys which are not copied, e.g. the frozen models which are not changed by the training
+    Returns:
+        snapshot(OrderedDict): The items which have the state_dict are replaced by the StateDictSnapshot
+    """
+    replace = dict() if replace is None else replace
+    share = set() if share is None else set(str(key) for key in share)
+    snapshot = OrderedDict()
+    for key, stuff in saved_stuff.items():
+        stuff = replace.get(key, stuff)
+        if key in share:
+            snapshot[key] = stuff
+        elif isinstance(stuff, dict):
+            snapshot[key] = {k: StateDictSnapshot(state_dict_to_cpu(replace.get(k, v).state_dict())) for k, v in stuff.items()}
+        elif hasattr(stuff, 'state_dict'):
+            snapshot[key] = StateDictSnapshot(state_dict_to_cpu(stuff.state_dict()))
+        else:
+            snapshot[key] = stuff
+    return snapshot
+
 def modelparallel(model):
     '''
     To make the model parallel 
@@ -241,7 +296,7 @@ def vis_optical_flow(batch_optical, output_format, output_size, normalize):
             if (len(normalize['mean'])!=0) and (len(normalize['std']) != 0):
                 temp_image = tf.normalize(temp_image, mean=normalize['mean'], std=normalize['std'])
         temp_list.append(temp_image)
-    optical_flow_image = torch.stack(temp_list, 0).cuda()
+    optical_flow_image = torch.stack(temp_list, 0).to(batch_optical.device)
     optical_flow_image = torch.nn.functional.interpolate(input=optical_flow_image,size=output_size, mode='bilinear', align_corners=False)
     return optical_flow_image
 
@@ -396,10 +451,15 @@ def save_score_results(score, cfg, logger, verbose=None, config_name='None', cur
 
     """
     # Smooth  function
+    smooth_cfg = cfg.DATASET.smooth
     def smooth_value(value, sigma):
         new_value = []
         for index, _ in enumerate(value):
-            temp = gaussian_filter1d(value[index], sigma)
+            if smooth_cfg.causal:
+                # the same as smoothing the scores of the service frame by frame
+                temp = smooth_scores(value[index], smooth_cfg.kernel, sigma, smooth_cfg.lag)
+            else:
+                temp = gaussian_filter1d(value[index], sigma)
             new_value.append(temp)
         return new_value
     
@@ -413,40 +473,63 @@ def save_score_results(score, cfg, logger, verbose=None, config_name='None', cur
     result_paths = OrderedDict()
 
     result_perfix_name = f'{verbose}_cfg#{config_name}#step{current_step}@{time_stamp}'
+    result_format = cfg.VAL.result_format
+    if result_format == 'pickle':
+        result_suffix = PICKLE_SUFFIX
+    elif result_format == 'columnar':
+        result_suffix = COLUMNAR_SUFFIX
+    else:
+        raise Exception(f'Not support the result format:{result_format}')
     # result_keys = kwargs.keys()
     result_dict = OrderedDict()
     result_dict['dataset'] = cfg.DATASET.name
     result_dict['num_videos'] = len(score)
     
-    if cfg.DATASET.smooth.guassian:
-        for sigma in cfg.DATASET.smooth.guassian_sigma:
-            new_score = smooth_value(score, sigma)
-            result_name = result_perfix_name + f'_sigma{sigma}_results.pkl'
+    sigmas = cfg.DATASET.smooth.guassian_sigma if cfg.DATASET.smooth.guassian else [None]
+    for sigma in sigmas:
+        new_score = smooth_value(score, sigma) if sigma is not None else score
+        result_name = result_perfix_name + f'_sigma{sigma}' + result_suffix
+        result_path = os.path.join(cfg.VAL.result_output, result_name)
+        if result_format == 'columnar':
+            save_score_archive(result_path, new_score, cfg.DATASET.name, step=current_step, sigma=sigma, model=cfg.MODEL.name)
+        else:
             result_dict['score'] = new_score
-            result_path = os.path.join(cfg.VAL.result_output, result_name)
-            # result_dict[f'score_smooth_{sigma}'] = new_score
             with open(result_path, 'wb') as writer:
                 pickle.dump(result_dict, writer, pickle.HIGHEST_PROTOCOL)
-            # result_paths.append(result_path) 
-            result_paths[f'sigma_{sigma}'] = result_path       
-            logger.info(f'Smooth the value with sigma:{sigma}')
-    else:
-        result_name = result_perfix_name + f'_sigmaNone_results.pkl'
-        result_path = os.path.join(cfg.VAL.result_output, result_name)
-        result_paths['sigma_None'] = result_path
-        # result_paths.append(result_path)
-        logger.info(f'Smooth the value with sigma: None')
+        # result_paths.append(result_path) 
+        result_paths[f'sigma_{sigma}'] = result_path       
+        logger.info(f'Smooth the value with sigma:{sigma}')
         
     return result_paths
 
 
+def reduce_meters(meter_list):
+    """Average the val and avg of the meters across the processes.
+    All of the processes must call it at the same step. Only the main process gets the averaged values.
+    Args:
+        meter_list(list): The AverageMeters
+    Returns:
+        values(list): [(val, avg), ...] of each meter
+    """
+    values = [(float(meter.val), float(meter.avg)) for meter in meter_list]
+    world_size = get_world_size()
+    if world_size < 2 or len(values) == 0:
+        return values
+    device = 'cuda' if torch.distributed.get_backend() == 'nccl' else 'cpu'
+    reduced = reduce_dict({f'{index:04d}': torch.tensor(value, dtype=torch.float64, device=device) for index, value in enumerate(values)}, average=True)
+    return [tuple(reduced[f'{index:04d}'].tolist()) for index in range(len(values))]
+
 def make_info_message(current_step, max_step, model_type, batch_time, batch_size, data_time, loss_list):
+    """Make the message of the training step.
+    In the distributed training, the losses are averaged across the processes and the batch size is the total of the processes.
+    """
+    batch_size = batch_size * get_world_size()
     speed = batch_time.val / batch_size
+    loss_values = reduce_meters(loss_list)
     loss_string = ''
     for index, loss_meter in enumerate(loss_list):
         loss_name = loss_meter.name
-        loss_val = loss_meter.val
-        loss_avg = loss_meter.avg
+        loss_val, loss_avg = loss_values[index]
         loss_string += f'{loss_name}:{loss_val:.5f}({loss_avg:.5f})'
         if index != (len(loss_list) -1):
             loss_string += '\t'
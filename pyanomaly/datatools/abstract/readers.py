@@ -9,11 +9,14 @@ import numpy as np
 import torchvision.transforms.functional as tf
 import os
 import numpy as np
+import hashlib
 import scipy.io as scio
 import imgaug.augmenters as iaa
 import logging
 logger = logging.getLogger(__name__)
 
+from ..tools import save_ragged_array, load_ragged_array, is_ragged_file
+
 __all__ = ['ImageLoader', 'VideoLoader', 'GroundTruthLoader']
 
 class ImageLoader(object):
@@ -275,10 +278,15 @@ class GroundTruthLoader(object):
     #         self.name = self.cfg.DATASET.name
         
     #     self.gt_path = self.cfg.DATASET.gt_path
-    def __init__(self) -> None:
+    def __init__(self, cache_dir='') -> None:
+        """
+        Args:
+            cache_dir(str): The directory of the compiled ground truth files, '' means not use the cache.
+        """
         self.dataset_name = ''
         self.gt_path = ''
         self.data_path = ''
+        self.cache_dir = cache_dir
     
     def set_name(self, dataset_name):
         self.dataset_name = dataset_name
@@ -302,15 +310,76 @@ class GroundTruthLoader(object):
         self.set_gt_path(gt_path)
         self.set_data_path(data_path)
         logger.info(f'Read the ground truth of dataset {self.dataset_name} in {self.gt_path} of {self.data_path}')
+        if dataset_name not in [GroundTruthLoader.Shanghai, GroundTruthLoader.Avenue, GroundTruthLoader.Ped1, GroundTruthLoader.Ped2]:
+            raise Exception(f'Not Support dataset: {self.dataset_name}')
+        
+        if self.cache_dir:
+            gt = self._load_cache()
+            if gt is not None:
+                return gt
+
         if dataset_name == GroundTruthLoader.Shanghai:
             gt = self._load_shanghai_gt()
-        elif dataset_name in [GroundTruthLoader.Avenue, GroundTruthLoader.Ped1, GroundTruthLoader.Ped2]:
-            gt = self._load_avenue_ped1_ped2_gt()
         else:
-            raise Exception(f'Not Support dataset: {self.dataset_name}')
+            gt = self._load_avenue_ped1_ped2_gt()
 
+        if self.cache_dir:
+            self._save_cache(gt)
         # pass
         return gt
+    
+    def _fingerprint(self):
+        """The fingerprint of the sources of the ground truth.
+        It uses the size and the modified time of the label files and the video folders(the time changes when adding or removing frames), 
+        so it does not need to list the frames of each video.
+        """
+        sha = hashlib.sha1()
+        sha.update(f'{self.dataset_name}|{os.path.abspath(self.gt_path)}|{os.path.abspath(self.data_path)}'.encode('utf-8'))
+        if self.dataset_name == GroundTruthLoader.Shanghai:
+            sources = [os.path.join(self.gt_path, name) for name in sorted(os.listdir(self.gt_path))]
+        else:
+            sources = [os.path.join(self.gt_path, GroundTruthLoader._LABEL_FILE[self.dataset_name]), self.data_path]
+            sources += [os.path.join(self.data_path, name) for name in sorted(os.listdir(self.data_path))]
+        for source in sources:
+            stat = os.stat(source)
+            sha.update(f'{os.path.basename(source)}|{stat.st_size}|{stat.st_mtime_ns}'.encode('utf-8'))
+        return sha.hexdigest()
+    
+    def _cache_file(self):
+        key = hashlib.sha1(f'{os.path.abspath(self.gt_path)}|{os.path.abspath(self.data_path)}'.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f'{self.dataset_name}_{key}.gt')
+
+    def _load_cache(self):
+        """Memory-map the compiled ground truth.
+        Returns:
+            gt(list|None): The labels of each video, None if the cache does not exist or is out of date
+        """
+        cache_file = self._cache_file()
+        if not is_ragged_file(cache_file):
+            return None
+        fingerprint = self._fingerprint()
+        cache = load_ragged_array(cache_file, mmap=True)
+        if cache.meta.get('fingerprint') != fingerprint:
+            logger.info(f'The ground truth cache {cache_file} is out of date')
+            return None
+        logger.info(f'Load the compiled ground truth from {cache_file}')
+        return list(cache)
+
+    def _save_cache(self, gt):
+        """Compile the ground truth into one file, concatenated int8 labels + offsets of videos + the fingerprint of the sources.
+        """
+        cache_file = self._cache_file()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = dict(dataset=self.dataset_name, gt_path=self.gt_path, data_path=self.data_path, fingerprint=self._fingerprint())
+        try:
+            save_ragged_array(cache_file, gt, dtype=np.int8, meta=meta)
+        except OSError as e:
+            # another process(e.g. the other ranks) may replace or map the same file at the same time, the labels are already read
+            if is_ragged_file(cache_file):
+                logger.info(f'The ground truth cache {cache_file} is written by another process: {e}')
+                return
+            raise
+        logger.info(f'Compile the ground truth into {cache_file}')
 
     def _load_avenue_ped1_ped2_gt(self):
         mat_file = os.path.join(self.gt_path, GroundTruthLoader._LABEL_FILE[self.dataset_name])
@@ -89,6 +89,17 @@ class AbstractVideoDataset(Dataset):
 
         self.videos_keys = self.videos.keys()
     
+    def state_dict(self):
+        """The mutable state of the dataset, i.e. the cursor of each video.
+        It only makes sense when the data is loaded in the main process(num_workers=0), otherwise the cursors are in the workers.
+        """
+        return {'cursor': OrderedDict((video_name, video['cursor']) for video_name, video in self.videos.items())}
+    
+    def load_state_dict(self, state):
+        for video_name, cursor in state['cursor'].items():
+            if video_name in self.videos:
+                self.videos[video_name]['cursor'] = cursor
+    
     def __getitem__(self, indice):
         raise Exception(f'No inplement at {AbstractVideoDataset._NAME}')
     
@@ -182,6 +193,17 @@ class FrameLevelVideoDataset(AbstractVideoDataset):
                                                                  step=self.frame_step)
         self.videos[video_name]['cursor'] = cusrsor + self.clip_step
         return video_clip
+
+    def read_clip(self, start, video_name=None):
+        '''
+        Read the clip which starts at the frame `start`, the cursor is not changed.
+        It is used by the evaluation which does not score every clip, e.g. the adaptive stride
+        '''
+        if video_name is None:
+            video_name = list(self.videos_keys)[0]
+        video_clip, _ = self.video_loader.read(self.videos[video_name]['frames'], start, start+self.clip_length, clip_length=self.sampled_clip_length, 
+                                               step=self.frame_step)
+        return video_clip
     
     def _get_annotations(self, video_name):
         '''
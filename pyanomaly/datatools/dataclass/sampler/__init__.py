@@ -4,4 +4,5 @@
 """
 from .common import *
 from .inf_sampler import TrainSampler
-from .dist_inf_sampler import DistTrainSampler
\ No newline at end of file
+from .dist_inf_sampler import DistTrainSampler, InferenceSampler, balance_video_shards
+from .data_stream import DataStream
\ No newline at end of file
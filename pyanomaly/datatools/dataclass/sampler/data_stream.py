@@ -0,0 +1,98 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+import random
+import numpy as np
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['DataStream']
+
+class DataStream(object):
+    """The iterator of the training dataloader, which can be saved in the checkpoint.
+    It counts the batches used by the trainer, so the state contains the position of the sampler, the cursors of the dataset and the RNG states.
+    After loading the state, the stream continues from the next batch without reading the used batches again.
+    Args:
+        dataloader(torch.utils.data.DataLoader): The dataloader with the batch_sampler made of the TrainSampler or DistTrainSampler
+    """
+    def __init__(self, dataloader):
+        self.dataloader = dataloader
+        self.batch_sampler = dataloader.batch_sampler
+        self.sampler = getattr(self.batch_sampler, 'sampler', None)
+        self.batch_size = getattr(self.batch_sampler, 'batch_size', 1)
+        self._start = self._sampler_start()
+        self.num_batches = 0
+        self._iter = iter(self.dataloader)
+
+    def _check_workers(self):
+        # each worker process has its own copy of the dataset, so the cursors of the main process are not the ones used by the workers
+        if getattr(self.dataloader, 'num_workers', 0) > 0 and hasattr(self.dataloader.dataset, 'state_dict'):
+            logger.warning(f'The dataloader uses {self.dataloader.num_workers} workers, the cursors of the dataset in the workers are not saved or restored')
+
+    def _sampler_start(self):
+        if self.sampler is not None and hasattr(self.sampler, 'state_dict'):
+            return self.sampler.state_dict()['start']
+        return 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = next(self._iter)
+        self.num_batches += 1
+        return batch
+
+    @property
+    def position(self):
+        """The number of the indices used from the sampler's stream.
+        """
+        return self._start + self.num_batches * self.batch_size
+
+    def state_dict(self):
+        state = dict()
+        state['position'] = self.position
+        if self.sampler is not None and hasattr(self.sampler, 'state_dict'):
+            sampler_state = self.sampler.state_dict()
+            sampler_state['start'] = self.position
+            state['sampler'] = sampler_state
+        dataset = self.dataloader.dataset
+        self._check_workers()
+        if hasattr(dataset, 'state_dict'):
+            state['dataset'] = dataset.state_dict()
+        # the keys of numpy are kept in a tensor, so the state can be loaded by torch.load(weights_only=True)
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        numpy_state = (name, torch.from_numpy(keys.astype(np.int64)), int(pos), int(has_gauss), float(cached_gaussian))
+        state['rng'] = {'python': random.getstate(), 'numpy': numpy_state, 'torch': torch.get_rng_state()}
+        if torch.cuda.is_available():
+            state['rng']['cuda'] = torch.cuda.get_rng_state_all()
+        return state
+
+    def load_state_dict(self, state):
+        """Restore the stream, the next batch is the one after the saved position.
+        """
+        if 'sampler' in state and self.sampler is not None and hasattr(self.sampler, 'load_state_dict'):
+            self.sampler.load_state_dict(state['sampler'])
+        else:
+            logger.warning('The sampler can not be restored, the data stream starts from the beginning')
+        dataset = self.dataloader.dataset
+        self._check_workers()
+        if 'dataset' in state and hasattr(dataset, 'load_state_dict'):
+            dataset.load_state_dict(state['dataset'])
+        # restore the RNG states before making the iterator, so the seed drawn by the iterator comes from the saved states
+        rng = state.get('rng', {})
+        if 'python' in rng:
+            random.setstate(rng['python'])
+        if 'numpy' in rng:
+            name, keys, pos, has_gauss, cached_gaussian = rng['numpy']
+            np.random.set_state((name, np.asarray(keys, dtype=np.int64).astype(np.uint32), pos, has_gauss, cached_gaussian))
+        if 'torch' in rng:
+            torch.set_rng_state(rng['torch'].cpu())
+        if 'cuda' in rng and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([item.cpu() for item in rng['cuda']])
+        # restart the iterator, so the sampler starts from the new position
+        self._start = self._sampler_start()
+        self.num_batches = 0
+        self._iter = iter(self.dataloader)
+        logger.info(f'=> Resume the data stream at the position {self.position}')
@@ -37,7 +37,7 @@ class DistTrainSampler(Sampler):
             seed (int): the initial seed of the shuffle. Must be the same
                 across all workers. If None, will use a random seed shared
                 among workers (require synchronization among all workers).
-            start(int): where to start to generate the data
+            start(int): where to start to generate the data, it is the number of the indices which have been produced by this worker
         """
         self._size = size
         assert size > 0
@@ -47,7 +47,7 @@ class DistTrainSampler(Sampler):
             # seed = comm.shared_random_seed()
             seed = shared_random_seed()
         self._seed = int(seed)
-        # self._start = start
+        self._start = start
 
         # self._rank = comm.get_rank()
         self._rank = get_rank()
@@ -55,8 +55,24 @@ class DistTrainSampler(Sampler):
         self._world_size = get_world_size()
 
     def __iter__(self):
-        start = self._rank
+        start = self._rank + self._start * self._world_size
         yield from itertools.islice(self._inf_indices(), start, None, self._world_size)
+
+    def set_start(self, start):
+        """Skip the indices which have been produced by this worker, used when resuming. It works on the next iter().
+        """
+        self._start = int(start)
+
+    def state_dict(self):
+        return {'size': self._size, 'seed': self._seed, 'shuffle': self._shuffle, 'start': self._start, 'world_size': self._world_size}
+
+    def load_state_dict(self, state):
+        assert state['size'] == self._size, f'The size of the dataset is changed, {state["size"]} != {self._size}'
+        assert state['world_size'] == self._world_size, f'The number of workers is changed, {state["world_size"]} != {self._world_size}'
+        # the seed must be the same, otherwise the shuffled stream is different
+        self._seed = state['seed']
+        self._shuffle = state['shuffle']
+        self._start = state['start']
     
     def _inf_indices(self):
         g = torch.Generator()
@@ -78,13 +94,41 @@ class InferenceSampler(Sampler):
         """
         Args:
             size (int): the total number of data of the underlying dataset to sample from
+            start(int): skip the first indices of the dataset
         """
         self._size = size
         assert size > 0
-        self._locak_indeices = range(start, self._size)
+        self._rank = get_rank()
+        self._world_size = get_world_size()
+
+        total = max(self._size - start, 0)
+        shard_size = (total - 1) // self._world_size + 1 if total > 0 else 0
+        begin = start + shard_size * self._rank
+        end = min(start + shard_size * (self._rank + 1), self._size)
+        self._local_indices = range(begin, max(begin, end))
     
     def __iter__(self):
         yield from self._local_indices
 
     def __len__(self):
-        return len(self._local_indices)
\ No newline at end of file
+        return len(self._local_indices)
+
+def balance_video_shards(video_lengths, num_shards):
+    """Split the videos into the shards whose numbers of frames are close, used by the sharded evaluation.
+    The longest video is given to the shard with the fewest frames at present, so the time of the slowest shard is close to the average.
+    Args:
+        video_lengths(list): The number of frames of each video
+        num_shards(int): The number of the processes
+    Returns:
+        shards(list): The indices of the videos in each shard, in the ascending order
+    """
+    assert num_shards > 0, f'The number of shards should be positive, but got {num_shards}'
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    # sort by the length, and by the index when the lengths are the same, so every process gets the same result
+    order = sorted(range(len(video_lengths)), key=lambda i: (-video_lengths[i], i))
+    for index in order:
+        target = min(range(num_shards), key=lambda k: (loads[k], k))
+        shards[target].append(index)
+        loads[target] += video_lengths[index]
+    return [sorted(shard) for shard in shards]
@@ -19,6 +19,20 @@ class TrainSampler(Sampler):
     def __iter__(self):
         yield from itertools.islice(self._inf_indices(), self._start, None)
 
+    def set_start(self, start):
+        """Skip the first `start` indices of the stream, used when resuming. It works on the next iter().
+        """
+        self._start = int(start)
+
+    def state_dict(self):
+        return {'size': self._size, 'seed': self._seed, 'shuffle': self._shuffle, 'start': self._start}
+
+    def load_state_dict(self, state):
+        assert state['size'] == self._size, f'The size of the dataset is changed, {state["size"]} != {self._size}'
+        self._seed = state['seed']
+        self._shuffle = state['shuffle']
+        self._start = state['start']
+
     def _inf_indices(self):
         g = torch.Generator()
         g.manual_seed(self._seed)
@@ -77,6 +77,10 @@ class DataAPI(AbstractBuilder):
         # build the val part of dataloder dict
         dataset_dict = dataset_all['val_dataset_dict']
         batch_size = self.cfg.VAL.batch_size
+        # each worker has its own copy of the dataset, so it moves its own cursor of the video(and the cursors can not be saved for the resume)
+        # so all of the clips are read in the main process
+        if self.cfg.DATASET.num_workers > 0:
+            logger.info(f'The datasets read the clips by the cursors of the videos, DATASET.num_workers={self.cfg.DATASET.num_workers} is ignored and the clips are read in the main process')
         
         for key in dataset_dict.keys():
             temp = dataset_dict[key]
@@ -86,7 +90,7 @@ class DataAPI(AbstractBuilder):
                 temp_data_len = len(dataset)
                 sampler = self._build_sampler(temp_data_len)
                 batch_sampler = torch.utils.data.sampler.BatchSampler(sampler, batch_size, drop_last=True)
-                dataloader = DataLoader(dataset, batch_sampler=batch_sampler, pin_memory=True, num_workers=self.cfg.DATASET.num_workers)
+                dataloader = DataLoader(dataset, batch_sampler=batch_sampler, pin_memory=True, num_workers=0)
                 dataloader_dict['val'][key][dataset_key] = dataloader
         
         # build the train part of dataloader dict
@@ -103,7 +107,7 @@ class DataAPI(AbstractBuilder):
                     # need to change
                     sampler = self._build_sampler(temp_data_len)
                     batch_sampler = torch.utils.data.sampler.BatchSampler(sampler, batch_size, drop_last=True)
-                    dataloader = DataLoader(dataset, batch_sampler=batch_sampler, pin_memory=True)
+                    dataloader = DataLoader(dataset, batch_sampler=batch_sampler, pin_memory=True, num_workers=0)
                     dataloader_dict['train'][key][dataset_key] = dataloader
         
         return dataloader_dict
@@ -1 +1,3 @@
 from .eval_function import *
+from .score_assembler import *
+from .smoothing import *
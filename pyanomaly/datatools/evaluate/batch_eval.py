@@ -0,0 +1,200 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Evaluate a directory of result files in parallel.
+The ground truth is loaded once into the shared memory, and the result files are evaluated by a pool of processes.
+The metrics of all files are written into one table, sorted by the step and the sigma.
+For example:
+    python -m pyanomaly.datatools.evaluate.batch_eval ./output/results --cfg ./configuration/stae/ped2/ped2_default.yaml --workers 8 --output ./output/stae_ped2.csv
+"""
+import os
+import csv
+import argparse
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from sklearn import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+from ..abstract.readers import GroundTruthLoader
+from .results import load_score_results, parse_result_name, PICKLE_SUFFIX, COLUMNAR_SUFFIX
+from .utils import cal_eer
+
+__all__ = ['list_result_files', 'compute_frame_auc', 'evaluate_result_file', 'evaluate_directory']
+
+TABLE_FIELDS = ['step', 'sigma', 'video_auc', 'frame_auc', 'eer', 'num_videos', 'file']
+
+# the ground truth which is attached in the worker process
+_WORKER_GT = None
+
+
+def list_result_files(result_dir):
+    """Get the result files in the directory, both the pickle and the columnar files.
+    """
+    names = sorted(os.listdir(result_dir))
+    return [os.path.join(result_dir, name) for name in names if name.endswith(PICKLE_SUFFIX) or name.endswith(COLUMNAR_SUFFIX)]
+
+
+def _split_gt(labels, offsets):
+    return [labels[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+
+def _init_worker(shm_name, offsets, pos_label):
+    global _WORKER_GT
+    shm = shared_memory.SharedMemory(name=shm_name)
+    labels = np.ndarray((int(offsets[-1]),), dtype=np.int8, buffer=shm.buf)
+    # keep the shm object, otherwise the buffer is released
+    _WORKER_GT = (shm, _split_gt(labels, offsets), pos_label)
+
+
+def _worker_evaluate(result_file):
+    _, gt, pos_label = _WORKER_GT
+    return evaluate_result_file(result_file, gt, pos_label)
+
+
+def compute_frame_auc(scores, gt, pos_label=0, return_eer=False):
+    """Compute the frame-level AUC of the scores of all videos.
+    Args:
+        scores(list): The scores of each video
+        gt(list): The labels of each video
+        pos_label(int): 0 if the score is the normal score, 1 if the score is the abnormal score
+        return_eer(bool): Also return the EER of the same ROC curve
+    Returns:
+        auc(float), or (auc, eer) if return_eer
+    """
+    all_scores = np.concatenate([np.asarray(item) for item in scores])
+    all_labels = np.concatenate(gt)
+    fpr, tpr, _ = metrics.roc_curve(all_labels, all_scores, pos_label=pos_label)
+    auc = float(metrics.auc(fpr, tpr))
+    if not return_eer:
+        return auc
+    return auc, float(cal_eer(fpr, tpr))
+
+
+def evaluate_result_file(result_file, gt, pos_label=0):
+    """Compute the metrics of one result file.
+    Args:
+        result_file(str): The path of the result file
+        gt(list): The labels of each video
+        pos_label(int): 0 if the score is the normal score, 1 if the score is the abnormal score
+    Returns:
+        row(OrderedDict): The keys are TABLE_FIELDS
+    """
+    results = load_score_results(result_file)
+    scores = results['score']
+    assert results['num_videos'] == len(gt), f'the number of saved videos does not match the ground truth, {results["num_videos"]} != {len(gt)}'
+    video_aucs = []
+    for i in range(len(gt)):
+        assert len(scores[i]) == len(gt[i]), f'The length of video {i} in {result_file} does not match the ground truth, {len(scores[i])} != {len(gt[i])}'
+        fpr, tpr, _ = metrics.roc_curve(gt[i], scores[i], pos_label=pos_label)
+        video_aucs.append(metrics.auc(fpr, tpr))
+    frame_auc, eer = compute_frame_auc(scores, gt, pos_label, return_eer=True)
+
+    info = parse_result_name(result_file)
+    meta = results.get('meta', {})
+    row = OrderedDict()
+    row['step'] = meta.get('step', info.get('step'))
+    row['sigma'] = meta.get('sigma', info.get('sigma'))
+    # skip the videos whose AUC is undefined, e.g. no abnormal frame in the video
+    row['video_auc'] = float(np.nanmean(video_aucs))
+    row['frame_auc'] = frame_auc
+    row['eer'] = eer
+    row['num_videos'] = len(gt)
+    row['file'] = os.path.basename(result_file)
+    return row
+
+
+def _sort_key(row):
+    step = row['step'] if row['step'] is not None else -1
+    sigma = row['sigma'] if row['sigma'] is not None else -1
+    return (step, sigma, row['file'])
+
+
+def evaluate_directory(result_dir, dataset_name, gt_path, data_path, score_type='normal', num_workers=None, output_file=None, gt_cache_dir=''):
+    """Evaluate all of result files in the directory.
+    Args:
+        result_dir(str): The directory of the result files
+        dataset_name(str): The name of the dataset, e.g. 'Ped2'
+        gt_path(str): The path of the ground truth
+        data_path(str): The path of the testing videos
+        score_type(str): 'normal' | 'abnormal'
+        num_workers(int): The number of processes, None means the number of cpus
+        output_file(str): The path of the csv table, None means not write
+        gt_cache_dir(str): The directory of the compiled ground truth, '' means not use the cache
+    Returns:
+        rows(list): The metrics of each file, sorted by the step and the sigma
+    """
+    if score_type == 'normal':
+        pos_label = 0
+    elif score_type == 'abnormal':
+        pos_label = 1
+    else:
+        raise Exception(f'Not support the score type:{score_type}')
+
+    result_files = list_result_files(result_dir)
+    if len(result_files) == 0:
+        logger.info(f'No result file in {result_dir}')
+        return []
+
+    gt = GroundTruthLoader(gt_cache_dir).read(dataset_name, gt_path, data_path)
+    offsets = np.zeros(len(gt) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in gt])
+    shm = shared_memory.SharedMemory(create=True, size=max(int(offsets[-1]), 1))
+    labels = np.ndarray((int(offsets[-1]),), dtype=np.int8, buffer=shm.buf)
+    try:
+        labels[:] = np.concatenate(gt).astype(np.int8)
+        chunksize = max(1, len(result_files) // (4 * (num_workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(shm.name, offsets, pos_label)) as executor:
+            rows = list(executor.map(_worker_evaluate, result_files, chunksize=chunksize))
+    finally:
+        # release the view before closing the shared memory
+        labels = None
+        shm.close()
+        shm.unlink()
+
+    rows = sorted(rows, key=_sort_key)
+    if output_file is not None:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f'Write the metrics of {len(rows)} files into {output_file}')
+    best = max(rows, key=lambda row: row['video_auc'])
+    logger.info(f'The optimal result: {dict(best)}')
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate the result files in a directory with a pool of processes')
+    parser.add_argument('result_dir', help='the directory of the result files')
+    parser.add_argument('--cfg', default=None, help='the config file, use DATASET.name, DATASET.val.gt_path, DATASET.val.data_path and DATASET.score_type in it')
+    parser.add_argument('--dataset', default=None)
+    parser.add_argument('--gt_path', default=None)
+    parser.add_argument('--data_path', default=None)
+    parser.add_argument('--score_type', default=None)
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes, default is the number of cpus')
+    parser.add_argument('--output', default=None, help='the csv file of the table')
+    parser.add_argument('--gt_cache_dir', default=None, help='the directory of the compiled ground truth')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    dataset_name, gt_path, data_path, score_type = args.dataset, args.gt_path, args.data_path, args.score_type
+    if args.cfg is not None:
+        from pyanomaly.config import update_config
+        cfg = update_config(args.cfg, [])
+        dataset_name = dataset_name or cfg.DATASET.name
+        gt_path = gt_path or cfg.DATASET.val.gt_path
+        data_path = data_path or cfg.DATASET.val.data_path
+        score_type = score_type or cfg.DATASET.score_type
+        if args.gt_cache_dir is None:
+            args.gt_cache_dir = cfg.DATASET.gt_cache_dir
+    assert dataset_name is not None and gt_path is not None and data_path is not None, 'Please give the dataset, gt_path and data_path, or the cfg file'
+
+    table = evaluate_directory(args.result_dir, dataset_name, gt_path, data_path, score_type or 'normal', args.workers, args.output, args.gt_cache_dir or '')
+    print('\t'.join(TABLE_FIELDS))
+    for row in table:
+        print('\t'.join(str(row[field]) for field in TABLE_FIELDS))
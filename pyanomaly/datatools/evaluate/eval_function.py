@@ -16,18 +16,19 @@ from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 
-from .utils import load_pickle_results
+from .utils import load_pickle_results, cal_eer
+from .results import load_score_results
 from ..abstract import GroundTruthLoader, AbstractEvalMethod
 from ..tools import RecordResult
 from ..datatools_registry import EVAL_METHOD_REGISTRY
 
-__all__ = ['ScoreAUCMetrics']
+__all__ = ['ScoreAUCMetrics', 'ScoreHistogram', 'OnlineScoreAUCMetrics']
 
 @EVAL_METHOD_REGISTRY.register()
 class ScoreAUCMetrics(AbstractEvalMethod):
     def __init__(self, cfg, is_training) -> None:
         super(ScoreAUCMetrics, self).__init__(cfg)
-        self.gt_loader = GroundTruthLoader()
+        self.gt_loader = GroundTruthLoader(cfg.DATASET.gt_cache_dir)
         # self.dataset_name = cfg.DATASET.name
         # self.gt_path = cfg.DATASET.gt_path
         self.optimal_resulst = RecordResult()
@@ -71,9 +72,9 @@ class ScoreAUCMetrics(AbstractEvalMethod):
           'score': the score of each testing videos
           'num_videos': the number of the videos
         }
+        The columnar result file is also supported, whose scores are memory-mapped.
         '''
-        with open(result_file, 'rb') as f:
-            results = pickle.load(f)
+        results = load_score_results(result_file)
         
         dataset_name = results['dataset']
         num_videos = results['num_videos']
@@ -145,3 +146,262 @@ class ScoreAUCMetrics(AbstractEvalMethod):
                     self.optimal_resulst = temp_result
         
         return self.optimal_resulst
+
+
+class ScoreHistogram(object):
+    """Fixed-size histograms of the scores, one per label.
+    The memory does not grow with the number of frames, and the histograms from different processes or jobs can be merged by adding the counts.
+    The AUC is approximated by comparing the bins, and the pairs in the same bin are counted as half. 
+    So the error of the AUC is bounded by the half of the pairs falling in the same bin, see `auc_error_bound`.
+
+    Args:
+        num_bins(int): The number of the bins
+        score_range(tuple): The range of the scores, the scores out of the range are put into the bins at the edge
+        pos_label(int): The label regarded as the positive, the higher score means the positive one. The same as the `pos_label` in sklearn
+    """
+    def __init__(self, num_bins=1000, score_range=(0.0, 1.0), pos_label=1):
+        assert num_bins > 0, f'The number of bins should be larger than 0, but got {num_bins}'
+        assert score_range[1] > score_range[0], f'Wrong score range:{score_range}'
+        self.num_bins = int(num_bins)
+        self.score_range = (float(score_range[0]), float(score_range[1]))
+        self.pos_label = pos_label
+        self.pos_hist = np.zeros(self.num_bins, dtype=np.int64)
+        self.neg_hist = np.zeros(self.num_bins, dtype=np.int64)
+    
+    @property
+    def num_pos(self):
+        return int(self.pos_hist.sum())
+    
+    @property
+    def num_neg(self):
+        return int(self.neg_hist.sum())
+
+    def _bin_index(self, scores):
+        low, high = self.score_range
+        index = np.floor((scores - low) / (high - low) * self.num_bins).astype(np.int64)
+        return np.clip(index, 0, self.num_bins - 1)
+
+    def update(self, scores, labels):
+        """Add the scores and the labels of frames.
+        Args:
+            scores(np.ndarray): [N] the scores
+            labels(np.ndarray): [N] the labels
+        """
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        labels = np.asarray(labels).reshape(-1)
+        assert len(scores) == len(labels), f'The length of scores and labels are not equal, {len(scores)} vs. {len(labels)}'
+        index = self._bin_index(scores)
+        pos = labels == self.pos_label
+        self.pos_hist += np.bincount(index[pos], minlength=self.num_bins)
+        self.neg_hist += np.bincount(index[~pos], minlength=self.num_bins)
+
+    def merge(self, other):
+        """Merge another histogram with the same setting into this one.
+        """
+        assert self.num_bins == other.num_bins and self.score_range == other.score_range and self.pos_label == other.pos_label, \
+            'Can not merge the histograms with different settings'
+        self.pos_hist += other.pos_hist
+        self.neg_hist += other.neg_hist
+        return self
+    
+    def state_dict(self):
+        return OrderedDict(num_bins=self.num_bins, score_range=self.score_range, pos_label=self.pos_label, 
+                           pos_hist=self.pos_hist.copy(), neg_hist=self.neg_hist.copy())
+    
+    def load_state_dict(self, state_dict):
+        self.num_bins = state_dict['num_bins']
+        self.score_range = tuple(state_dict['score_range'])
+        self.pos_label = state_dict['pos_label']
+        self.pos_hist = np.asarray(state_dict['pos_hist'], dtype=np.int64).copy()
+        self.neg_hist = np.asarray(state_dict['neg_hist'], dtype=np.int64).copy()
+
+    def all_reduce(self):
+        """Sum the histograms of all processes, each process gets the merged one.
+        """
+        from ..dataclass.sampler.common import all_gather, get_world_size
+        if get_world_size() == 1:
+            return self
+        states = all_gather(self.state_dict())
+        self.pos_hist = np.sum([state['pos_hist'] for state in states], axis=0).astype(np.int64)
+        self.neg_hist = np.sum([state['neg_hist'] for state in states], axis=0).astype(np.int64)
+        return self
+
+    def auc(self):
+        """The approximate area under the ROC curve.
+        Returns:
+            auc(float): nan if one of the labels does not appear
+        """
+        num_pos, num_neg = self.num_pos, self.num_neg
+        if num_pos == 0 or num_neg == 0:
+            return float('nan')
+        # the negatives in the lower bins than each bin
+        neg_below = np.cumsum(self.neg_hist) - self.neg_hist
+        correct = np.sum(self.pos_hist * neg_below) + 0.5 * np.sum(self.pos_hist * self.neg_hist)
+        return float(correct / (num_pos * num_neg))
+    
+    def auc_error_bound(self):
+        """The max distance between the approximate AUC and the exact one.
+        """
+        num_pos, num_neg = self.num_pos, self.num_neg
+        if num_pos == 0 or num_neg == 0:
+            return float('nan')
+        return float(0.5 * np.sum(self.pos_hist * self.neg_hist) / (num_pos * num_neg))
+
+    def roc(self):
+        """The ROC curve on the bin edges, from the highest threshold to the lowest.
+        Returns:
+            fpr(np.ndarray), tpr(np.ndarray), thresholds(np.ndarray)
+        """
+        tpr = np.concatenate([[0], np.cumsum(self.pos_hist[::-1])]) / max(self.num_pos, 1)
+        fpr = np.concatenate([[0], np.cumsum(self.neg_hist[::-1])]) / max(self.num_neg, 1)
+        thresholds = np.linspace(self.score_range[1], self.score_range[0], self.num_bins + 1)
+        return fpr, tpr, thresholds
+
+    def eer(self):
+        """The approximate equal error rate(the same definition as cal_eer), the error is bounded by the width of one bin on the ROC curve.
+        """
+        if self.num_pos == 0 or self.num_neg == 0:
+            return float('nan')
+        fpr, tpr, _ = self.roc()
+        return float(cal_eer(fpr, tpr))
+
+
+@EVAL_METHOD_REGISTRY.register()
+class OnlineScoreAUCMetrics(AbstractEvalMethod):
+    """Online version of the ScoreAUCMetrics.
+    The scores are put into the fixed-size histograms instead of being kept in memory, so the approximate AUC and EER can be reported at any point of the long-running evaluation.
+    Both the frame-level(micro) AUC over all of frames and the average of the video-level AUC (the same as ScoreAUCMetrics) are recorded.
+    The video with only one label has no AUC(ScoreAUCMetrics gets nan for it), it is skipped in the video-level AUC and logged, see `skipped_videos`.
+    The settings are in cfg.VAL.online_eval
+    """
+    def __init__(self, cfg, is_training) -> None:
+        super(OnlineScoreAUCMetrics, self).__init__(cfg)
+        self.gt_loader = GroundTruthLoader(cfg.DATASET.gt_cache_dir)
+        self.online_params = cfg.VAL.online_eval
+        self.parts = ['train', 'val'] if is_training else ['val']
+        if self.dataset_params.score_type == 'normal':
+            self.pos_label = 0
+        elif self.dataset_params.score_type == 'abnormal':
+            self.pos_label = 1
+        else:
+            raise Exception(f'Not support the score type:{self.dataset_params.score_type}')
+        self.optimal_resulst = RecordResult()
+        self.gt_dict = self.load_ground_truth()
+        self.reset()
+    
+    def _make_histogram(self):
+        return ScoreHistogram(self.online_params.num_bins, tuple(self.online_params.score_range), self.pos_label)
+
+    def reset(self):
+        """Clear the recorded scores.
+        """
+        self.histogram = self._make_histogram()
+        self.video_results = RecordResult(self.dataset_name, 'online', verbose='online')
+        # the videos without the AUC, only one label in them
+        self.skipped_videos = list()
+    
+    def load_ground_truth(self):
+        gt_dict = OrderedDict()
+        for part in self.parts:
+            if part == 'train':
+                continue
+            gt_path = self.dataset_params[part]['gt_path']
+            data_path = self.dataset_params[part]['data_path']
+            gt_dict[part] = self.gt_loader.read(self.dataset_name, gt_path, data_path)
+        return gt_dict
+    
+    def load_results(self, result_file):
+        results = load_score_results(result_file)
+        assert results['dataset'] == self.dataset_name, f'The dataset are not match, Result:{results["dataset"]}, cfg:{self.dataset_name}'
+        return results['score'], results['num_videos']
+
+    def update(self, scores, labels):
+        """Add a part of frames, only the frame-level histogram is updated.
+        """
+        self.histogram.update(scores, labels)
+
+    def update_video(self, scores, labels, video_id=None):
+        """Add the frames of one whole video.
+        Args:
+            video_id(str|int): The name of the video in the log of the skipped videos, the index of the video by default
+        """
+        self.update(scores, labels)
+        video_histogram = self._make_histogram()
+        video_histogram.update(scores, labels)
+        video_auc = video_histogram.auc()
+        if np.isnan(video_auc):
+            video_id = len(self.skipped_videos) + self.video_results.count if video_id is None else video_id
+            self.skipped_videos.append(video_id)
+            logger.warning(f'The video {video_id} has only one label, it is skipped in the video-level AUC')
+        else:
+            self.video_results.update(video_auc)
+    
+    def merge(self, other):
+        """Merge the records of another online evaluator.
+        """
+        self.histogram.merge(other.histogram)
+        self.skipped_videos.extend(other.skipped_videos)
+        self.video_results.sum_value += other.video_results.sum_value
+        self.video_results.count += other.video_results.count
+        if self.video_results.count > 0:
+            self.video_results.avg_value = self.video_results.sum_value / self.video_results.count
+        return self
+    
+    def all_reduce(self):
+        """Merge the records of all processes.
+        """
+        from ..dataclass.sampler.common import all_gather, get_world_size
+        if get_world_size() == 1:
+            return self
+        self.histogram.all_reduce()
+        video_states = all_gather((self.video_results.sum_value, self.video_results.count, self.skipped_videos))
+        self.video_results.sum_value = sum([state[0] for state in video_states])
+        self.video_results.count = sum([state[1] for state in video_states])
+        self.skipped_videos = [video_id for state in video_states for video_id in state[2]]
+        if self.video_results.count > 0:
+            self.video_results.avg_value = self.video_results.sum_value / self.video_results.count
+        return self
+
+    def summary(self):
+        """Report the metrics at present.
+        Returns:
+            summary(OrderedDict): frame_auc, frame_auc_error, eer, video_auc, num_frames, num_videos, num_skipped_videos
+        """
+        summary = OrderedDict()
+        summary['frame_auc'] = self.histogram.auc()
+        summary['frame_auc_error'] = self.histogram.auc_error_bound()
+        summary['eer'] = self.histogram.eer()
+        summary['video_auc'] = self.video_results.avg_value if self.video_results.count > 0 else float('nan')
+        summary['num_frames'] = self.histogram.num_pos + self.histogram.num_neg
+        summary['num_videos'] = self.video_results.count
+        summary['num_skipped_videos'] = len(self.skipped_videos)
+        return summary
+
+    def eval_method(self, result, gt, verbose):
+        assert len(result) == len(gt), f'The number of the videos are not equal, {len(result)} vs. {len(gt)}'
+        self.reset()
+        for i in range(len(gt)):
+            self.update_video(result[i], gt[i], video_id=i)
+            if self.online_params.log_interval > 0 and (i + 1) % self.online_params.log_interval == 0:
+                logger.info(f'[{verbose}] {i+1}/{len(gt)} videos: {dict(self.summary())}')
+        self.video_results.loss_file = self._result_name
+        self.video_results.verbose = verbose
+        logger.info(f'[{verbose}] Final: {dict(self.summary())}')
+        return self.video_results
+
+    def compute(self, result_file_dict):
+        """Compute the metrics of the result files.
+        The same usage as ScoreAUCMetrics.compute, the optimal video-level AUC is returned and the summary of the last file is kept in self.summary()
+        """
+        for part in self.parts:
+            if part == 'train':
+                continue
+            gt = self.gt_dict[part]
+            for key, item in result_file_dict[part].items():
+                self._result_name = item
+                score_records, num_videos = self.load_results(item)
+                assert num_videos == len(gt), f'the number of saved videos does not match the ground truth, {num_videos} != {len(gt)}'
+                temp_result = self.eval_method(score_records, gt, str(key))
+                if temp_result > self.optimal_resulst:
+                    self.optimal_resulst = temp_result
+        return self.optimal_resulst
@@ -0,0 +1,136 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The storage of the score results.
+Two formats are supported:
+    pickle: {'dataset':..., 'num_videos':..., 'score':[np.ndarray, ...]}, the original format
+    columnar: one contiguous float32 scores buffer, the offsets of each video and a small header(dataset, step, sigma, model).
+              It is memory-mapped when loading, so comparing hundreds of checkpoints does not read all of the scores into memory.
+"""
+import os
+import re
+import pickle
+import argparse
+import numpy as np
+from collections import OrderedDict
+import logging
+logger = logging.getLogger(__name__)
+
+from ..tools import save_ragged_array, load_ragged_array, is_ragged_file
+
+__all__ = ['COLUMNAR_SUFFIX', 'PICKLE_SUFFIX', 'save_score_archive', 'load_score_results', 'parse_result_name', 'convert_pickle_results']
+
+COLUMNAR_SUFFIX = '_results.scores'
+PICKLE_SUFFIX = '_results.pkl'
+
+# {verbose}_cfg#{config_name}#step{current_step}@{time_stamp}_sigma{sigma}_results.pkl
+_RESULT_NAME_PATTERN = re.compile(r'^(?P<verbose>.*?)_cfg#(?P<config_name>.*)#step(?P<step>-?\d+)@(?P<time_stamp>.*)_sigma(?P<sigma>[^_]+)_results\.(pkl|scores)$')
+
+
+def parse_result_name(result_path):
+    """Get the information from the name of the result file.
+    Args:
+        result_path(str): The path of the result file
+    Returns:
+        info(OrderedDict): verbose, config_name, step, time_stamp, sigma. Empty if the name is not in the format of save_score_results
+    """
+    info = OrderedDict()
+    matched = _RESULT_NAME_PATTERN.match(os.path.basename(result_path))
+    if matched is None:
+        return info
+    info['verbose'] = matched.group('verbose')
+    info['config_name'] = matched.group('config_name')
+    info['step'] = int(matched.group('step'))
+    info['time_stamp'] = matched.group('time_stamp')
+    sigma = matched.group('sigma')
+    info['sigma'] = None if sigma == 'None' else float(sigma)
+    return info
+
+
+def save_score_archive(result_path, score, dataset, step=None, sigma=None, model=None, **kwargs):
+    """Save the scores in the columnar format.
+    Args:
+        result_path(str): The path of the file
+        score(list): The scores of each video
+        dataset(str): The name of the dataset
+        step(int): The training step of the model
+        sigma(float): The sigma of the gaussian smooth, None means not smooth
+        model(str): The name of the model
+        kwargs: Other json-serializable information
+    Returns:
+        result_path(str)
+    """
+    meta = OrderedDict(dataset=dataset, num_videos=len(score), step=step, sigma=sigma, model=model)
+    meta.update(kwargs)
+    return save_ragged_array(result_path, score, dtype=np.float32, meta=meta)
+
+
+def load_score_results(result_path, mmap=True):
+    """Load the results in either the pickle or the columnar format.
+    Args:
+        result_path(str): The path of the result file
+        mmap(bool): Memory-map the columnar scores
+    Returns:
+        results(dict): {'dataset':..., 'num_videos':..., 'score':...}. The 'score' of the columnar file is a RaggedArray, which can be indexed like a list.
+                       The columnar results also have the 'meta' key
+    """
+    if is_ragged_file(result_path):
+        archive = load_ragged_array(result_path, mmap=mmap)
+        results = OrderedDict()
+        results['dataset'] = archive.meta['dataset']
+        results['num_videos'] = len(archive)
+        results['score'] = archive
+        results['meta'] = archive.meta
+        return results
+
+    with open(result_path, 'rb') as f:
+        results = pickle.load(f)
+    return results
+
+
+def convert_pickle_results(pickle_path, output_path=None, model=None):
+    """Convert the pickle result file into the columnar format.
+    The step and the sigma are parsed from the file name.
+    Args:
+        pickle_path(str): The path of the pickle file
+        output_path(str): The path of the new file, default is replacing the suffix with COLUMNAR_SUFFIX
+        model(str): The name of the model
+    Returns:
+        output_path(str)
+    """
+    if output_path is None:
+        if pickle_path.endswith(PICKLE_SUFFIX):
+            output_path = pickle_path[:-len(PICKLE_SUFFIX)] + COLUMNAR_SUFFIX
+        else:
+            output_path = os.path.splitext(pickle_path)[0] + COLUMNAR_SUFFIX
+    with open(pickle_path, 'rb') as f:
+        results = pickle.load(f)
+    info = parse_result_name(pickle_path)
+    extra = OrderedDict()
+    if 'config_name' in info:
+        extra['config_name'] = info['config_name']
+        extra['time_stamp'] = info['time_stamp']
+    assert results['num_videos'] == len(results['score']), f'The num_videos in {pickle_path} does not match the scores'
+    save_score_archive(output_path, results['score'], results['dataset'], step=info.get('step'), sigma=info.get('sigma'), model=model, **extra)
+    logger.info(f'Convert {pickle_path} => {output_path}')
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the pickle result files into the columnar format')
+    parser.add_argument('paths', nargs='+', help='the pickle files or the directories containing them')
+    parser.add_argument('--model', default=None, help='the name of the model stored in the header')
+    parser.add_argument('--remove', action='store_true', help='remove the pickle file after converting')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for path in args.paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(PICKLE_SUFFIX))
+        else:
+            files = [path]
+        for pickle_file in files:
+            convert_pickle_results(pickle_file, model=args.model)
+            if args.remove:
+                os.remove(pickle_file)
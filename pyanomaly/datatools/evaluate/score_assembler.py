@@ -0,0 +1,144 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['ScoreAssembler']
+
+class ScoreAssembler(object):
+    """Map the sliding-window outputs of one video to the per-frame scores.
+    The window scores are scattered to the frames with vectorized numpy operations, so the batch size of the dataloader does not matter.
+    The frames which are not covered by any window (e.g. the first clip_length-1 frames when the model only scores the last frame)
+    are padded with the nearest covered frame.
+
+    Args:
+        video_length(int): The number of frames in the video
+        window_length(int): The number of frames in one window(clip)
+        reduction(str): How to combine the scores of the overlapping windows on one frame.
+            'last': the value of the latest window, 'mean': the average of the windows, 'max': the max of the windows
+        normalize(str): The normalization method of the scores, 'minmax': (s-min)/(max-min), 'max': s/max, None: keep the raw value
+        inverse(bool): Whether to use 1-s after the normalization, e.g. turn the reconstruction error into the normal score
+        step(int): The distance between the start indices of two adjacent windows, used when the starts are not given
+    """
+    _REDUCTIONS = ('last', 'mean', 'max')
+    _NORMALIZATIONS = ('minmax', 'max', None)
+
+    def __init__(self, video_length, window_length, reduction='last', normalize='minmax', inverse=False, step=1):
+        assert reduction in ScoreAssembler._REDUCTIONS, f'Not support the reduction:{reduction}'
+        assert normalize in ScoreAssembler._NORMALIZATIONS, f'Not support the normalization:{normalize}'
+        assert video_length > 0 and window_length > 0, f'Wrong length, video:{video_length}, window:{window_length}'
+        self.video_length = int(video_length)
+        self.window_length = int(window_length)
+        self.reduction = reduction
+        self.normalize = normalize
+        self.inverse = inverse
+        self.step = step
+        self.reset()
+
+    def reset(self):
+        """Clear the recorded scores.
+        """
+        self._value = np.zeros(self.video_length, dtype=np.float64)
+        self._count = np.zeros(self.video_length, dtype=np.int64)
+        if self.reduction == 'max':
+            self._value.fill(-np.inf)
+        self._next_start = 0
+        self.num_windows = 0
+
+    def update(self, window_scores, starts=None):
+        """Record the scores of a batch of windows.
+        Args:
+            window_scores(np.ndarray|torch.Tensor): [B] one score per window which belongs to the last frame of the window, or
+                [B, K] K<=window_length scores which belong to the last K frames of the window.
+            starts(np.ndarray|list|None): [B] the index of the first frame of each window.
+                If None, the windows are regarded as the continuation of the previous ones with the distance `step`
+        """
+        if hasattr(window_scores, 'detach'):
+            window_scores = window_scores.detach().cpu().numpy()
+        scores = np.asarray(window_scores, dtype=np.float64)
+        if scores.ndim == 0:
+            scores = scores.reshape(1, 1)
+        elif scores.ndim == 1:
+            scores = scores[:, None]
+        elif scores.ndim > 2:
+            raise Exception(f'The window scores should be [B] or [B, K], but got the shape:{scores.shape}')
+        batch, k = scores.shape
+        assert k <= self.window_length, f'The number of scores in one window({k}) is larger than the window length({self.window_length})'
+
+        if starts is None:
+            starts = self._next_start + np.arange(batch, dtype=np.int64) * self.step
+        else:
+            starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+            assert len(starts) == batch, f'The number of starts({len(starts)}) does not match the windows({batch})'
+        self._next_start = int(starts.max()) + self.step
+        self.num_windows += batch
+
+        # keep the order of windows, so the 'last' reduction is the window with the largest start
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        scores = scores[order]
+
+        index = starts[:, None] + (self.window_length - k) + np.arange(k, dtype=np.int64)[None, :]
+        index = index.reshape(-1)
+        values = scores.reshape(-1)
+        valid = (index >= 0) & (index < self.video_length)
+        index = index[valid]
+        values = values[valid]
+        if len(index) == 0:
+            return
+
+        np.add.at(self._count, index, 1)
+        if self.reduction == 'mean':
+            np.add.at(self._value, index, values)
+        elif self.reduction == 'max':
+            np.maximum.at(self._value, index, values)
+        else:
+            # the last occurrence of each frame wins
+            unique_index, position = np.unique(index[::-1], return_index=True)
+            self._value[unique_index] = values[::-1][position]
+
+    @property
+    def covered(self):
+        """The mask of frames which have at least one score.
+        """
+        return self._count > 0
+
+    def raw_scores(self):
+        """Get the scores before the normalization.
+        Returns:
+            scores(np.ndarray): [video_length] float64
+        """
+        covered = self.covered
+        if not covered.any():
+            raise Exception('No window has been recorded in the score assembler')
+        scores = self._value.copy()
+        if self.reduction == 'mean':
+            scores[covered] /= self._count[covered]
+        # pad the uncovered frames with the nearest covered frame, forward then backward
+        frame_index = np.where(covered, np.arange(self.video_length), 0)
+        np.maximum.accumulate(frame_index, out=frame_index)
+        first = np.argmax(covered)
+        frame_index[:first] = first
+        return scores[frame_index]
+
+    def assemble(self):
+        """Get the per-frame scores of the video.
+        Returns:
+            scores(np.ndarray): [video_length] float32
+        """
+        scores = self.raw_scores()
+        if self.normalize == 'minmax':
+            smin, smax = scores.min(), scores.max()
+            scale = smax - smin
+            scores = (scores - smin) / scale if scale > 0 else np.zeros_like(scores)
+        elif self.normalize == 'max':
+            smax = scores.max()
+            scores = scores / smax if smax != 0 else np.zeros_like(scores)
+        if self.inverse:
+            scores = 1.0 - scores
+        if self.normalize is not None:
+            scores = np.clip(scores, 0, None)
+        return scores.astype(np.float32)
@@ -0,0 +1,147 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Smooth the scores with the causal kernels, so the scores of the live streams can be smoothed frame by frame.
+The score of a frame is the weighted mean of the scores of the frame and the frames before it(and `lag` frames after it in the fixed-lag mode),
+the weights of the frames which do not exist(e.g. before the first frame) are not used.
+    'exponential': w(d) = exp(-|d| / sigma), without the lag it is the recursion y_t = a * x_t + (1 - a) * y_t-1, a = 1 - exp(-1 / sigma)
+    'gaussian': w(d) = exp(-d^2 / (2 * sigma^2)), the half-Gaussian truncated at truncate * sigma frames
+d is the distance from the smoothed frame. The state of each stream is one value(the exponential recursion) or the last truncate * sigma + lag scores.
+The fixed-lag mode delays the output by `lag` frames and uses the scores after the frame, with lag >= truncate * sigma the gaussian kernel is close to
+the gaussian_filter1d away from the ends of the video.
+"""
+import math
+from collections import deque, OrderedDict
+import numpy as np
+from scipy.signal import lfilter
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['CausalSmoother', 'build_smoother', 'smooth_scores']
+
+_KERNELS = ('exponential', 'gaussian')
+
+
+def _kernel_weights(kernel, sigma, lag, truncate):
+    # the weights of the distances -(past - 1), ..., 0, ..., lag
+    past = int(math.ceil(truncate * sigma)) + 1
+    distance = np.arange(-(past - 1), lag + 1, dtype=np.float64)
+    if kernel == 'exponential':
+        return np.exp(-np.abs(distance) / sigma)
+    return np.exp(-distance ** 2 / (2 * sigma ** 2))
+
+
+class _SmoothState(object):
+    __slots__ = ['count', 'value', 'scores']
+
+    def __init__(self, length):
+        # the number of the scores of the stream
+        self.count = 0
+        # the value of the exponential recursion
+        self.value = None
+        # the latest scores, used by the kernel
+        self.scores = deque(maxlen=length)
+
+
+class CausalSmoother(object):
+    """Smooth the scores of each stream one by one.
+    Args:
+        kernel(str): 'exponential' | 'gaussian'
+        sigma(float): The time constant of the exponential kernel or the std of the gaussian kernel, in frames
+        lag(int): The delay of the output in frames, 0 means the causal smoothing
+        truncate(float): The kernel is truncated at truncate * sigma frames before the smoothed frame
+    """
+    def __init__(self, kernel='exponential', sigma=5.0, lag=0, truncate=3.0):
+        assert kernel in _KERNELS, f'Not support the kernel of the smoothing: {kernel}'
+        assert sigma > 0 and lag >= 0, f'Wrong sigma:{sigma} or lag:{lag}'
+        self.kernel = kernel
+        self.sigma = float(sigma)
+        self.lag = int(lag)
+        self.truncate = truncate
+        # the exponential kernel without the lag uses the recursion, which keeps one value
+        self.recursive = kernel == 'exponential' and self.lag == 0
+        self.alpha = 1.0 - math.exp(-1.0 / self.sigma)
+        self.weights = _kernel_weights(kernel, self.sigma, self.lag, truncate)
+        self._past = len(self.weights) - self.lag
+        # stream_id -> _SmoothState
+        self._streams = OrderedDict()
+
+    def _state(self, stream_id):
+        state = self._streams.get(stream_id)
+        if state is None:
+            state = self._streams[stream_id] = _SmoothState(0 if self.recursive else len(self.weights))
+        return state
+
+    def _weighted(self, scores, first, index, count):
+        # the weighted mean of the kept scores for the frame `index`, the scores are the frames [first, count)
+        start = max(first, index - self._past + 1)
+        weights = self.weights[start - index + self._past - 1:count - index + self._past - 1]
+        values = np.asarray(scores, dtype=np.float64)[start - first:]
+        return float(np.dot(weights, values) / weights.sum())
+
+    def update(self, stream_id, score):
+        """Push the score of the next frame of the stream.
+        Returns:
+            index(int|None): The index of the smoothed frame in the scores of the stream(the number of the pushed scores - 1 - lag),
+                None if less than lag + 1 scores are pushed
+            value(float|None): The smoothed score of the frame
+        """
+        state = self._state(stream_id)
+        state.count += 1
+        if self.recursive:
+            state.value = score if state.value is None else self.alpha * score + (1 - self.alpha) * state.value
+            return state.count - 1, float(state.value)
+        state.scores.append(score)
+        index = state.count - 1 - self.lag
+        if index < 0:
+            return None, None
+        return index, self._weighted(state.scores, state.count - len(state.scores), index, state.count)
+
+    def flush(self, stream_id):
+        """Smooth the last `lag` frames of the stream with the frames after them, and forget the stream.
+        Returns:
+            results(list): [(index, value), ...]
+        """
+        state = self._streams.pop(stream_id, None)
+        if state is None or self.recursive:
+            return []
+        first = state.count - len(state.scores)
+        return [(index, self._weighted(state.scores, first, index, state.count)) for index in range(max(0, state.count - self.lag), state.count)]
+
+    def reset(self, stream_id):
+        """Forget the stream.
+        """
+        self._streams.pop(stream_id, None)
+
+
+def build_smoother(smooth_cfg):
+    """Build the CausalSmoother with the SERVICE.smoothing config, None if it is not used.
+    """
+    if not smooth_cfg.use:
+        return None
+    return CausalSmoother(smooth_cfg.kernel, smooth_cfg.sigma, smooth_cfg.lag, smooth_cfg.truncate)
+
+
+def smooth_scores(scores, kernel='exponential', sigma=5.0, lag=0, truncate=3.0):
+    """Smooth the scores of one video, the same as pushing them into the CausalSmoother one by one and flushing it at the end.
+    Args:
+        scores(np.ndarray): [T]
+    Returns:
+        scores(np.ndarray): [T] the smoothed score of each frame
+    """
+    assert kernel in _KERNELS, f'Not support the kernel of the smoothing: {kernel}'
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        return scores
+    if kernel == 'exponential' and int(lag) == 0:
+        alpha = 1.0 - math.exp(-1.0 / sigma)
+        # y_0 = x_0
+        smoothed, _ = lfilter([alpha], [1.0, alpha - 1.0], scores, zi=[(1.0 - alpha) * scores[0]])
+        return smoothed
+    weights = _kernel_weights(kernel, float(sigma), int(lag), truncate)
+    past = len(weights) - int(lag)
+    padded = np.concatenate([np.zeros(past - 1), scores, np.zeros(int(lag))])
+    mask = np.concatenate([np.zeros(past - 1), np.ones(len(scores)), np.zeros(int(lag))])
+    return np.correlate(padded, weights, mode='valid') / np.correlate(mask, weights, mode='valid')
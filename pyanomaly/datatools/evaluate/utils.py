@@ -4,10 +4,22 @@ import pickle
 import torch
 from collections import OrderedDict
 from ..abstract.readers import GroundTruthLoader
+from ..tools import is_ragged_file
+from .results import load_score_results
 from scipy.ndimage import gaussian_filter1d
 
 
 def load_pickle_results(loss_file, cfg):
+    if is_ragged_file(loss_file):
+        # the columnar result file, the keys of the smoothed scores are not in it
+        results = load_score_results(loss_file)
+        score_records = [results['score']]
+        gt_loader = GroundTruthLoader(cfg.DATASET.gt_cache_dir)
+        gt = gt_loader.read(cfg.DATASET.name, cfg.DATASET.gt_path, cfg.DATASET.test_path)
+        assert results['dataset'] == cfg.DATASET.name, f'The dataset are not match, Result:{results["dataset"]}, cfg:{cfg.DATASET.name}'
+        assert results['num_videos'] == len(gt), f'the number of saved videos does not match the ground truth, {results["num_videos"]} != {len(gt)}'
+        return results['dataset'], [], score_records, gt, results['num_videos']
+
     with open(loss_file, 'rb') as f:
         # results {
         #   'dataset': the name of dataset
@@ -57,7 +69,7 @@ def load_pickle_results(loss_file, cfg):
     assert dataset == cfg.DATASET.name, f'The dataset are not match, Result:{dataset}, cfg:{cfg.DATASET.name}'
 
     # load ground truth
-    gt_loader = GroundTruthLoader(cfg)
+    gt_loader = GroundTruthLoader(cfg.DATASET.gt_cache_dir)
     # gt = gt_loader(dataset=dataset)
     # gt = gt_loader()
     gt = gt_loader.read(cfg.DATASET.name, cfg.DATASET.gt_path, cfg.DATASET.test_path) # because this method is only used for test/val
@@ -309,6 +321,9 @@ def precision_recall_auc(loss_file, cfg):
 
 
 def cal_eer(fpr, tpr):
+    """The EER of the ROC curve, the fpr at the point where the fpr is the closest to the fnr(1 - tpr).
+    Used by all of the evaluators, so the EERs of them are the same on the same ROC curve.
+    """
     # makes fpr + tpr = 1
     eer = fpr[np.nanargmin(np.absolute((fpr + tpr - 1)))]
     return eer
@@ -2,10 +2,19 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
+import os
+import json
+import struct
+import tempfile
 import torch
 import numpy as np
+from collections import OrderedDict
 from torch.utils.data.dataloader import default_collate
 
+# the files are created with the mode of the umask like open(), it is read once since os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 class RecordResult(object):
     def __init__(self, dataset=None, loss_file=None, metric_name='AUC', verbose=None):
         self.value = 0
@@ -67,3 +76,137 @@ def collect_fn_local(batch):
     
     return default_collate(batch)
 
+
+_RAGGED_MAGIC = b'PYRAGGED'
+_RAGGED_VERSION = 1
+_RAGGED_ALIGN = 64
+
+class RaggedArray(object):
+    """A list of 1-D arrays stored in one contiguous buffer.
+    The i-th array is values[offsets[i]:offsets[i+1]], and getting it does not copy the data.
+    Args:
+        values(np.ndarray): [total] the concatenated values
+        offsets(np.ndarray): [N+1] int64, the start of each array and the end of the last one
+        meta(dict): The information of the arrays
+    """
+    def __init__(self, values, offsets, meta=None):
+        assert offsets[0] == 0 and offsets[-1] == len(values), 'The offsets do not match the values'
+        self.values = values
+        self.offsets = offsets
+        self.meta = OrderedDict() if meta is None else OrderedDict(meta)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(f'The index {index} is out of range, the length is {len(self)}')
+        return self.values[self.offsets[index]:self.offsets[index+1]]
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+    
+    def tolist(self):
+        """Copy the arrays into a list of np.ndarray.
+        """
+        return [np.array(item) for item in self]
+
+
+def make_temp_file(path):
+    """Create the temp file which is written and then replaced to the path.
+    Each writer has its own temp file in the same directory, so the writers of the same path(e.g. the ranks of DDP, or the threads) do not race.
+    The mode follows the umask like the files made by open(), instead of the 0600 of tempfile.mkstemp.
+    Args:
+        path(str): The path of the final file
+    Returns:
+        fd(int): The opened file descriptor of the temp file
+        temp_path(str)
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    os.chmod(temp_path, 0o666 & ~_UMASK)
+    return fd, temp_path
+
+
+def save_ragged_array(path, arrays, dtype=np.float32, meta=None):
+    """Store a list of 1-D arrays into one file.
+    Layout: magic(8 bytes) | version(uint32) | header length(uint32) | json header | offsets(int64) | values
+    The header is padded so that the offsets and the values are aligned, which makes them can be memory-mapped directly.
+    Args:
+        path(str): The path of the file
+        arrays(list): The list of arrays, they will be flattened
+        dtype: The numpy dtype of the values
+        meta(dict): The json-serializable information stored in the header
+    Returns:
+        path(str)
+    """
+    dtype = np.dtype(dtype)
+    arrays = [np.asarray(item, dtype=dtype).reshape(-1) for item in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    if len(arrays) > 0:
+        offsets[1:] = np.cumsum([len(item) for item in arrays])
+    header = OrderedDict(dtype=dtype.str, num_items=len(arrays), meta=OrderedDict() if meta is None else meta)
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_len = len(_RAGGED_MAGIC) + 8 + len(header_bytes)
+    header_bytes += b' ' * ((-prefix_len) % _RAGGED_ALIGN)
+
+    fd, temp_path = make_temp_file(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_RAGGED_MAGIC)
+            f.write(struct.pack('<II', _RAGGED_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.write(offsets.astype('<i8').tobytes())
+            for item in arrays:
+                f.write(item.tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def is_ragged_file(path):
+    """Check whether the file is written by save_ragged_array.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(_RAGGED_MAGIC)) == _RAGGED_MAGIC
+
+
+def load_ragged_array(path, mmap=True):
+    """Load the file written by save_ragged_array.
+    Args:
+        path(str): The path of the file
+        mmap(bool): Use np.memmap to map the values instead of reading them into the memory
+    Returns:
+        ragged(RaggedArray)
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(_RAGGED_MAGIC))
+        if magic != _RAGGED_MAGIC:
+            raise Exception(f'{path} is not a ragged array file')
+        version, header_len = struct.unpack('<II', f.read(8))
+        if version > _RAGGED_VERSION:
+            raise Exception(f'Not support the version {version} of {path}')
+        header = json.loads(f.read(header_len).decode('utf-8'), object_pairs_hook=OrderedDict)
+        num_items = header['num_items']
+        offsets = np.frombuffer(f.read(8 * (num_items + 1)), dtype='<i8').astype(np.int64)
+        values_start = f.tell()
+        dtype = np.dtype(header['dtype'])
+        total = int(offsets[-1])
+        if total == 0:
+            values = np.zeros(0, dtype=dtype)
+        elif mmap:
+            values = np.memmap(path, dtype=dtype, mode='r', offset=values_start, shape=(total,))
+        else:
+            values = np.frombuffer(f.read(total * dtype.itemsize), dtype=dtype)
+    return RaggedArray(values, offsets, header['meta'])
@@ -92,8 +92,9 @@ class GradientLoss(nn.Module):
         pos = torch.tensor(np.identity(channels), dtype=torch.float32)
         neg = (-1 * pos) + 1 -1 
         self.alpha = 1
-        self.filter_x = torch.unsqueeze(torch.stack([neg, pos], dim=0), 0).permute(2,3,0,1).cuda()        # c_out, c_in, h, w
-        self.filter_y = torch.stack([torch.unsqueeze(neg, dim=0), torch.unsqueeze(pos, dim=0)]).permute(2,3,0,1).cuda()
+        # the buffers are moved with the module, e.g. .to(device)
+        self.register_buffer('filter_x', torch.unsqueeze(torch.stack([neg, pos], dim=0), 0).permute(2,3,0,1))        # c_out, c_in, h, w
+        self.register_buffer('filter_y', torch.stack([torch.unsqueeze(neg, dim=0), torch.unsqueeze(pos, dim=0)]).permute(2,3,0,1))
         # strides = [1,1]
 
     def forward(self, gen_frames, gt_frames):
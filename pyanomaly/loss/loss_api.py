@@ -35,7 +35,7 @@ class LossAPI(object):
                 raise Exception(f'The name of {register_name} is not supported')
             
             # change the device type 
-            if loss_devicetype == 'cuda':
+            if loss_devicetype == 'cuda' and self.cfg.SYSTEM.device == 'cuda':
                 loss_dict[loss_name] = loss_dict[loss_name].cuda() 
             loss_coefficient_dict[loss_name] = couple[1]
         return loss_dict, loss_coefficient_dict
@@ -14,12 +14,13 @@ from pyanomaly.networks.meta.base import (
     Up, 
     OutConv,  
     BasicConv2d,
-    ConvLSTMCell
+    ConvLSTMCell,
+    ConvLSTMStream
 )
 
 from ..model_registry import META_ARCH_REGISTRY
 
-__all__ = ['AnoPcn']
+__all__ = ['AnoPcn', 'check_streaming']
 
 class ERM(nn.Module):
     def __init__(self, c_in, c_out, bilinear=False):
@@ -60,7 +61,7 @@ class ERM(nn.Module):
         return x
 
 
-class SingleStampConvLSTM(nn.Module):
+class SingleStampConvLSTM(ConvLSTMStream, nn.Module):
     # input_channels corresponds to the first input feature map
     # hidden state is a list of succeeding lstm layers.
     def __init__(self, input_channels, hidden_channels, kernel_size):
@@ -79,25 +80,16 @@ class SingleStampConvLSTM(nn.Module):
 
         # for each sequence, we need to clear the internal_state
         self.internal_state = []
+        # stream_id -> the state of the stream, used by the streaming inference
+        self.stream_states = OrderedDict()
     
     # @torchsnooper.snoop()
     def forward(self, input, step):
-        x = input  # the input is a single image, shape is N C H W
-        for i in range(self.num_layers):
-            if step == 0 and i==0:
-                self.internal_state = list() # 清空state中的状态，因为换到下一个video clip了
-            name = 'cell{}'.format(i)
-
-            if step == 0:
-                # all cells are initialized in the first step
-                bsize, _, height, width = x.size()
-                (h, c) = getattr(self, name).init_hidden(batch_size=bsize, hidden=self.hidden_channels[i], shape=(height, width))
-                self.internal_state.append((h, c))
-            
-            # do forward
-            (h, c) = self.internal_state[i]
-            x, new_c = getattr(self, name)(x, h, c)
-            self.internal_state[i] = (x, new_c)
+        # the input is a single image, shape is N C H W
+        if step == 0:
+            self.internal_state = list() # 清空state中的状态，因为换到下一个video clip了
+        # all cells are initialized in the first step
+        (x, new_c), self.internal_state = self.advance(input, self.internal_state)
         return x, new_c
 
 
@@ -142,6 +134,9 @@ class PCM(nn.Module):
             nn.ReLU(inplace=True),
             nn.Conv2d(16, 3, 3, 1, 1)
         )
+        # stream_id -> (the state after the frames, the state started at the last re-seed, the number of the frames)
+        # each state is (the state of the convlstm, the prediction of the next frame)
+        self.stream_states = OrderedDict()
 
         self._init_weights()
     
@@ -152,28 +147,79 @@ class PCM(nn.Module):
             if isinstance(m, nn.ConvTranspose2d):
                 m.weight = nn.init.kaiming_normal_(m.weight, mode='fan_out')
     
+    def advance(self, frame, state=None):
+        """Predict the next frame with the frame and the state of the frames before it.
+        Args:
+            frame(torch.Tensor): [N, C, H, W]
+            state(tuple|None): (the state of the convlstm, the prediction of the frame), None means the first frame of the clip
+        Returns:
+            Ihat(torch.Tensor): [N, C, H, W] the prediction of the next frame
+            state(tuple): The state after the frame
+        """
+        lstm_state, temp = (None, None) if state is None else state
+        E = torch.zeros_like(frame) if temp is None else torch.sub(frame, temp)
+        R = self.pep(E)
+        (x, _), lstm_state = self.convlstm.advance(R, lstm_state)
+        Ihat = self.fr(x)
+        # temp = Ihat.detach()
+        return Ihat, (lstm_state, Ihat)
+
+    def stream(self, stream_id, frame, horizon=0):
+        """Push the new frame of the stream, the cost does not depend on the number of the frames before it.
+        The state starts from the zero state at the first frame of the stream, so the prediction after the t-th frame
+        is the same as the forward on the clip of the frames [0, t].
+        With the horizon, the state is re-seeded every horizon frames: a second state starts from the zero state at the
+        frame k*horizon and replaces the state after the frame (k+1)*horizon-1. So the prediction is made by the last horizon
+        to 2*horizon-1 frames, and after the frame (k+1)*horizon-1 it is the same as the forward on the last horizon frames.
+        Args:
+            frame(torch.Tensor): [N, C, H, W]
+            horizon(int): 0 means the state is never re-seeded
+        Returns:
+            Ihat(torch.Tensor): [N, C, H, W] the prediction of the next frame of the stream
+        """
+        state, seed, num_frames = self.stream_states.get(stream_id, (None, None, 0))
+        if horizon > 0 and num_frames >= horizon:
+            Ihat, seed = self.advance(frame, seed)
+            if (num_frames + 1) % horizon == 0:
+                # the seed has seen the last horizon frames
+                state, seed = seed, None
+            else:
+                Ihat, state = self.advance(frame, state)
+        else:
+            Ihat, state = self.advance(frame, state)
+        self.stream_states[stream_id] = (state, seed, num_frames + 1)
+        return Ihat
+
+    def stream_prediction(self, stream_id):
+        """The prediction of the next frame of the stream, None if no frame is pushed.
+        """
+        state = self.stream_states.get(stream_id)
+        return None if state is None else state[0][1]
+
+    def reset_stream(self, stream_id=None):
+        """Forget the state of the stream, or all of the streams if the stream_id is None.
+        """
+        if stream_id is None:
+            self.stream_states.clear()
+        else:
+            self.stream_states.pop(stream_id, None)
+
     # @torchsnooper.snoop()
     def forward(self, video_clip):
         # the video_clip is [N C D H W]
         len_video = video_clip.shape[2]
         frames = torch.chunk(video_clip, len_video, 2)
+        state = None
         for time_stamp in range(len_video):
             # print(time_stamp)
-            frame = frames[time_stamp].squeeze(2)
-            E = torch.zeros_like(frame) if time_stamp == 0 else torch.sub(frame, temp)
-            R = self.pep(E)
-            x, _ = self.convlstm(R, time_stamp)
-            Ihat = self.fr(x)
-            # import ipdb; ipdb.set_trace()
-            # temp = Ihat.detach()
-            temp = Ihat
-            if time_stamp == len_video-1: # 最后一个
-                result = Ihat
+            Ihat, state = self.advance(frames[time_stamp].squeeze(2), state)
+        # the prediction after the last frame
+        result = Ihat
 
         return result
 
 
-class ConvLSTM(nn.Module):
+class ConvLSTM(ConvLSTMStream, nn.Module):
     # input_channels corresponds to the first input feature map
     # hidden state is a list of succeeding lstm layers.
     def __init__(self, input_channels, hidden_channels, kernel_size, step=1, effective_step=[1]):
@@ -193,26 +239,15 @@ class ConvLSTM(nn.Module):
             self._all_layers.append(cell)
         
         self.pep = PEP(c_in=3, c_out=64, bilinear=False)
+        # stream_id -> the state of the stream
+        self.stream_states = OrderedDict()
 
     def forward(self, input):
-        internal_state = []
+        # all cells are initialized in the first step
+        internal_state = None
         outputs = []
         for step in range(self.step):
-            x = input
-            for i in range(self.num_layers):
-                # all cells are initialized in the first step
-                name = 'cell{}'.format(i)
-                print(name)
-                if step == 0:
-                    bsize, _, height, width = x.size()
-                    (h, c) = getattr(self, name).init_hidden(batch_size=bsize, hidden=self.hidden_channels[i],
-                                                             shape=(height, width))
-                    internal_state.append((h, c))
-
-                # do forward
-                (h, c) = internal_state[i]
-                x, new_c = getattr(self, name)(x, h, c)
-                internal_state[i] = (x, new_c)
+            (x, new_c), internal_state = self.advance(input, internal_state)
             # only record effective steps
             if step in self.effective_step:
                 outputs.append(x)
@@ -257,13 +292,56 @@ class AnoPcn(nn.Module):
         self.pcm = PCM()
         self.erm = ERM(3,3)
     
+    def refine(self, prediction, target):
+        pe = torch.sub(target,prediction) # pe = prediction error
+        re = self.erm(pe) # re = recontruction error
+        result = torch.add(prediction, re)
+        return result
+
+    def stream_predict(self, stream_id, frame, horizon=0):
+        """Get the prediction of the new frame of the stream(made by the frames before it), and push the frame into the PCM.
+        The PCM carries its state from the first frame of the stream, so each frame costs one step of the PCM(two steps with the horizon)
+        instead of the whole clip.
+        Args:
+            frame(torch.Tensor): [N, C, H, W]
+            horizon(int): re-seed the state every horizon frames, see PCM.stream
+        Returns:
+            prediction(torch.Tensor|None): [N, C, H, W], None at the first frame of the stream
+        """
+        prediction = self.pcm.stream_prediction(stream_id)
+        self.pcm.stream(stream_id, frame, horizon)
+        return prediction
+
+    def reset_stream(self, stream_id=None):
+        self.pcm.reset_stream(stream_id)
+
     # @torchsnooper.snoop()
     def forward(self, x, target):
         # input is the video clip
         prediction = self.pcm(x)
-        pe = torch.sub(target,prediction) # pe = prediction error
-        re = self.erm(pe) # re = recontruction error
-        result = torch.add(prediction, re)
+        result = self.refine(prediction, target)
         
         return prediction, result
 
+
+def check_streaming(pcm, video_clip):
+    """Compare the streaming PCM with the recomputation on the clips.
+    The frames of the clip are pushed into a stream one by one, and the prediction after the t-th frame is compared with
+    the forward on the clip of the frames [0, t], which is what the sliding window does at the beginning of a video.
+    Args:
+        pcm(PCM): e.g. AnoPcn.pcm
+        video_clip(torch.Tensor): [N, C, D, H, W]
+    Returns:
+        error(float): The max absolute difference of the predictions, 0 up to the floating point error
+    """
+    stream_id = '__check_streaming__'
+    error = 0.0
+    pcm.reset_stream(stream_id)
+    with torch.no_grad():
+        for t in range(video_clip.shape[2]):
+            streamed = pcm.stream(stream_id, video_clip[:, :, t])
+            recomputed = pcm(video_clip[:, :, :t + 1])
+            error = max(error, float((streamed - recomputed).abs().max()))
+    pcm.reset_stream(stream_id)
+    return error
+
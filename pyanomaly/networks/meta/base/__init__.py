@@ -1,3 +1,4 @@
 from .commonness import *
 from .convolution_lstm import *
+from .incremental import *
 from .prednet import *
\ No newline at end of file
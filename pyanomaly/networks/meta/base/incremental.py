@@ -0,0 +1,171 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Run the 3D-conv encoder(nn.Sequential of Conv3d, MaxPool3d/AvgPool3d and the element-wise layers, e.g. the encoders of STAE and MemAE)
+on the windows of a stream which are shifted by one frame, and reuse the temporal slices of the feature maps computed for the windows before.
+Each temporal slice of a layer is anchored at the frame index(in the stream) where its temporal grid point is: the slice j of the window
+starting at the frame s is anchored at s + j * step, step is the product of the temporal strides before it. Two windows with the same
+anchor of a slice see the same frames in it, so the slice is the same if it is not touched by the temporal zero padding of the window.
+    'exact': only the slices not touched by the padding are reused, the features are the same as the encoder on the window
+    'approximate': the slices touched by the left padding are also reused, which were computed with the real frames before the window
+                   instead of the zeros. So the features are different from the encoder on the window at the beginning of the window.
+The slices touched by the right padding(the latest frames) are always computed.
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from collections import OrderedDict
+from torch.nn.modules.utils import _triple
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['IncrementalEncoder3D', 'build_incremental_encoder']
+
+_MODES = ('exact', 'approximate')
+_ELEMENTWISE = (nn.BatchNorm3d, nn.LeakyReLU, nn.ReLU, nn.ReLU6, nn.PReLU, nn.ELU, nn.Sigmoid, nn.Tanh, nn.Dropout, nn.Dropout3d, nn.Identity)
+
+
+class _Unit(object):
+    """One Conv3d or pooling layer of the encoder and the element-wise layers after it.
+    """
+    def __init__(self, layer):
+        self.layer = layer
+        self.elementwise = []
+        self.is_conv = isinstance(layer, nn.Conv3d)
+        if self.is_conv:
+            assert layer.dilation[0] == 1 and layer.padding_mode == 'zeros', f'Not support the temporal dilation or the padding mode of {layer}'
+            self.kernel, self.stride, self.padding = layer.kernel_size[0], layer.stride[0], layer.padding[0]
+        else:
+            self.kernel, self.stride, self.padding = _triple(layer.kernel_size)[0], _triple(layer.stride or layer.kernel_size)[0], _triple(layer.padding)[0]
+            assert self.padding == 0 and not layer.ceil_mode, f'Not support the temporal padding or the ceil mode of {layer}'
+
+    def finish(self, x):
+        for module in self.elementwise:
+            x = module(x)
+        return x
+
+    def compute(self, x, indices):
+        """Compute the output slices of the conv.
+        Args:
+            x(torch.Tensor): [N, C, D, H, W] the input of the window
+            indices(list): The sorted indices of the output slices
+        Returns:
+            slices(dict): index -> [N, C', 1, H', W']
+        """
+        conv = self.layer
+        padded = F.pad(x, (0, 0, 0, 0, self.padding, self.padding)) if self.padding > 0 else x
+        slices = dict()
+        begin = 0
+        while begin < len(indices):
+            # the contiguous indices are computed in one conv
+            end = begin
+            while end + 1 < len(indices) and indices[end + 1] == indices[end] + 1:
+                end += 1
+            first, last = indices[begin], indices[end]
+            slab = padded[:, :, first * self.stride:last * self.stride + self.kernel]
+            y = F.conv3d(slab, conv.weight, conv.bias, (self.stride,) + conv.stride[1:], (0,) + conv.padding[1:], (1,) + conv.dilation[1:], conv.groups)
+            y = self.finish(y)
+            for offset, index in enumerate(range(first, last + 1)):
+                slices[index] = y[:, :, offset:offset + 1]
+            begin = end + 1
+        return slices
+
+
+class IncrementalEncoder3D(object):
+    """Reuse the feature maps of the encoder across the overlapping windows of each stream.
+    Args:
+        encoder(nn.Sequential): The encoder in the eval mode, the element-wise layers work on each slice, e.g. the BatchNorm3d in the eval mode
+        mode(str): 'exact' | 'approximate'
+    """
+    def __init__(self, encoder, mode='exact'):
+        assert mode in _MODES, f'Not support the mode of the incremental encoder: {mode}'
+        self.encoder = encoder
+        self.mode = mode
+        self.units = []
+        for module in encoder:
+            if isinstance(module, (nn.Conv3d, nn.MaxPool3d, nn.AvgPool3d)):
+                self.units.append(_Unit(module))
+            elif isinstance(module, _ELEMENTWISE) and len(self.units) > 0:
+                self.units[-1].elementwise.append(module)
+            else:
+                raise Exception(f'Not support the layer in the incremental encoder: {module}')
+        # stream_id -> [the cache of each unit(anchor -> slice), the shape of the frames]
+        self.stream_states = OrderedDict()
+        # the number of the computed conv slices and all of the conv slices
+        self.computed = 0
+        self.total = 0
+
+    @property
+    def computed_ratio(self):
+        return self.computed / self.total if self.total > 0 else 0.0
+
+    def _state(self, stream_id, window):
+        shape = (tuple(window.shape[:2]) + tuple(window.shape[3:]), window.device)
+        state = self.stream_states.get(stream_id)
+        if state is None or state[1] != shape:
+            # the cached slices do not match the frames
+            state = self.stream_states[stream_id] = [[dict() for _ in self.units], shape]
+        return state[0]
+
+    def stream(self, stream_id, window, start):
+        """Get the features of the window of the stream.
+        The windows of a stream should be given in the order of the start, and the slices anchored before the start are released.
+        Args:
+            window(torch.Tensor): [N, C, D, H, W], the frames [start, start + D) of the stream
+            start(int): The index of the first frame of the window in the stream
+        Returns:
+            features(torch.Tensor): The output of the encoder
+        """
+        assert not self.encoder.training, 'The incremental encoder should be in the eval mode'
+        caches = self._state(stream_id, window)
+        x = window
+        # whether each slice is touched by the left padding and the right padding
+        left = [False] * x.shape[2]
+        right = [False] * x.shape[2]
+        step = 1
+        for unit, cache in zip(self.units, caches):
+            length = x.shape[2]
+            num_out = (length + 2 * unit.padding - unit.kernel) // unit.stride + 1
+            inputs = [range(j * unit.stride - unit.padding, j * unit.stride - unit.padding + unit.kernel) for j in range(num_out)]
+            out_left = [any(i < 0 or (i < length and left[i]) for i in item) for item in inputs]
+            out_right = [any(i >= length or (i >= 0 and right[i]) for i in item) for item in inputs]
+            step *= unit.stride
+            if not unit.is_conv:
+                x = unit.finish(unit.layer(x))
+            else:
+                reusable = [not r and (self.mode == 'approximate' or not l) for l, r in zip(out_left, out_right)]
+                anchors = [start + j * step for j in range(num_out)]
+                slices = [cache.get(anchor) if can_reuse else None for anchor, can_reuse in zip(anchors, reusable)]
+                missing = [j for j in range(num_out) if slices[j] is None]
+                if len(missing) > 0:
+                    for j, value in unit.compute(x, missing).items():
+                        slices[j] = value
+                        if reusable[j]:
+                            cache[anchors[j]] = value
+                self.computed += len(missing)
+                self.total += num_out
+                x = torch.cat(slices, dim=2)
+            left, right = out_left, out_right
+        # the next windows start after this one
+        for cache in caches:
+            for anchor in [anchor for anchor in cache.keys() if anchor <= start]:
+                del cache[anchor]
+        return x
+
+    def reset_stream(self, stream_id=None):
+        """Forget the slices of the stream, or all of the streams if the stream_id is None.
+        """
+        if stream_id is None:
+            self.stream_states.clear()
+        else:
+            self.stream_states.pop(stream_id, None)
+
+
+def build_incremental_encoder(incremental_cfg, encoder):
+    """Build the IncrementalEncoder3D with the SERVICE.incremental config, None if it is not used.
+    """
+    if not incremental_cfg.use:
+        return None
+    return IncrementalEncoder3D(encoder, incremental_cfg.mode)
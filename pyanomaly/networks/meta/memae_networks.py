@@ -2,9 +2,14 @@
 @author:  Yuhao Cheng
 @contact: yuhao.cheng[at]outlook.com
 """
+import time
+import queue
+import resource
+import argparse
 import torch
 import torch.nn as nn
 import math
+import multiprocessing as mp
 # from torch.nn.parameter import Parameter
 from torch.nn import functional as F
 import numpy as np
@@ -12,15 +17,26 @@ from collections import OrderedDict
 
 import torchsnooper
 from ..model_registry import META_ARCH_REGISTRY
+import logging
+logger = logging.getLogger(__name__)
 
-__all__ = ['AutoEncoderCov3DMem']
+__all__ = ['AutoEncoderCov3DMem', 'benchmark_memory_module']
 
 class MemoryModule3D(nn.Module):
-    def __init__(self, mem_dim, fea_dim, hard_shrink=True, lam=1.0):
+    """The memory of MemAE.
+    Args:
+        mem_dim(int): The number of the items in the memory
+        fea_dim(int): The channels of the features
+        chunk_size(int): The number of the features addressed together, 0 means all of them
+        detect_anomaly(bool): Run the forward with the torch.autograd.set_detect_anomaly, only for debugging because it is slow
+    """
+    def __init__(self, mem_dim, fea_dim, hard_shrink=True, lam=1.0, chunk_size=4096, detect_anomaly=False):
         super(MemoryModule3D, self).__init__()
         self.mem_dim = mem_dim
         self.fea_dim = fea_dim
         self.hard_shrink = hard_shrink
+        self.chunk_size = chunk_size
+        self.detect_anomaly = detect_anomaly
         if hard_shrink:
             self.shrink_thres = lam / self.mem_dim
         self.memory = nn.Parameter(torch.Tensor(self.mem_dim, self.fea_dim))  # M x C
@@ -34,26 +50,62 @@ class MemoryModule3D(nn.Module):
     def hard_shrink_relu(self, input, lambd=0, epsilon=1e-15):
         return (F.relu(input-lambd) * input) / (torch.abs(input - lambd) + epsilon)
     
-    # @torchsnooper.snoop()
-    def forward(self, z):
-        with torch.autograd.set_detect_anomaly(True):
-            N, C, D, H, W = z.size() # C=256
-            z = z.permute(0, 2, 3, 4, 1) 
-            z = z.reshape(-1, C) # [N*D*H*W, C]
-            ex_mem = self.memory.unsqueeze(0).repeat(z.shape[0], 1, 1) # the shape of memory is to be [N*D*H*W, M, C]
-            ex_z = z.unsqueeze(1).repeat(1,self.mem_dim, 1) # ex_z is to be [N*D*H*W, M, C]
-            w_logit = self.cos_similarity(ex_z, ex_mem)
+    def address(self, z):
+        """Get the addressing weights of the features.
+        The cosine similarity is the matmul of the normalized features and the normalized memory, the same as the nn.CosineSimilarity
+        on the [N*D*H*W, M, C] repeated features and memory. The features are addressed chunk by chunk, so the temporary tensors are [chunk_size, M].
+        Args:
+            z(torch.Tensor): [N*D*H*W, C]
+        Returns:
+            w_hat(torch.Tensor): [N*D*H*W, M] the weights after the softmax and the shrinkage
+        """
+        eps = self.cos_similarity.eps
+        mem_norm = self.memory / self.memory.norm(dim=1, keepdim=True).clamp_min(eps)
+        chunk_size = self.chunk_size if self.chunk_size > 0 else max(z.shape[0], 1)
+        weights = []
+        for start in range(0, z.shape[0], chunk_size):
+            z_chunk = z[start:start + chunk_size]
+            z_norm = z_chunk / z_chunk.norm(dim=1, keepdim=True).clamp_min(eps)
+            w_logit = torch.mm(z_norm, mem_norm.t())
             w = F.softmax(w_logit, dim=1)
             if self.hard_shrink:
                 w_hat = self.hard_shrink_relu(w, lambd=self.shrink_thres)
             else:
                 w_hat = F.relu(w)
-            
-            w_hat = F.normalize(w_hat, p=1, dim=0)
-            mem_trans = self.memory.permute(1,0)
-            z_hat = F.linear(w_hat, mem_trans)
-            z_output = z_hat.reshape(N,D,H,W,C).permute(0,4,1,2,3)
-            return z_output, w_hat
+            weights.append(w_hat)
+        return weights[0] if len(weights) == 1 else torch.cat(weights, dim=0)
+
+    def address_repeat(self, z):
+        """The addressing with the repeated tensors, which is the original implementation, only used to check the address and by the benchmark.
+        """
+        ex_mem = self.memory.unsqueeze(0).repeat(z.shape[0], 1, 1) # the shape of memory is to be [N*D*H*W, M, C]
+        ex_z = z.unsqueeze(1).repeat(1,self.mem_dim, 1) # ex_z is to be [N*D*H*W, M, C]
+        w_logit = self.cos_similarity(ex_z, ex_mem)
+        w = F.softmax(w_logit, dim=1)
+        if self.hard_shrink:
+            w_hat = self.hard_shrink_relu(w, lambd=self.shrink_thres)
+        else:
+            w_hat = F.relu(w)
+        return w_hat
+
+    def read(self, z, repeat=False):
+        N, C, D, H, W = z.size() # C=256
+        z = z.permute(0, 2, 3, 4, 1) 
+        z = z.reshape(-1, C) # [N*D*H*W, C]
+        w_hat = self.address_repeat(z) if repeat else self.address(z)
+        
+        w_hat = F.normalize(w_hat, p=1, dim=0)
+        mem_trans = self.memory.permute(1,0)
+        z_hat = F.linear(w_hat, mem_trans)
+        z_output = z_hat.reshape(N,D,H,W,C).permute(0,4,1,2,3)
+        return z_output, w_hat
+
+    # @torchsnooper.snoop()
+    def forward(self, z):
+        if self.detect_anomaly:
+            with torch.autograd.set_detect_anomaly(True):
+                return self.read(z)
+        return self.read(z)
         
 
 @META_ARCH_REGISTRY.register()
@@ -100,10 +152,108 @@ class AutoEncoderCov3DMem(nn.Module):
             if isinstance(m, nn.ConvTranspose3d):
                 m.weight = nn.init.kaiming_normal_(m.weight, mode='fan_out')
     
+    def decode(self, f):
+        """Decode the features of the encoder with the memory, e.g. the features given by the IncrementalEncoder3D.
+        """
+        z_hat, w_hat = self.mem_rep(f)
+        output = self.decoder(z_hat)
+        return output, w_hat
+
     def forward(self, x):
         f = self.encoder(x)
-        z_hat, w_hat = self.mem_rep(f)
         # import ipdb; ipdb.set_trace()
-
-        output = self.decoder(z_hat)
+        output, w_hat = self.decode(f)
         return output, w_hat
+
+
+def _run_memory_module(module, z, repeat, iterations, backward):
+    # the mean seconds of the forward(and the backward) and the outputs
+    outputs = None
+    start = time.perf_counter()
+    for _ in range(iterations):
+        module.zero_grad()
+        with torch.set_grad_enabled(backward):
+            z_input = z.detach().requires_grad_(backward)
+            outputs = module.read(z_input, repeat=repeat)
+            if backward:
+                outputs[0].sum().backward()
+    if z.is_cuda:
+        torch.cuda.synchronize(z.device)
+    return (time.perf_counter() - start) / iterations, [item.detach() for item in outputs]
+
+
+def _measure_cpu(module, z, repeat, iterations, backward, queue):
+    # the peak resident memory of the child process, which starts with the memory of the parent
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds, outputs = _run_memory_module(module, z, repeat, iterations, backward)
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024.0
+    queue.put((seconds, peak, [item.numpy() for item in outputs]))
+
+
+def benchmark_memory_module(num_features=4096, mem_dim=2000, fea_dim=256, chunk_size=4096, device='cpu', iterations=5, backward=False):
+    """Compare the addressing with the repeated tensors and the chunked matmul.
+    On the cuda device, the peak memory is the torch.cuda.max_memory_allocated during the run. On the cpu, each addressing is run in a forked process
+    and the peak memory is the increase of its max resident memory(Linux).
+    Args:
+        num_features(int): The number of the features, N*D*H*W
+        mem_dim(int): The number of the items in the memory
+        fea_dim(int): The channels of the features
+        chunk_size(int): The chunk size of the matmul addressing
+        backward(bool): Also run the backward
+    Returns:
+        rows(list): The seconds per iteration, the peak memory in MB and the max difference of the outputs of each addressing
+    """
+    device = torch.device(device)
+    module = MemoryModule3D(mem_dim, fea_dim, chunk_size=chunk_size).to(device)
+    z = torch.randn(1, fea_dim, 1, 1, num_features, device=device)
+    rows, reference = [], None
+    for name, repeat in [('repeat', True), ('matmul', False)]:
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+            seconds, outputs = _run_memory_module(module, z, repeat, iterations, backward)
+            peak = (torch.cuda.max_memory_allocated(device) - base) / 1024.0 ** 2
+        else:
+            context = mp.get_context('fork')
+            results = context.Queue()
+            process = context.Process(target=_measure_cpu, args=(module, z, repeat, iterations, backward, results))
+            process.start()
+            while True:
+                try:
+                    seconds, peak, outputs = results.get(timeout=1.0)
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise Exception(f'The process of the {name} addressing exits with the code {process.exitcode}, e.g. out of memory')
+            process.join()
+            outputs = [torch.from_numpy(item) for item in outputs]
+        outputs = [item.cpu() for item in outputs]
+        reference = outputs if reference is None else reference
+        row = OrderedDict()
+        row['addressing'] = name
+        row['chunk_size'] = chunk_size if not repeat else 0
+        row['seconds'] = seconds
+        row['peak_memory_mb'] = peak
+        row['max_diff'] = max(float((item - ref).abs().max()) for item, ref in zip(outputs, reference))
+        logger.info(f'{name}: {seconds * 1000:.2f}ms, peak memory:{peak:.1f}MB, max difference:{row["max_diff"]:.3e}')
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the latency and the peak memory of the addressing of the MemoryModule3D')
+    parser.add_argument('--num_features', type=int, default=4096, help='the number of the features, N*D*H*W')
+    parser.add_argument('--mem_dim', type=int, default=2000)
+    parser.add_argument('--fea_dim', type=int, default=256)
+    parser.add_argument('--chunk_size', type=int, default=4096)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--backward', action='store_true', help='also run the backward')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    table = benchmark_memory_module(args.num_features, args.mem_dim, args.fea_dim, args.chunk_size, args.device, args.iterations, args.backward)
+    fields = list(table[0].keys())
+    print('\t'.join(fields))
+    for row in table:
+        print('\t'.join(str(row[field]) for field in fields))
@@ -1,6 +1,7 @@
 # https://github.com/automan000/Convolutional_LSTM_PyTorch.git
 import torch
 import torch.nn as nn
+from collections import OrderedDict
 from torch.autograd import Variable
 import torchsnooper
 class ConvLSTMCell(nn.Module):
@@ -37,19 +38,74 @@ class ConvLSTMCell(nn.Module):
         ch = co * torch.tanh(cc)
         return ch, cc
 
-    def init_hidden(self, batch_size, hidden, shape):
+    def init_hidden(self, batch_size, hidden, shape, device=None, dtype=None):
+        # the state is made on the device of the input, e.g. device=x.device
         if self.Wci is None:
-            self.Wci = Variable(torch.zeros(1, hidden, shape[0], shape[1])).cuda()
-            self.Wcf = Variable(torch.zeros(1, hidden, shape[0], shape[1])).cuda()
-            self.Wco = Variable(torch.zeros(1, hidden, shape[0], shape[1])).cuda()
+            self.Wci = torch.zeros(1, hidden, shape[0], shape[1], device=device, dtype=dtype)
+            self.Wcf = torch.zeros(1, hidden, shape[0], shape[1], device=device, dtype=dtype)
+            self.Wco = torch.zeros(1, hidden, shape[0], shape[1], device=device, dtype=dtype)
         else:
             assert shape[0] == self.Wci.size()[2], 'Input Height Mismatched!'
             assert shape[1] == self.Wci.size()[3], 'Input Width Mismatched!'
-        return (Variable(torch.zeros(batch_size, hidden, shape[0], shape[1])).cuda(),
-                Variable(torch.zeros(batch_size, hidden, shape[0], shape[1])).cuda())
+            if device is not None and self.Wci.device != torch.device(device):
+                self.Wci, self.Wcf, self.Wco = self.Wci.to(device), self.Wcf.to(device), self.Wco.to(device)
+        return (torch.zeros(batch_size, hidden, shape[0], shape[1], device=device, dtype=dtype),
+                torch.zeros(batch_size, hidden, shape[0], shape[1], device=device, dtype=dtype))
 
 
-class ConvLSTM(nn.Module):
+class ConvLSTMStream(object):
+    """Run the stacked cells(`cell0`, `cell1`, ...) of the sub-class one step at a time.
+    The state is the list of (h, c) of each layer, so the recurrence can be carried across the frames of a stream
+    instead of being recomputed from the zero state on every clip. The sub-class has the num_layers, hidden_channels
+    and the `stream_states`(stream_id -> state).
+    """
+    def init_state(self, x):
+        """The zero state of the input.
+        Args:
+            x(torch.Tensor): [N, C, H, W]
+        Returns:
+            state(list): [(h, c), ...] of each layer
+        """
+        bsize, _, height, width = x.size()
+        return [getattr(self, 'cell{}'.format(i)).init_hidden(batch_size=bsize, hidden=self.hidden_channels[i], shape=(height, width), device=x.device, dtype=x.dtype)
+                for i in range(self.num_layers)]
+
+    def advance(self, x, state=None):
+        """Advance the state one step with the input.
+        Args:
+            x(torch.Tensor): [N, C, H, W]
+            state(list|None): The state of the last step, None or [] means the first step
+        Returns:
+            (h, c): The output of the last layer
+            state(list): The new state
+        """
+        if not state:
+            state = self.init_state(x)
+        new_state = []
+        for i in range(self.num_layers):
+            (h, c) = state[i]
+            x, new_c = getattr(self, 'cell{}'.format(i))(x, h, c)
+            new_state.append((x, new_c))
+        return (x, new_c), new_state
+
+    def stream(self, stream_id, x):
+        """Advance the state of the stream with its new input, the first input of the stream starts from the zero state.
+        Returns:
+            (h, c): The output of the last layer
+        """
+        output, self.stream_states[stream_id] = self.advance(x, self.stream_states.get(stream_id))
+        return output
+
+    def reset_stream(self, stream_id=None):
+        """Forget the state of the stream, or all of the streams if the stream_id is None.
+        """
+        if stream_id is None:
+            self.stream_states.clear()
+        else:
+            self.stream_states.pop(stream_id, None)
+
+
+class ConvLSTM(ConvLSTMStream, nn.Module):
     # input_channels corresponds to the first input feature map
     # hidden state is a list of succeeding lstm layers.
     def __init__(self, input_channels, hidden_channels, kernel_size, step=1, effective_step=[1]):
@@ -66,26 +122,15 @@ class ConvLSTM(nn.Module):
             cell = ConvLSTMCell(self.input_channels[i], self.hidden_channels[i], self.kernel_size)
             setattr(self, name, cell)
             self._all_layers.append(cell)
+        # stream_id -> the state of the stream
+        self.stream_states = OrderedDict()
 
     def forward(self, input):
-        internal_state = []
+        # all cells are initialized in the first step
+        internal_state = None
         outputs = []
         for step in range(self.step):
-            x = input
-            for i in range(self.num_layers):
-                # all cells are initialized in the first step
-                name = 'cell{}'.format(i)
-                print(name)
-                if step == 0:
-                    bsize, _, height, width = x.size()
-                    (h, c) = getattr(self, name).init_hidden(batch_size=bsize, hidden=self.hidden_channels[i],
-                                                             shape=(height, width))
-                    internal_state.append((h, c))
-
-                # do forward
-                (h, c) = internal_state[i]
-                x, new_c = getattr(self, name)(x, h, c)
-                internal_state[i] = (x, new_c)
+            (x, new_c), internal_state = self.advance(input, internal_state)
             # only record effective steps
             if step in self.effective_step:
                 outputs.append(x)
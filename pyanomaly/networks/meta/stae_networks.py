@@ -69,10 +69,17 @@ class STAutoEncoderCov3D(nn.Module):
                 nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
             if isinstance(m, nn.ConvTranspose3d):
                 nn.init.kaiming_normal_(m.weight, mode='fan_out', nonlinearity='relu')
+
+    def decode(self, f):
+        """Decode the features of the encoder, e.g. the features given by the IncrementalEncoder3D.
+        """
+        out_reconstruction = self.decoder_reconstruction(f)
+        out_prediction = self.decoder_prediction(f)
+        return out_reconstruction, out_prediction
+
     # @torchsnooper.snoop()
     def forward(self, x):
         f = self.encoder(x)
-        out_reconstruction = self.decoder_reconstruction(f)
-        out_prediction = self.decoder_prediction(f)
+        out_reconstruction, out_prediction = self.decode(f)
         # import ipdb; ipdb.set_trace()
         return out_reconstruction, out_prediction
@@ -0,0 +1,305 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+Plan the cpu runtime of the process, based on the layout of the cores.
+The cores of the process(its part of the machine in the distributed training) are split between the compute threads of torch and the data workers,
+so the data workers do not compete with the compute threads once they start.
+The plan sets torch.set_num_threads, torch.set_num_interop_threads and the core affinity of the process and the data workers.
+The RuntimeTuner times a few training steps with each candidate plan and keeps the fastest one.
+"""
+import os
+import glob
+import time
+import numpy as np
+import torch
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = ['CPUTopology', 'RuntimePlan', 'RuntimeTuner', 'read_cpu_topology', 'make_runtime_plan', 'candidate_plans', 'apply_runtime_plan', 
+           'plan_runtime', 'get_runtime_plan', 'get_runtime_tuner', 'runtime_worker_init']
+
+# the plan applied in this process, which is inherited by the forked data workers
+_RUNTIME_PLAN = None
+# the tuner made by plan_runtime, which is used by the trainer
+_RUNTIME_TUNER = None
+
+
+def _parse_cpu_list(text):
+    # e.g. '0-3,8,10-11'
+    cpus = []
+    for part in text.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            begin, end = part.split('-')
+            cpus.extend(range(int(begin), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class CPUTopology(object):
+    """The layout of the cpus which can be used by the process.
+    Args:
+        nodes(list): The NUMA nodes, each one is the list of the physical cores on it, and each core is the list of its logical cpus(the hyper-threads)
+    """
+    def __init__(self, nodes):
+        self.nodes = [node for node in nodes if len(node) > 0]
+
+    @property
+    def cores(self):
+        return [core for node in self.nodes for core in node]
+
+    @property
+    def cpus(self):
+        return [cpu for core in self.cores for cpu in core]
+
+    def __repr__(self):
+        return f'CPUTopology(nodes={len(self.nodes)}, cores={len(self.cores)}, cpus={len(self.cpus)})'
+
+
+def read_cpu_topology():
+    """Read the NUMA nodes and the physical cores from the sysfs, only the cpus in the affinity of the process are used.
+    If the sysfs is not available, every cpu is regarded as one core on one node.
+    Returns:
+        topology(CPUTopology)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        allowed = sorted(os.sched_getaffinity(0))
+    else:
+        allowed = list(range(os.cpu_count() or 1))
+    allowed_set = set(allowed)
+
+    node_of = dict()
+    for node_path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*')):
+        text = _read_file(os.path.join(node_path, 'cpulist'))
+        if text is None:
+            continue
+        node_id = int(os.path.basename(node_path)[len('node'):])
+        for cpu in _parse_cpu_list(text):
+            node_of[cpu] = node_id
+
+    core_of = dict()
+    for cpu in allowed:
+        text = _read_file(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list')
+        siblings = _parse_cpu_list(text) if text is not None else [cpu]
+        # the core is named by its first logical cpu
+        core_of[cpu] = min(siblings)
+
+    nodes = dict()
+    for cpu in allowed:
+        node = nodes.setdefault(node_of.get(cpu, 0), dict())
+        node.setdefault(core_of[cpu], []).append(cpu)
+    topology = CPUTopology([[sorted(node[core]) for core in sorted(node)] for _, node in sorted(nodes.items())])
+    assert set(topology.cpus) == allowed_set
+    return topology
+
+
+class RuntimePlan(object):
+    """The threads and the cores used by the process.
+    Args:
+        num_threads(int): The intra-op threads of torch
+        num_interop_threads(int): The inter-op threads of torch
+        num_workers(int): The number of the data workers
+        compute_cpus(list): The cpus of the compute threads
+        worker_cpus(list): The cpus of the data workers
+        pin(bool): Whether to set the core affinity
+    """
+    def __init__(self, num_threads, num_interop_threads, num_workers, compute_cpus, worker_cpus, pin=True):
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.num_workers = num_workers
+        self.compute_cpus = list(compute_cpus)
+        self.worker_cpus = list(worker_cpus)
+        self.pin = pin
+
+    def __repr__(self):
+        return (f'RuntimePlan(threads={self.num_threads}, interop_threads={self.num_interop_threads}, data_workers={self.num_workers}, '
+                f'compute_cpus={self.compute_cpus}, worker_cpus={self.worker_cpus}, pin={self.pin})')
+
+
+def _process_cores(topology, local_rank, local_size):
+    # the processes on the machine take the contiguous parts of the cores, so each part stays on as few nodes as possible
+    cores = topology.cores
+    if local_size <= 1:
+        return cores
+    if len(cores) < local_size:
+        return [cores[local_rank % len(cores)]]
+    per_process = len(cores) // local_size
+    return cores[local_rank * per_process:(local_rank + 1) * per_process]
+
+
+def make_runtime_plan(topology, local_rank=0, local_size=1, num_workers=-1, num_interop_threads=1, use_smt=False, pin=True):
+    """Split the cores of the process between the compute threads and the data workers.
+    Args:
+        topology(CPUTopology): The layout from read_cpu_topology
+        local_rank(int): The rank of the process on this machine
+        local_size(int): The number of the processes on this machine
+        num_workers(int): The number of the data workers, -1 means planning it by the number of the cores
+        num_interop_threads(int): The inter-op threads of torch
+        use_smt(bool): Use all of the hyper-threads as the compute threads, otherwise one thread on each physical core
+        pin(bool): Set the core affinity
+    Returns:
+        plan(RuntimePlan)
+    """
+    cores = _process_cores(topology, local_rank, local_size)
+    if num_workers < 0:
+        # one data worker for every 8 cores, the small machines load the data in the main process
+        num_workers = 0 if len(cores) < 4 else max(1, min(4, len(cores) // 8))
+    # each data worker gets one physical core, the compute threads get the rest
+    num_worker_cores = min(num_workers, len(cores) - 1)
+    if num_worker_cores > 0:
+        compute_cores, worker_cores = cores[:-num_worker_cores], cores[-num_worker_cores:]
+    else:
+        compute_cores, worker_cores = cores, cores
+    if use_smt:
+        compute_cpus = [cpu for core in compute_cores for cpu in core]
+    else:
+        compute_cpus = [core[0] for core in compute_cores]
+    worker_cpus = [cpu for core in worker_cores for cpu in core]
+    return RuntimePlan(len(compute_cpus), num_interop_threads, num_workers, compute_cpus, worker_cpus, pin=pin)
+
+
+def candidate_plans(topology, base_plan, local_rank=0, local_size=1):
+    """The plans compared by the RuntimeTuner: one thread on each physical core, one thread on each hyper-thread and half of the physical cores.
+    The threads which have started keep their affinity, so the plans use the same cpus(with the hyper-threads) and only change the number of the threads.
+    The data workers of the base plan are kept.
+    """
+    smt_plan = make_runtime_plan(topology, local_rank, local_size, base_plan.num_workers, base_plan.num_interop_threads, use_smt=True, pin=base_plan.pin)
+    num_cores = len(make_runtime_plan(topology, local_rank, local_size, base_plan.num_workers, use_smt=False).compute_cpus)
+    counts = []
+    for count in [num_cores, smt_plan.num_threads, num_cores // 2]:
+        if count > 0 and count not in counts:
+            counts.append(count)
+    return [RuntimePlan(count, base_plan.num_interop_threads, base_plan.num_workers, smt_plan.compute_cpus, smt_plan.worker_cpus, pin=base_plan.pin) for count in counts]
+
+
+def apply_runtime_plan(plan, set_interop=True, set_affinity=True):
+    """Apply the plan to this process.
+    The affinity is set on the calling thread and inherited by the threads and the data workers started after it,
+    so call it before building the models and the dataloaders.
+    Args:
+        plan(RuntimePlan)
+        set_interop(bool): Set the inter-op threads, which can only be set once before the inter-op work starts
+        set_affinity(bool): Set the affinity of the calling thread
+    """
+    global _RUNTIME_PLAN
+    if set_affinity and plan.pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, plan.compute_cpus)
+    torch.set_num_threads(plan.num_threads)
+    if set_interop and plan.num_interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(plan.num_interop_threads)
+        except RuntimeError as e:
+            logger.warning(f'Can not set the inter-op threads: {e}')
+    _RUNTIME_PLAN = plan
+    logger.info(f'Use the cpu runtime plan: {plan}')
+
+
+def plan_runtime(runtime_cfg, local_rank=0, local_size=1):
+    """Make and apply the plan of this process with the SYSTEM.runtime config.
+    If the auto-tune is used, the first candidate plan is applied and the RuntimeTuner is kept for the trainer(get_runtime_tuner).
+    Args:
+        runtime_cfg: The config node SYSTEM.runtime
+        local_rank(int): The rank of the process on this machine
+        local_size(int): The number of the processes on this machine
+    Returns:
+        plan(RuntimePlan)
+    """
+    global _RUNTIME_TUNER
+    topology = read_cpu_topology()
+    logger.info(f'The cpus of the process: {topology}, local rank:{local_rank}/{local_size}')
+    plan = make_runtime_plan(topology, local_rank, local_size, runtime_cfg.num_workers, runtime_cfg.interop_threads, runtime_cfg.use_smt, runtime_cfg.pin)
+    _RUNTIME_TUNER = None
+    if runtime_cfg.auto_tune.use:
+        plans = candidate_plans(topology, plan, local_rank, local_size)
+        _RUNTIME_TUNER = RuntimeTuner(plans, runtime_cfg.auto_tune.steps, runtime_cfg.auto_tune.warmup)
+        plan = plans[0]
+    apply_runtime_plan(plan)
+    return plan
+
+
+def get_runtime_plan():
+    """Get the plan applied in this process, None if the planner is not used.
+    """
+    return _RUNTIME_PLAN
+
+
+def get_runtime_tuner():
+    """Get the RuntimeTuner made by plan_runtime, None if the auto-tune is not used.
+    """
+    return _RUNTIME_TUNER
+
+
+def runtime_worker_init(worker_id):
+    """The worker_init_fn of the dataloaders, which moves the data worker to the cores of the data workers and uses one thread in it.
+    """
+    plan = _RUNTIME_PLAN
+    if plan is None:
+        return
+    torch.set_num_threads(1)
+    if plan.pin and hasattr(os, 'sched_setaffinity') and len(plan.worker_cpus) > 0:
+        os.sched_setaffinity(0, plan.worker_cpus)
+
+
+class RuntimeTuner(object):
+    """Time the training steps with each candidate plan, and keep the fastest one.
+    The tuned steps are the normal training steps, only the threads and the affinity are changed between them.
+    The engine calls before_step and after_step around the training step(without the hooks).
+    Args:
+        plans(list): The candidate plans, got from candidate_plans
+        steps(int): The number of the timed steps of each plan
+        warmup(int): The number of the steps which are not timed after changing the plan
+    """
+    def __init__(self, plans, steps=5, warmup=1):
+        self.plans = plans
+        self.steps = max(1, int(steps))
+        self.warmup = max(0, int(warmup))
+        self.timings = [[] for _ in plans]
+        self.best = None
+        self._index = 0
+        self._count = 0
+        self._start = None
+
+    @property
+    def finished(self):
+        return self.best is not None
+
+    def before_step(self, current_step):
+        if self.finished:
+            return
+        if self._count == 0:
+            apply_runtime_plan(self.plans[self._index], set_interop=False, set_affinity=False)
+        self._start = time.perf_counter()
+
+    def after_step(self, current_step):
+        if self.finished or self._start is None:
+            return
+        elapsed = time.perf_counter() - self._start
+        self._start = None
+        if self._count >= self.warmup:
+            self.timings[self._index].append(elapsed)
+        self._count += 1
+        if self._count >= self.warmup + self.steps:
+            self._index += 1
+            self._count = 0
+            if self._index >= len(self.plans):
+                self._finish()
+
+    def _finish(self):
+        medians = [float(np.median(item)) for item in self.timings]
+        for plan, median in zip(self.plans, medians):
+            logger.info(f'Auto-tune: {median * 1000:.1f}ms/step with {plan}')
+        self.best = self.plans[int(np.argmin(medians))]
+        apply_runtime_plan(self.best, set_interop=False, set_affinity=False)
+        logger.info(f'Auto-tune: keep the plan with {self.best.num_threads} threads')
@@ -1,29 +1,50 @@
 '''
 This file is to set up the setting about the system, torch, CUDA, cudnn and so on based on the xxx.yaml
 '''
+import os
 import torch
 import logging
 import argparse
+from .runtime import plan_runtime
 logger = logging.getLogger(__name__)
 
+def _local_rank_and_size():
+    # torch.distributed.run sets the LOCAL_RANK and LOCAL_WORLD_SIZE, and the launch() sets the local process group
+    if 'LOCAL_RANK' in os.environ and 'LOCAL_WORLD_SIZE' in os.environ:
+        return int(os.environ['LOCAL_RANK']), int(os.environ['LOCAL_WORLD_SIZE'])
+    from pyanomaly.datatools.dataclass.sampler import common as comm
+    if comm._LOCAL_PROCESS_GROUP is not None:
+        return comm.get_local_rank(), comm.get_local_size()
+    return 0, 1
+
 def system_setup(args, cfg):
     # cudnn related setting
     torch.backends.cudnn.enable = cfg.SYSTEM.cudnn.enable
     torch.backends.cudnn.benchmark = cfg.SYSTEM.cudnn.benchmark
     torch.backends.cudnn.deterministic = cfg.SYSTEM.cudnn.deterministic
     gpus = cfg.SYSTEM.gpus
-    if len(gpus) > 1:
+    if cfg.SYSTEM.device == 'cpu' or cfg.SYSTEM.distributed.use:
+        # the DataParallel is only used with multiple gpus in one process
+        parallel_flag = False
+    elif len(gpus) > 1:
         parallel_flag = True
     elif len(gpus) == 1:
         parallel_flag = False
     else:
         raise Exception('You need to  decide the gpu!')
 
-    if cfg.SYSTEM.distributed.use:
-        rank = args.rank * ngpus_per_node + gpu
-        logger.info('Need to set the local_rank in args!!!')
-        logger.info(f'local_rank:{args.local_rank}')
-        torch.distributed.init_process_group(backend="nccl", init_method=args.init_method, world_size=args.world_size, rank=rank)
+    if cfg.SYSTEM.distributed.use and not torch.distributed.is_initialized():
+        # the processes are not started by the launch(), e.g. started by torch.distributed.run, which sets the RANK and WORLD_SIZE
+        rank = int(os.environ.get('RANK', args.rank))
+        world_size = int(os.environ.get('WORLD_SIZE', args.world_size))
+        init_method = 'env://' if 'RANK' in os.environ else args.init_method
+        logger.info(f'Init the process group, rank:{rank}, world_size:{world_size}, backend:{cfg.SYSTEM.distributed.backend}')
+        torch.distributed.init_process_group(backend=cfg.SYSTEM.distributed.backend, init_method=init_method, world_size=world_size, rank=rank)
+    
+    if cfg.SYSTEM.device == 'cpu' and cfg.SYSTEM.runtime.use:
+        # split the cores between the compute threads and the data workers before building the models and the dataloaders
+        local_rank, local_size = _local_rank_and_size()
+        plan_runtime(cfg.SYSTEM.runtime, local_rank, local_size)
     
     return parallel_flag
 
@@ -0,0 +1,67 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The MicroBatchScheduler scores the windows of many streams together, and each stream gets the same scores as pushing its frames one by one.
+"""
+from pathlib import Path
+import numpy as np
+import pytest
+import torch
+from pyanomaly import ModelAPI
+from pyanomaly.config import update_config
+from pyanomaly.core.engine.engine_api import ENGINE_REGISTRY
+
+CFG_PATH = Path(__file__).resolve().parents[1] / 'configuration' / 'stae' / 'avenue' / 'avenue_default.yaml'
+NUM_STREAMS = 3
+NUM_FRAMES = 12
+
+
+def build_service(tmp_path, opts):
+    model_file = tmp_path / 'stae.pth'
+    cfg = update_config(CFG_PATH, ['SYSTEM.device', 'cpu', 'AUGMENT.val.resize.height', '32', 'AUGMENT.val.resize.width', '32',
+                                   'DATASET.val.sampled_clip_length', '8', 'SERVICE.batching.max_batch_size', '4', 'VAL.model_file', str(model_file)] + opts)
+    torch.manual_seed(0)
+    model_dict = ModelAPI(cfg)()
+    torch.save({key: model.state_dict() for key, model in model_dict.items()}, model_file)
+    return ENGINE_REGISTRY.get('STAEService')(model_dict=model_dict, config=cfg, parallel=False, verbose='test', config_name='test', hooks=[], evaluate_function=None)
+
+
+@pytest.fixture
+def frames():
+    rs = np.random.RandomState(0)
+    return rs.randint(0, 255, (NUM_STREAMS, NUM_FRAMES, 32, 32, 3)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('opts', [[], ['SERVICE.incremental.use', 'True', 'SERVICE.incremental.mode', 'exact']])
+def test_scheduler_scores(tmp_path, frames, opts):
+    service = build_service(tmp_path, opts)
+    expected = dict()
+    for stream in range(NUM_STREAMS):
+        results = [service.push_frame(f'single{stream}', frame) for frame in frames[stream]]
+        expected[stream] = [result.score for result in results if result is not None]
+        service.close_stream(f'single{stream}')
+
+    if service.incremental is not None:
+        service.incremental.computed, service.incremental.total = 0, 0
+    scheduler = service.build_scheduler()
+    futures = {stream: [] for stream in range(NUM_STREAMS)}
+    # the frames of the streams arrive interleaved
+    for index in range(NUM_FRAMES):
+        for stream in range(NUM_STREAMS):
+            future = scheduler.submit(f'batched{stream}', frames[stream, index])
+            if future is not None:
+                futures[stream].append(future)
+    for stream in range(NUM_STREAMS):
+        results = [future.result(timeout=60) for future in futures[stream]]
+        assert [result.frame_index for result in results] == list(range(service.window_length - 1, NUM_FRAMES))
+        assert np.allclose([result.score for result in results], expected[stream], atol=1e-6)
+        # the stream is closed under the locks of the scheduler
+        assert scheduler.close_stream(f'batched{stream}')['count'] == len(results)
+    assert len(service.streams) == 0
+    stats = scheduler.close()
+    assert stats['windows'] == NUM_STREAMS * (NUM_FRAMES - service.window_length + 1)
+    if service.incremental is not None:
+        # the batches also reuse the slices of the windows before
+        assert 0.0 < service.incremental.computed_ratio < 1.0
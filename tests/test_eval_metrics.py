@@ -0,0 +1,61 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The metrics of the evaluators on the same scores.
+"""
+import numpy as np
+import pytest
+from sklearn import metrics
+from pyanomaly.datatools.evaluate.batch_eval import compute_frame_auc
+from pyanomaly.datatools.evaluate.eval_function import ScoreHistogram
+from pyanomaly.datatools.evaluate.utils import cal_eer
+
+NUM_BINS = 1000
+
+
+@pytest.fixture
+def videos():
+    rs = np.random.RandomState(0)
+    scores, labels = [], []
+    for length in [200, 150, 300]:
+        label = np.zeros(length, dtype=np.int64)
+        label[length // 3: length // 2] = 1
+        # the abnormal frames get the higher scores
+        scores.append(np.clip(rs.normal(0.4, 0.15, length) + 0.3 * label, 0.0, 1.0))
+        labels.append(label)
+    return scores, labels
+
+
+def test_eer_definition(videos):
+    scores, labels = videos
+    fpr, tpr, _ = metrics.roc_curve(np.concatenate(labels), np.concatenate(scores), pos_label=1)
+    auc, eer = compute_frame_auc(scores, labels, pos_label=1, return_eer=True)
+    assert auc == pytest.approx(metrics.auc(fpr, tpr))
+    assert eer == pytest.approx(cal_eer(fpr, tpr))
+    histogram = ScoreHistogram(NUM_BINS, (0.0, 1.0), pos_label=1)
+    for score, label in zip(scores, labels):
+        histogram.update(score, label)
+    # the same definition on the binned ROC curve
+    assert histogram.eer() == pytest.approx(eer, abs=0.01)
+
+
+def test_histogram_auc(videos):
+    scores, labels = videos
+    histogram = ScoreHistogram(NUM_BINS, (0.0, 1.0), pos_label=1)
+    for score, label in zip(scores, labels):
+        histogram.update(score, label)
+    exact = compute_frame_auc(scores, labels, pos_label=1)
+    assert abs(histogram.auc() - exact) <= histogram.auc_error_bound() + 1e-12
+    # the merged histograms are the same as one histogram of all of the frames
+    merged = ScoreHistogram(NUM_BINS, (0.0, 1.0), pos_label=1)
+    for score, label in zip(scores, labels):
+        part = ScoreHistogram(NUM_BINS, (0.0, 1.0), pos_label=1)
+        part.update(score, label)
+        merged.merge(part)
+    assert merged.auc() == histogram.auc()
+    # one label only
+    single = ScoreHistogram(NUM_BINS, (0.0, 1.0), pos_label=1)
+    single.update(scores[0], np.zeros_like(labels[0]))
+    assert np.isnan(single.auc())
@@ -0,0 +1,37 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The window of the FrameRingBuffer keeps the temporal order of the latest frames.
+"""
+import pytest
+import torch
+from pyanomaly.core.engine.streaming import FrameRingBuffer
+
+CAPACITY = 4
+
+
+def test_window_order():
+    buffer = FrameRingBuffer(CAPACITY)
+    with pytest.raises(AssertionError):
+        buffer.window()
+    for index in range(3 * CAPACITY + 1):
+        # the value of the frame is its index
+        buffer.push(torch.full((2, 3, 3), float(index)))
+        window = buffer.window()
+        first = max(0, index - CAPACITY + 1)
+        assert window.shape == (2, index - first + 1, 3, 3)
+        assert window[0, :, 0, 0].tolist() == [float(i) for i in range(first, index + 1)]
+        assert buffer.full == (index >= CAPACITY - 1)
+    buffer.clear()
+    assert len(buffer) == 0 and not buffer.full
+
+
+def test_shape_change_clears():
+    buffer = FrameRingBuffer(CAPACITY)
+    for index in range(CAPACITY):
+        buffer.push(torch.zeros(1, 4, 4))
+    buffer.push(torch.ones(1, 8, 8))
+    assert len(buffer) == 1
+    assert buffer.window().shape == (1, 1, 8, 8)
@@ -0,0 +1,48 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The exact IncrementalEncoder3D gives the same features as the encoder on each window of the stream.
+"""
+from types import SimpleNamespace
+import pytest
+import torch
+import torch.nn as nn
+from pyanomaly.networks.meta.base.incremental import IncrementalEncoder3D
+from pyanomaly.networks.meta.stae_networks import STAutoEncoderCov3D
+from pyanomaly.networks.meta.memae_networks import AutoEncoderCov3DMem
+
+WINDOW = 8
+NUM_FRAMES = 20
+
+
+def build_encoder(name):
+    torch.manual_seed(0)
+    if name == 'stae':
+        model = STAutoEncoderCov3D(SimpleNamespace(DATASET=SimpleNamespace(channel_num=3)))
+    else:
+        model = AutoEncoderCov3DMem(3, 100)
+    for module in model.encoder:
+        if isinstance(module, nn.BatchNorm3d):
+            # the statistics of a trained model
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 1.5)
+    return model.encoder.eval()
+
+
+@pytest.mark.parametrize('name', ['stae', 'memae'])
+def test_exact_incremental_encoder(name):
+    encoder = build_encoder(name)
+    incremental = IncrementalEncoder3D(encoder, mode='exact')
+    torch.manual_seed(1)
+    frames = torch.rand(1, 3, NUM_FRAMES, 32, 32)
+    with torch.no_grad():
+        for start in range(NUM_FRAMES - WINDOW + 1):
+            window = frames[:, :, start:start + WINDOW]
+            streamed = incremental.stream('s', window, start)
+            assert torch.allclose(streamed, encoder(window), atol=1e-5), start
+    # the slices of the windows before are reused
+    assert 0.0 < incremental.computed_ratio < 1.0
+    incremental.reset_stream('s')
+    assert len(incremental.stream_states) == 0
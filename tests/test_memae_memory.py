@@ -0,0 +1,28 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The chunked matmul addressing of the MemAE memory is the same as the addressing with the repeated tensors.
+"""
+import pytest
+import torch
+from pyanomaly.networks.meta.memae_networks import MemoryModule3D
+
+
+@pytest.mark.parametrize('chunk_size', [0, 7, 64])
+@pytest.mark.parametrize('hard_shrink', [True, False])
+def test_address(chunk_size, hard_shrink):
+    torch.manual_seed(0)
+    memory = MemoryModule3D(mem_dim=50, fea_dim=16, hard_shrink=hard_shrink, chunk_size=chunk_size)
+    # [N, C, D, H, W], N*D*H*W = 96 features
+    z = torch.randn(2, 16, 2, 4, 6, requires_grad=True)
+    chunked, chunked_w = memory.read(z)
+    repeated, repeated_w = memory.read(z, repeat=True)
+    assert torch.allclose(chunked_w, repeated_w, atol=1e-6)
+    assert torch.allclose(chunked, repeated, atol=1e-5)
+    # the gradients are also the same
+    chunked_grad = torch.autograd.grad(chunked.sum(), [z, memory.memory])
+    repeated_grad = torch.autograd.grad(repeated.sum(), [z, memory.memory])
+    for chunked_item, repeated_item in zip(chunked_grad, repeated_grad):
+        assert torch.allclose(chunked_item, repeated_item, atol=1e-4)
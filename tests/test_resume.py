@@ -0,0 +1,100 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The resume of the training.
+The trainer is stopped after a few steps, and the new trainer resumed from the final checkpoint continues from the saved step and the saved position of the data stream.
+"""
+import logging
+from pathlib import Path
+import cv2
+import numpy as np
+import pytest
+import scipy.io as scio
+import torch
+from pyanomaly.config import update_config
+from pyanomaly.utils import system_setup, get_tensorboard
+from pyanomaly.core.engine.checkpoint import load_checkpoint
+from pyanomaly import ModelAPI, LossAPI, OptimizerAPI, SchedulerAPI, EngineAPI, HookAPI, DataAPI, EvaluateAPI
+
+ROOT = Path(__file__).resolve().parents[1]
+CFG_PATH = ROOT / 'configuration' / 'stae' / 'avenue' / 'avenue_default.yaml'
+NUM_FRAMES = 36
+FIRST_STEPS = 3
+MAX_STEPS = 5
+
+
+@pytest.fixture
+def avenue(tmp_path, monkeypatch):
+    # the paths in the config are relative to the project path
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / 'data' / 'Avenue'
+    rs = np.random.RandomState(0)
+    for split, num_videos in [('training', 2), ('testing', 2)]:
+        for video in range(num_videos):
+            video_path = root / split / 'frames' / f'{video + 1:02d}'
+            video_path.mkdir(parents=True)
+            for t in range(NUM_FRAMES):
+                cv2.imwrite(str(video_path / f'{t:04d}.jpg'), rs.randint(0, 255, (32, 32, 3)).astype(np.uint8))
+    gt = np.empty(2, dtype=object)
+    for video in range(2):
+        gt[video] = np.array([[20], [30]])
+    scio.savemat(str(root / 'avenue.mat'), {'gt': gt})
+    return tmp_path
+
+
+class _Args(object):
+    verbose = 'test'
+
+
+def build_trainer(tmp_path, opts):
+    """Build the trainer in the same order as the main.py.
+    """
+    opts = ['SYSTEM.device', 'cpu', 'TRAIN.batch_size', '2', 'TRAIN.eval_step', '1000', 'TRAIN.log_step', '1',
+            'AUGMENT.train.resize.height', '32', 'AUGMENT.train.resize.width', '32',
+            'AUGMENT.val.resize.height', '32', 'AUGMENT.val.resize.width', '32'] + opts
+    cfg = update_config(CFG_PATH, opts)
+    parallel_flag = system_setup(_Args(), cfg)
+    model_dict = ModelAPI(cfg)()
+    loss_function_dict, loss_lamada = LossAPI(cfg)()
+    optimizer_dict = OptimizerAPI(cfg)(model_dict)
+    lr_scheduler_dict = SchedulerAPI(cfg)(optimizer_dict)
+    dataloaders_dict = DataAPI(cfg, True)()
+    evaluate_function = EvaluateAPI(cfg, True)()
+    hooks = HookAPI(cfg)(True)
+    engine = EngineAPI(cfg, True).build()
+    tensorboard_log_dir = tmp_path / 'tensorboard'
+    tensorboard_log_dir.mkdir(exist_ok=True)
+    writer_dict = get_tensorboard(str(tensorboard_log_dir), 'test', cfg.MODEL.name, 'test.log')
+    trainer = engine(model_dict=model_dict, dataloaders_dict=dataloaders_dict, optimizer_dict=optimizer_dict, loss_function_dict=loss_function_dict, logger=logging.getLogger('test_resume'), config=cfg, parallel=parallel_flag,
+                     pretrain=False, verbose=_Args.verbose, time_stamp='test', model_type=cfg.MODEL.name, writer_dict=writer_dict, config_name='avenue_default', loss_lamada=loss_lamada,
+                     hooks=hooks, evaluate_function=evaluate_function, lr_scheduler_dict=lr_scheduler_dict)
+    return cfg, trainer
+
+
+def test_resume_training(avenue):
+    cfg, trainer = build_trainer(avenue, ['TRAIN.max_steps', str(FIRST_STEPS)])
+    trainer.run(cfg.TRAIN.start_step, cfg.TRAIN.max_steps)
+    checkpoints = list(Path(cfg.TRAIN.checkpoint_output).rglob(f'final_step{FIRST_STEPS}*'))
+    assert len(checkpoints) == 1
+    checkpoint = load_checkpoint(str(checkpoints[0]))
+    assert checkpoint['step'] == FIRST_STEPS
+    assert checkpoint['data_stream']['position'] == FIRST_STEPS * cfg.TRAIN.batch_size
+    # the batches used by the uninterrupted training after the saved step
+    next_batches = [trainer.data_stream.__next__() for _ in range(MAX_STEPS - FIRST_STEPS)]
+
+    cfg, resumed = build_trainer(avenue, ['TRAIN.max_steps', str(MAX_STEPS), 'TRAIN.resume.use', 'True', 'TRAIN.resume.checkpoint_path', str(checkpoints[0])])
+    assert resumed.resume_step == FIRST_STEPS
+    assert resumed.data_stream.position == FIRST_STEPS * cfg.TRAIN.batch_size
+    for name, value in resumed.STAE.state_dict().items():
+        assert torch.equal(value, checkpoint['STAE'][name]), name
+    # the stream continues from the next batch without reading the used batches again
+    for expected in next_batches:
+        batch = resumed.data_stream.__next__()
+        assert torch.equal(batch[0], expected[0])
+    resumed.data_stream.load_state_dict(checkpoint['data_stream'])
+
+    resumed.run(cfg.TRAIN.start_step, cfg.TRAIN.max_steps)
+    assert resumed.saved_stuff['step'] == MAX_STEPS
+    assert len(list(Path(cfg.TRAIN.checkpoint_output).rglob(f'final_step{MAX_STEPS}*'))) == 1
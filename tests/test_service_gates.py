@@ -0,0 +1,32 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The adaptive stride and the motion gate of the service decide together whether the model scores a frame.
+"""
+from types import SimpleNamespace
+import numpy as np
+from pyanomaly.core.engine.abstract.base_engine import BaseService
+from pyanomaly.core.engine.adaptive_stride import AdaptiveStride
+from pyanomaly.core.engine.motion_gate import MotionGate
+
+STRIDE = 2
+
+
+def test_stride_counts_only_the_scored_frames():
+    service = SimpleNamespace(adaptive_stride=AdaptiveStride(stride=STRIDE, warmup=100), motion_gate=MotionGate(threshold=0.01, size=8))
+    state = SimpleNamespace(stream_id='s', last_score=None)
+    static = np.zeros((16, 16, 3), dtype=np.uint8)
+    # the first frame is scored, there is no score to carry
+    assert BaseService.check_skip(service, state, static) is None
+    state.last_score = 0.5
+    skips = [BaseService.check_skip(service, state, static) for _ in range(6)]
+    # the stride passes every STRIDE-th frame, and the motion gate skips it
+    assert skips == ['stride', 'motion', 'motion', 'motion', 'motion', 'motion']
+    assert service.adaptive_stride.evaluated_ratio('s') == 1 / 7
+    # the moving frame passes both of the gates, and the stride starts again from it
+    moving = np.full((16, 16, 3), 255, dtype=np.uint8)
+    assert BaseService.check_skip(service, state, moving) is None
+    assert BaseService.check_skip(service, state, moving) == 'stride'
+    assert service.adaptive_stride.evaluated_ratio('s') == 2 / 9
@@ -0,0 +1,28 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The CausalSmoother of the streams gives the same scores as the smooth_scores of the whole video.
+"""
+import numpy as np
+import pytest
+from pyanomaly.datatools.evaluate.smoothing import CausalSmoother, smooth_scores
+
+
+@pytest.mark.parametrize('kernel,lag', [('exponential', 0), ('exponential', 4), ('gaussian', 0), ('gaussian', 6)])
+def test_online_smoother(kernel, lag):
+    scores = np.random.RandomState(0).rand(60)
+    smoother = CausalSmoother(kernel, sigma=2.0, lag=lag, truncate=3.0)
+    online = dict()
+    for score in scores:
+        index, value = smoother.update('s', score)
+        if index is not None:
+            online[index] = value
+    online.update(smoother.flush('s'))
+    assert sorted(online) == list(range(len(scores)))
+    expected = smooth_scores(scores, kernel, sigma=2.0, lag=lag, truncate=3.0)
+    assert np.allclose([online[index] for index in range(len(scores))], expected, atol=1e-10)
+    # the flushed stream starts again from its first frame
+    index, _ = smoother.update('s', scores[0])
+    assert index == (0 if lag == 0 else None)
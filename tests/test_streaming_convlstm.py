@@ -0,0 +1,108 @@
+"""
+@author:  Yuhao Cheng
+@contact: yuhao.cheng[at]outlook.com
+"""
+"""
+The streaming inference of the ConvLSTMs and the PCM of AnoPcn.
+The state of a stream is carried from its first frame, or re-seeded every window, so the re-seeded predictions are the same as the windowed inference once per window.
+"""
+import pytest
+import torch
+from pyanomaly.networks.meta.base import convolution_lstm as base_convolution_lstm
+from pyanomaly.networks.meta.pcn_parts import convolution_lstm as pcn_convolution_lstm
+from pyanomaly.networks.meta.anopcn_networks import AnoPcn, SingleStampConvLSTM, check_streaming
+
+WINDOW = 3
+
+
+@pytest.fixture
+def anopcn():
+    torch.manual_seed(0)
+    return AnoPcn(None).eval()
+
+
+@pytest.fixture
+def video_clip():
+    torch.manual_seed(1)
+    # [N, C, D, H, W], longer than the window
+    return torch.rand(2, 3, 3 * WINDOW, 16, 16)
+
+
+def test_single_stamp_convlstm_stream():
+    torch.manual_seed(0)
+    convlstm = SingleStampConvLSTM(input_channels=4, hidden_channels=[8, 4], kernel_size=3).eval()
+    frames = torch.rand(5, 2, 4, 8, 8)
+    with torch.no_grad():
+        for step, frame in enumerate(frames):
+            windowed, _ = convlstm(frame, step)
+            streamed, _ = convlstm.stream('s', frame)
+            assert torch.allclose(windowed, streamed, atol=1e-6)
+        # the new clip starts from the zero state, and so does the stream after the reset
+        convlstm.reset_stream('s')
+        windowed, _ = convlstm(frames[-1], 0)
+        streamed, _ = convlstm.stream('s', frames[-1])
+        assert torch.allclose(windowed, streamed, atol=1e-6)
+    assert 's' in convlstm.stream_states
+    convlstm.reset_stream()
+    assert len(convlstm.stream_states) == 0
+
+
+@pytest.mark.parametrize('module', [base_convolution_lstm, pcn_convolution_lstm])
+def test_convlstm_stream(module):
+    torch.manual_seed(0)
+    steps = 3
+    convlstm = module.ConvLSTM(input_channels=3, hidden_channels=[8, 4], kernel_size=3, step=steps, effective_step=[steps - 1]).eval()
+    x = torch.rand(1, 3, 8, 8)
+    with torch.no_grad():
+        outputs, (h, c) = convlstm(x)
+        # the forward feeds the same input at each step
+        for _ in range(steps):
+            streamed_h, streamed_c = convlstm.stream('s', x)
+    assert len(outputs) == 1
+    assert torch.allclose(outputs[0], h)
+    assert torch.allclose(h, streamed_h, atol=1e-6)
+    assert torch.allclose(c, streamed_c, atol=1e-6)
+    convlstm.reset_stream('s')
+    assert 's' not in convlstm.stream_states
+
+
+def test_pcm_stream(anopcn, video_clip):
+    assert check_streaming(anopcn.pcm, video_clip) < 1e-5
+
+
+def test_anopcn_stream_predict(anopcn, video_clip):
+    with torch.no_grad():
+        assert anopcn.stream_predict('s', video_clip[:, :, 0]) is None
+        for t in range(1, video_clip.shape[2]):
+            # the prediction of the frame t is made by the frames [0, t)
+            prediction = anopcn.stream_predict('s', video_clip[:, :, t])
+            assert torch.allclose(prediction, anopcn.pcm(video_clip[:, :, :t]), atol=1e-5)
+    anopcn.reset_stream('s')
+    assert anopcn.pcm.stream_prediction('s') is None
+
+
+def test_stream_diverges_after_first_window(anopcn, video_clip):
+    with torch.no_grad():
+        for t in range(video_clip.shape[2]):
+            prediction = anopcn.stream_predict('s', video_clip[:, :, t])
+            if t <= WINDOW:
+                continue
+            # the windowed inference recomputes the window [t - WINDOW, t) from the zero state
+            windowed = anopcn.pcm(video_clip[:, :, t - WINDOW:t])
+            assert not torch.allclose(prediction, windowed, atol=1e-5)
+
+
+def test_stream_reseed(anopcn, video_clip):
+    with torch.no_grad():
+        for t in range(video_clip.shape[2]):
+            prediction = anopcn.stream_predict('s', video_clip[:, :, t], horizon=WINDOW)
+            if t == 0:
+                assert prediction is None
+                continue
+            # the state is re-seeded at the frame k * WINDOW and used from the frame (k + 1) * WINDOW
+            start = max(0, (t // WINDOW - 1) * WINDOW)
+            assert torch.allclose(prediction, anopcn.pcm(video_clip[:, :, start:t]), atol=1e-5)
+            if t % WINDOW == 0:
+                # the same as the windowed inference on [t - WINDOW, t)
+                assert start == t - WINDOW
+    assert anopcn.pcm.stream_states['s'][2] == video_clip.shape[2]